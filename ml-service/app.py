@@ -3,20 +3,114 @@ Flask API for Crop Recommendation System
 Provides ML-powered crop predictions based on soil and climate parameters
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 from flask_cors import CORS
-import joblib
 import numpy as np
-import json
+import hmac
 import os
+import time
+import uuid
 from datetime import datetime
+from drift import MIN_LIVE_COUNT, InputSketch, compare_to_training
+from feedback_log import FEEDBACK_DIR, OUTCOMES, FeedbackLog, RetrainJob
+from metrics import CONTENT_TYPE, MetricsRegistry, StageTimer
+from micro_batcher import MicroBatcher
+from model_registry import ModelRegistry, LEGACY_VERSION, MODELS_DIR, load_bundle
+from prediction_cache import PredictionCache
+from request_log import RequestLog
+from sampling_profiler import SamplingProfiler
+from shadow import ShadowEvaluator, compatibility_error
+from shards import ShardRouter
+from validation import (CATEGORICAL_FIELDS, NUMERICAL_FIELDS, NUMERICAL_RANGES, REQUIRED_FIELDS,
+                        invalid_category_message, parse_record, range_error, validate_columns)
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for React frontend
 
-# Load the trained model
-MODEL_PATH = 'crop_model.pkl'
-FEATURE_NAMES_PATH = 'feature_names.json'
+# Model artifact to serve from: 'pickle', 'mmap' (memory-mapped node arrays written
+# by train_model.py) or 'auto' (mmap when the arrays exist, pickle otherwise)
+MODEL_FORMAT = os.environ.get('MODEL_FORMAT', 'auto')
+
+# Seconds between checks of models/CURRENT for a new version (0 disables watching)
+MODEL_WATCH_INTERVAL = float(os.environ.get('MODEL_WATCH_INTERVAL', '0'))
+
+# Token required by /admin endpoints in the X-Admin-Token header; without one they
+# are disabled (behind a local reverse proxy every caller looks local)
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# Model tiers /predict can answer from: the full model, or the distilled student
+# model (distill_model.py) that trades a little accuracy for latency
+TIERS = ['accurate', 'fast']
+DEFAULT_TIER = 'accurate'
+
+# Largest number of records accepted by /predict/batch in one call
+MAX_BATCH_SIZE = 5000
+
+# /predict/sweep limits: varied fields, values per field, and default grid steps
+# and number of crop curves returned
+MAX_SWEEP_AXES = 2
+MAX_SWEEP_STEPS = 101
+DEFAULT_SWEEP_STEPS = 11
+DEFAULT_SWEEP_CROPS = 5
+
+# /predict/reverse: combinations returned by default and at most
+DEFAULT_REVERSE_RESULTS = 10
+MAX_REVERSE_RESULTS = 100
+
+# Prediction cache: number of entries kept and rounding step for numerical inputs in
+# the key. 0 caches exact inputs only; a step makes nearby inputs share an answer.
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', '10000'))
+PREDICTION_CACHE_RESOLUTION = float(os.environ.get('PREDICTION_CACHE_RESOLUTION', '0'))
+
+# Micro-batching: concurrent /predict calls share one model call of up to
+# MICRO_BATCH_MAX_SIZE rows, waiting at most MICRO_BATCH_MAX_WAIT_US for each other
+MICRO_BATCH_ENABLED = os.environ.get('MICRO_BATCH_ENABLED', '0') == '1'
+MICRO_BATCH_MAX_SIZE = int(os.environ.get('MICRO_BATCH_MAX_SIZE', '32'))
+MICRO_BATCH_MAX_WAIT_US = int(os.environ.get('MICRO_BATCH_MAX_WAIT_US', '500'))
+
+# Answer /predict from the model version's precomputed lookup table (lookup_table.py)
+# when the request falls into a covered cell, and from the model otherwise
+LOOKUP_TABLE_ENABLED = os.environ.get('LOOKUP_TABLE_ENABLED', '0') == '1'
+
+# Structured request log (JSON lines): all errors plus REQUEST_LOG_SAMPLE_RATE of
+# successful requests, written to REQUEST_LOG_FILE (stdout when unset) by a
+# background thread. At most REQUEST_LOG_QUEUE_SIZE records wait; more are dropped.
+REQUEST_LOG_ENABLED = os.environ.get('REQUEST_LOG_ENABLED', '1') == '1'
+REQUEST_LOG_SAMPLE_RATE = float(os.environ.get('REQUEST_LOG_SAMPLE_RATE', '0.1'))
+REQUEST_LOG_QUEUE_SIZE = int(os.environ.get('REQUEST_LOG_QUEUE_SIZE', '10000'))
+REQUEST_LOG_FILE = os.environ.get('REQUEST_LOG_FILE')
+
+# Sketch the inputs of valid /predict and /predict/batch requests for GET /drift
+DRIFT_SKETCH_ENABLED = os.environ.get('DRIFT_SKETCH_ENABLED', '1') == '1'
+
+# Shadow evaluation: score SHADOW_SAMPLE_RATE of /predict rows with this candidate
+# model version too, in a background thread. At most SHADOW_QUEUE_SIZE rows wait;
+# more are dropped. A candidate can also be set with POST /admin/shadow.
+SHADOW_MODEL_VERSION = os.environ.get('SHADOW_MODEL_VERSION')
+SHADOW_SAMPLE_RATE = float(os.environ.get('SHADOW_SAMPLE_RATE', '0.1'))
+SHADOW_QUEUE_SIZE = int(os.environ.get('SHADOW_QUEUE_SIZE', '1000'))
+
+# Answer the accurate tier of /predict and /predict/batch from the model version's
+# per-(state, season) shard models (train_model.py --shards) when the row's shard
+# has one. Shards load on first use; SHARD_CACHE_SIZE stay in memory per worker.
+SHARDS_ENABLED = os.environ.get('SHARDS_ENABLED', '0') == '1'
+SHARD_CACHE_SIZE = int(os.environ.get('SHARD_CACHE_SIZE', '8'))
+
+# Farmer feedback (POST /feedback) appended to the binary log in FEEDBACK_DIR
+# (feedback_log.py). POST /admin/retrain grows extra trees on it in a child
+# process with RETRAIN_NICE lower CPU priority and RETRAIN_JOBS processes.
+# /feedback takes reports from anyone and they end up in the model, so it is
+# off unless the deployment opts in.
+FEEDBACK_LOG_ENABLED = os.environ.get('FEEDBACK_LOG_ENABLED', '0') == '1'
+FEEDBACK_DIR = os.path.abspath(os.environ.get('FEEDBACK_DIR', FEEDBACK_DIR))
+RETRAIN_NICE = int(os.environ.get('RETRAIN_NICE', '10'))
+RETRAIN_JOBS = int(os.environ.get('RETRAIN_JOBS', '1'))
+
+# Most trees one POST /admin/retrain run may grow
+MAX_RETRAIN_TREES = 200
+
+# Longest client supplied X-Request-ID kept; longer or missing ones get a generated ID
+MAX_REQUEST_ID_LENGTH = 128
 
 # Crop metadata (season, yield estimates, profit margins for Indian agriculture)
 CROP_INFO = {
@@ -45,22 +139,386 @@ CROP_INFO = {
     'coffee': {'season': 'Year-round', 'yield': '1200 kg/ha', 'profit': '₹88000/ha'}
 }
 
+prediction_cache = PredictionCache(
+    max_size=PREDICTION_CACHE_SIZE,
+    resolution=PREDICTION_CACHE_RESOLUTION
+)
+
+# Metrics exposed on GET /metrics (Prometheus text format)
+metrics = MetricsRegistry()
+request_counter = metrics.counter(
+    'krishi_ml_requests_total', 'HTTP requests by endpoint and status code', ['endpoint', 'status'])
+request_duration = metrics.histogram(
+    'krishi_ml_request_duration_seconds', 'Time spent handling a request', ['endpoint'])
+stage_duration = metrics.histogram(
+    'krishi_ml_stage_duration_seconds',
+    'Time spent in each stage of a prediction request (parse, validate, inference, serialize)',
+    ['endpoint', 'stage'])
+inference_duration = metrics.histogram(
+    'krishi_ml_model_inference_seconds', 'Time spent in the model itself, per call', ['endpoint'])
+error_counter = metrics.counter(
+    'krishi_ml_request_errors_total', 'Failed prediction requests by error type', ['endpoint', 'error_type'])
+batch_record_error_counter = metrics.counter(
+    'krishi_ml_batch_record_errors_total', 'Rejected /predict/batch records by error type', ['error_type'])
+metrics.collector(
+    'krishi_ml_prediction_cache_events_total', 'Prediction cache lookups by outcome', 'counter', ['outcome'],
+    lambda: [((outcome,), prediction_cache.stats()[outcome])
+             for outcome in ['hits', 'misses', 'coalesced', 'evictions']])
+metrics.collector(
+    'krishi_ml_prediction_cache_entries', 'Predictions currently cached', 'gauge', [],
+    lambda: [((), prediction_cache.stats()['size'])])
+metrics.collector(
+    'krishi_ml_model_info', 'Active model version and artifact format', 'gauge', ['version', 'format'],
+    lambda: [((registry.active.version, registry.active.model_format), 1)] if registry.active else [])
+
+tier_counter = metrics.counter(
+    'krishi_ml_predictions_by_tier_total', '/predict requests by requested and served model tier',
+    ['requested', 'served'])
+lookup_counter = metrics.counter(
+    'krishi_ml_lookup_table_lookups_total', '/predict lookup table lookups by outcome (hit, miss)', ['outcome'])
+
+micro_batch_size = metrics.histogram(
+    'krishi_ml_micro_batch_size', 'Rows scored per micro-batched model call', [],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+
+def record_micro_batch(size, seconds):
+    micro_batch_size.observe(size)
+    inference_duration.observe(seconds, '/predict')
+
+micro_batcher = MicroBatcher(
+    max_batch_size=MICRO_BATCH_MAX_SIZE,
+    max_wait=MICRO_BATCH_MAX_WAIT_US / 1e6,
+    on_batch=record_micro_batch
+) if MICRO_BATCH_ENABLED else None
+
+request_log = RequestLog(
+    sink=open(REQUEST_LOG_FILE, 'a', encoding='utf-8') if REQUEST_LOG_FILE else None,
+    max_queue_size=REQUEST_LOG_QUEUE_SIZE,
+    success_sample_rate=REQUEST_LOG_SAMPLE_RATE
+) if REQUEST_LOG_ENABLED else None
+
+metrics.collector(
+    'krishi_ml_request_log_dropped_total', 'Request log records dropped because the log queue was full',
+    'counter', [], lambda: [((), request_log.stats()['dropped'])] if request_log else [])
+
+# Stack sampling profiler, started and stopped through /admin/profiler
+profiler = SamplingProfiler()
+
+# Live input distribution of this process (drift.py), compared with the training data by GET /drift
+input_sketch = InputSketch() if DRIFT_SKETCH_ENABLED else None
+
+shadow_duration = metrics.histogram(
+    'krishi_ml_shadow_inference_seconds', 'Single-row model time of shadow-scored rows (active, candidate)',
+    ['model'])
+
+def record_shadow_score(active_seconds, candidate_seconds):
+    shadow_duration.observe(active_seconds, 'active')
+    shadow_duration.observe(candidate_seconds, 'candidate')
+
+# Candidate model scored off the request path; idle until a candidate is set
+shadow = ShadowEvaluator(
+    sample_rate=SHADOW_SAMPLE_RATE,
+    max_queue_size=SHADOW_QUEUE_SIZE,
+    on_score=record_shadow_score
+)
+
+metrics.collector(
+    'krishi_ml_shadow_rows_total', 'Rows offered for shadow scoring by outcome', 'counter', ['outcome'],
+    lambda: [((outcome,), shadow.stats()[outcome])
+             for outcome in ['scored', 'sampled_out', 'dropped', 'incompatible', 'errors']])
+metrics.collector(
+    'krishi_ml_shadow_agreement', 'Share of shadow-scored rows where the candidate agrees with the active model',
+    'gauge', ['k'],
+    lambda: [((k,), stats[f'top{k}_agreement']) for stats in [shadow.stats()] for k in ('1', '3')
+             if stats[f'top{k}_agreement'] is not None])
+
+feedback_log = FeedbackLog(FEEDBACK_DIR) if FEEDBACK_LOG_ENABLED else None
+
+def warm_up(bundle):
+    """
+    Run a few predictions on a freshly loaded model before it serves traffic.
+    Touches the single-row and batch paths (and the memory-mapped pages).
+    """
+    rows = []
+    for i in range(8):
+        numerical = [low + (high - low) * (i + 0.5) / 8 for low, high, _ in NUMERICAL_RANGES]
+        categorical = [i % len(bundle.label_encoders[field]) for field in CATEGORICAL_FIELDS]
+        rows.append(numerical + categorical)
+
+    probabilities = bundle.engine.predict_proba(np.array(rows[:1]))
+    probabilities = np.vstack([probabilities, bundle.engine.predict_proba(np.array(rows))])
+    if not np.allclose(probabilities.sum(axis=1), 1.0):
+        raise ValueError(f'Model {bundle.version} returned invalid probabilities during warm-up')
+    if bundle.student_engine is not None:
+        bundle.student_engine.predict_proba(np.array(rows))
+    if bundle.lookup_table is not None:
+        bundle.lookup_table.lookup(rows[0][:len(NUMERICAL_FIELDS)], rows[0][len(NUMERICAL_FIELDS):])
+
+# Process that has a warmed-up model and may take traffic (see /health/ready).
+# A forked server worker inherits this from the preloading master, so it only
+# counts as ready once init_worker() has warmed the model up in its own process.
+ready_pid = None
+
+def activate(bundle):
+    """Called after a new model version becomes active"""
+    global ready_pid
+    # Cached predictions are only valid for the model that produced them
+    prediction_cache.invalidate()
+    ready_pid = os.getpid()
+
+registry = ModelRegistry(
+    models_dir=MODELS_DIR,
+    model_format=MODEL_FORMAT,
+    warm_up=warm_up,
+    on_swap=activate,
+    shard_cache_size=SHARD_CACHE_SIZE
+)
+
+# Load the trained model (models/CURRENT, or crop_model.pkl next to this file)
 try:
-    model = joblib.load(MODEL_PATH)
-    with open(FEATURE_NAMES_PATH, 'r') as f:
-        feature_names = json.load(f)
-    with open('label_encoders.json', 'r') as f:
-        label_encoders = json.load(f)
+    initial_bundle = registry.reload()
     print("✅ Model loaded successfully!")
-    print(f"📋 Features: {feature_names}")
-    print(f"🗺️  States: {len(label_encoders['state'])}")
-    print(f"🌾 Seasons: {label_encoders['season']}")
-    print(f"🏞️  Soil Types: {label_encoders['soil_type']}")
+    print(f"🏷️  Version: {initial_bundle.version}")
+    print(f"🌲 Inference engine: {initial_bundle.engine.n_trees} trees, "
+          f"{initial_bundle.engine.n_nodes} nodes ({initial_bundle.model_format})")
+    print(f"📋 Features: {initial_bundle.feature_names}")
+    print(f"🗺️  States: {len(initial_bundle.label_encoders['state'])}")
+    print(f"🌾 Seasons: {initial_bundle.label_encoders['season']}")
+    print(f"🏞️  Soil Types: {initial_bundle.label_encoders['soil_type']}")
 except Exception as e:
     print(f"❌ Error loading model: {e}")
-    model = None
-    feature_names = None
-    label_encoders = None
+
+registry.watch(MODEL_WATCH_INTERVAL)
+
+def shard_stats():
+    """Shard cache counters of the active version, or None when it serves without shards"""
+    bundle = registry.active
+    if not SHARDS_ENABLED or bundle is None or bundle.shards is None:
+        return None
+    return bundle.shards.stats()
+
+metrics.collector(
+    'krishi_ml_shard_lookups_total', 'Shard model lookups of the active version by result', 'counter', ['result'],
+    lambda: [((result,), stats[result]) for stats in [shard_stats()] if stats
+             for result in ['hits', 'loads', 'fallbacks', 'evictions']])
+metrics.collector(
+    'krishi_ml_shards_loaded', 'Shard models of the active version held in memory', 'gauge', [],
+    lambda: [((), stats['loaded']) for stats in [shard_stats()] if stats])
+
+def load_shadow_candidate(version):
+    """Load and warm up a model version and start shadowing it against the active model"""
+    path = os.path.join(MODELS_DIR, version)
+    if not os.path.isdir(path):
+        raise LookupError(f'Unknown model version: {version}')
+    bundle = load_bundle(path, version, MODEL_FORMAT)
+    warm_up(bundle)
+    active = registry.active
+    error = compatibility_error(active, bundle) if active is not None else None
+    if error is not None:
+        raise ValueError(f'Model {version} cannot score rows encoded for {active.version}: {error}')
+    shadow.set_candidate(bundle)
+    return bundle
+
+if SHADOW_MODEL_VERSION:
+    try:
+        load_shadow_candidate(SHADOW_MODEL_VERSION)
+        print(f"👥 Shadowing candidate model {SHADOW_MODEL_VERSION} on {SHADOW_SAMPLE_RATE:.0%} of /predict requests")
+    except Exception as e:
+        print(f"❌ Error loading shadow model {SHADOW_MODEL_VERSION}: {e}")
+
+def retrain_done(result):
+    """Serve (or shadow) the version a finished retraining run published"""
+    if result['version'] is None:
+        return
+    if result['activated']:
+        registry.reload_in_background(result['version'])
+    else:
+        load_shadow_candidate(result['version'])
+
+# Retraining runs started by POST /admin/retrain from this process
+retrain_job = RetrainJob(os.path.dirname(os.path.abspath(__file__)), FEEDBACK_DIR, on_done=retrain_done)
+
+def init_worker():
+    """
+    Set up a server worker forked from a master that already loaded the model
+    (gunicorn.conf.py). Background threads do not survive fork, so they are
+    started again, and the model is warmed up in this process before the worker
+    reports ready.
+    """
+    global ready_pid
+    registry.watch(MODEL_WATCH_INTERVAL)
+    if micro_batcher is not None:
+        micro_batcher.start()
+    if request_log is not None:
+        request_log.start()
+    shadow.start()
+
+    bundle = registry.active
+    if bundle is None:
+        return False
+    warm_up(bundle)
+    ready_pid = os.getpid()
+    return True
+
+def is_ready():
+    return registry.active is not None and ready_pid == os.getpid()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    request_id = request.headers.get('X-Request-ID')
+    if not request_id or len(request_id) > MAX_REQUEST_ID_LENGTH:
+        request_id = uuid.uuid4().hex
+    g.request_id = request_id
+    g.log_fields = {}
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    request_counter.inc(endpoint, str(response.status_code))
+    started = g.get('request_started')
+    duration = time.perf_counter() - started if started is not None else None
+    if duration is not None:
+        request_duration.observe(duration, endpoint)
+
+    request_id = g.get('request_id')
+    if request_id is not None:
+        response.headers['X-Request-ID'] = request_id
+    if request_log is not None and request_log.should_log(response.status_code >= 400):
+        timer = g.get('stage_timer')
+        record = {
+            'timestamp': datetime.now().isoformat(),
+            'request_id': request_id,
+            'method': request.method,
+            'endpoint': endpoint,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 3) if duration is not None else None
+        }
+        if timer is not None:
+            record['stages_ms'] = {stage: round(seconds * 1000, 3) for stage, seconds in timer.stages.items()}
+        record.update(g.get('log_fields') or {})
+        request_log.log(record)
+    return response
+
+def log_fields(**fields):
+    """Add fields to this request's structured log record"""
+    g.log_fields.update(fields)
+
+def run_model(engine, rows, endpoint):
+    """engine.predict_proba, timed into the model inference histogram"""
+    started = time.perf_counter()
+    probabilities = engine.predict_proba(rows)
+    inference_duration.observe(time.perf_counter() - started, endpoint)
+    return probabilities
+
+def predict_row(engine, row):
+    """Class probabilities for one encoded row, micro-batched with concurrent requests when enabled"""
+    if micro_batcher is not None:
+        return micro_batcher.predict_proba(engine, row)
+    return run_model(engine, np.array([row]), '/predict')[0]
+
+def error_response(endpoint, error_type, message, status):
+    """Count and log a failed request by error type and build its JSON response"""
+    error_counter.inc(endpoint, error_type)
+    log_fields(error_type=error_type, error=message)
+    return jsonify({'success': False, 'error': message}), status
+
+def select_tier(bundle, data):
+    """
+    Requested model tier (query string, then body) and the engine that serves it.
+    Returns (requested_tier, tier, engine), with engine None for an unknown tier.
+    Without a distilled model the fast tier is served by the full model.
+    """
+    requested_tier = request.args.get('tier') or (data.get('tier') if isinstance(data, dict) else None) \
+        or DEFAULT_TIER
+    if requested_tier not in TIERS:
+        return requested_tier, None, None
+    tier = 'fast' if requested_tier == 'fast' and bundle.student_engine is not None else 'accurate'
+    return requested_tier, tier, bundle.student_engine if tier == 'fast' else bundle.engine
+
+def parse_sweep_axis(axis, label_encoders):
+    """
+    One /predict/sweep axis: a numerical field with min/max/steps (default:
+    its whole valid range) or explicit values, or a categorical field with a
+    list of values (default: all of them).
+    Returns (field, values, encoded_values, None) or (None, None, None, (error_type, message)).
+    """
+    if not isinstance(axis, dict) or axis.get('field') not in REQUIRED_FIELDS:
+        return None, None, None, ('invalid_axis', f'Each axis needs a "field", one of: {", ".join(REQUIRED_FIELDS)}')
+    field = axis['field']
+
+    if field in CATEGORICAL_FIELDS:
+        values = axis.get('values', label_encoders[field])
+        if not isinstance(values, list) or not values:
+            return None, None, None, ('invalid_axis', f'"values" for {field} must be a non-empty list')
+        for value in values:
+            if not isinstance(value, str) or value not in label_encoders[field]:
+                return None, None, None, ('invalid_category', invalid_category_message(label_encoders, field))
+        encoded = [label_encoders[field].index(value) for value in values]
+    else:
+        low, high, message = NUMERICAL_RANGES[NUMERICAL_FIELDS.index(field)]
+        try:
+            if 'values' in axis:
+                if not isinstance(axis['values'], list) or not axis['values']:
+                    return None, None, None, ('invalid_axis', f'"values" for {field} must be a non-empty list')
+                values = [float(value) for value in axis['values']]
+            else:
+                steps = int(axis.get('steps', DEFAULT_SWEEP_STEPS))
+                if steps < 1:
+                    return None, None, None, ('invalid_axis', f'"steps" for {field} must be at least 1')
+                start, stop = float(axis.get('min', low)), float(axis.get('max', high))
+                if start > stop:
+                    return None, None, None, ('invalid_axis', f'"min" for {field} must not be greater than "max"')
+                values = np.linspace(start, stop, min(steps, MAX_SWEEP_STEPS + 1)).round(6).tolist()
+        except (ValueError, TypeError) as e:
+            return None, None, None, ('invalid_value', f'Invalid input values. {str(e)}')
+        if not all(low <= value <= high for value in values):
+            return None, None, None, ('out_of_range', message)
+        encoded = values
+
+    if len(values) > MAX_SWEEP_STEPS:
+        return None, None, None, ('too_many_points', f'At most {MAX_SWEEP_STEPS} values per axis')
+    return field, values, encoded, None
+
+def build_prediction(class_names, probabilities):
+    """Build the `prediction` response object from one row of class probabilities"""
+    crop_probabilities = list(zip(class_names, probabilities))
+    crop_probabilities.sort(key=lambda x: x[1], reverse=True)
+
+    # Top prediction
+    top_crop, confidence = crop_probabilities[0]
+
+    # Get crop info
+    crop_data = CROP_INFO.get(top_crop, {
+        'season': 'Unknown',
+        'yield': 'N/A',
+        'profit': 'N/A'
+    })
+
+    # Build alternatives list (top 3)
+    alternatives = []
+    for crop_name, prob in crop_probabilities[1:4]:  # Skip first (it's the main prediction)
+        alt_data = CROP_INFO.get(crop_name, {
+            'season': 'Unknown',
+            'yield': 'N/A',
+            'profit': 'N/A'
+        })
+        alternatives.append({
+            'crop': crop_name.capitalize(),
+            'confidence': round(float(prob), 3),
+            'season': alt_data['season'],
+            'yield': alt_data['yield'],
+            'profit': alt_data['profit']
+        })
+
+    return {
+        'crop': top_crop.capitalize(),
+        'confidence': round(float(confidence), 3),
+        'season': crop_data['season'],
+        'yield_estimate': crop_data['yield'],
+        'profit_margin': crop_data['profit'],
+        'alternatives': alternatives
+    }
 
 @app.route('/', methods=['GET'])
 def home():
@@ -69,7 +527,7 @@ def home():
         'status': 'running',
         'service': 'Krishi Mitra ML Service',
         'version': '1.0.0',
-        'model_loaded': model is not None,
+        'model_loaded': registry.active is not None,
         'timestamp': datetime.now().isoformat()
     })
 
@@ -91,12 +549,14 @@ def predict():
         "season": "Kharif",
         "soil_type": "Clay",
         "irrigation": "Flood",
-        "farm_size": "Medium"
+        "farm_size": "Medium",
+        "tier": "accurate"      // optional, or ?tier=; "fast" uses the distilled model
     }
     
     Returns:
     {
         "success": true,
+        "tier": "accurate",
         "prediction": {
             "crop": "rice",
             "confidence": 0.95,
@@ -105,166 +565,67 @@ def predict():
     }
     """
     try:
-        if model is None:
-            return jsonify({
-                'success': False,
-                'error': 'Model not loaded. Please run train_model.py first.'
-            }), 500
+        # One model version for the whole request, even if a reload swaps it meanwhile
+        timer = g.stage_timer = StageTimer(stage_duration, '/predict')
+        bundle = registry.active
+        if bundle is None:
+            return error_response('/predict', 'model_not_loaded',
+                                  'Model not loaded. Please run train_model.py first.', 500)
+        label_encoders = bundle.label_encoders
         
         # Get JSON data
         data = request.get_json()
-        print(f"📥 Received request: {data}")
-        
-        # Validate required fields
-        required_fields = ['N', 'P', 'K', 'temperature', 'humidity', 'ph', 'rainfall',
-                          'state', 'season', 'soil_type', 'irrigation', 'farm_size']
-        missing_fields = [field for field in required_fields if field not in data]
-        
-        if missing_fields:
-            return jsonify({
-                'success': False,
-                'error': f'Missing required fields: {", ".join(missing_fields)}'
-            }), 400
-        
-        # Extract and validate input values
-        try:
-            # Numerical features
-            numerical_inputs = [
-                float(data['N']),
-                float(data['P']),
-                float(data['K']),
-                float(data['temperature']),
-                float(data['humidity']),
-                float(data['ph']),
-                float(data['rainfall'])
-            ]
-            
-            # Categorical features - encode them
-            state = data['state']
-            season = data['season']
-            soil_type = data['soil_type']
-            irrigation = data['irrigation']
-            farm_size = data['farm_size']
-            
-            # Validate categorical values
-            if state not in label_encoders['state']:
-                return jsonify({
-                    'success': False,
-                    'error': f'Invalid state. Must be one of: {", ".join(label_encoders["state"])}'
-                }), 400
-            
-            if season not in label_encoders['season']:
-                return jsonify({
-                    'success': False,
-                    'error': f'Invalid season. Must be one of: {", ".join(label_encoders["season"])}'
-                }), 400
-            
-            if soil_type not in label_encoders['soil_type']:
-                return jsonify({
-                    'success': False,
-                    'error': f'Invalid soil type. Must be one of: {", ".join(label_encoders["soil_type"])}'
-                }), 400
-                
-            if irrigation not in label_encoders['irrigation']:
-                return jsonify({
-                    'success': False,
-                    'error': f'Invalid irrigation. Must be one of: {", ".join(label_encoders["irrigation"])}'
-                }), 400
-                
-            if farm_size not in label_encoders['farm_size']:
-                return jsonify({
-                    'success': False,
-                    'error': f'Invalid farm size. Must be one of: {", ".join(label_encoders["farm_size"])}'
-                }), 400
-            
-            # Encode categorical features
-            state_encoded = label_encoders['state'].index(state)
-            season_encoded = label_encoders['season'].index(season)
-            soil_type_encoded = label_encoders['soil_type'].index(soil_type)
-            irrigation_encoded = label_encoders['irrigation'].index(irrigation)
-            farm_size_encoded = label_encoders['farm_size'].index(farm_size)
-            
-            # Combine all features in correct order
-            input_values = numerical_inputs + [
-                state_encoded,
-                season_encoded,
-                soil_type_encoded,
-                irrigation_encoded,
-                farm_size_encoded
-            ]
-            
-        except (ValueError, TypeError) as e:
-            return jsonify({
-                'success': False,
-                'error': f'Invalid input values. {str(e)}'
-            }), 400
-        
-        # Validate ranges
-        if not (0 <= input_values[0] <= 140):  # N
-            return jsonify({'success': False, 'error': 'Nitrogen (N) must be between 0-140'}), 400
-        if not (5 <= input_values[1] <= 145):  # P
-            return jsonify({'success': False, 'error': 'Phosphorus (P) must be between 5-145'}), 400
-        if not (5 <= input_values[2] <= 205):  # K
-            return jsonify({'success': False, 'error': 'Potassium (K) must be between 5-205'}), 400
-        if not (8 <= input_values[3] <= 43):  # temperature
-            return jsonify({'success': False, 'error': 'Temperature must be between 8-43°C'}), 400
-        if not (14 <= input_values[4] <= 99):  # humidity
-            return jsonify({'success': False, 'error': 'Humidity must be between 14-99%'}), 400
-        if not (3.5 <= input_values[5] <= 9.9):  # ph
-            return jsonify({'success': False, 'error': 'pH must be between 3.5-9.9'}), 400
-        if not (20 <= input_values[6] <= 300):  # rainfall
-            return jsonify({'success': False, 'error': 'Rainfall must be between 20-300mm'}), 400
-        
-        # Prepare input for model
-        input_array = np.array([input_values])
-        
-        # Get prediction
-        prediction = model.predict(input_array)[0]
-        probabilities = model.predict_proba(input_array)[0]
-        
-        # Get class names and their probabilities
-        class_names = model.classes_
-        crop_probabilities = list(zip(class_names, probabilities))
-        crop_probabilities.sort(key=lambda x: x[1], reverse=True)
-        
-        # Top prediction
-        top_crop = prediction
-        confidence = max(probabilities)
+        timer.mark('parse')
+        log_fields(input=data)
+
+        # Model tier
+        requested_tier, tier, engine = select_tier(bundle, data)
+        if engine is None:
+            return error_response('/predict', 'invalid_tier',
+                                  f'Invalid tier. Must be one of: {", ".join(TIERS)}', 400)
         
-        # Get crop info
-        crop_data = CROP_INFO.get(top_crop, {
-            'season': 'Unknown',
-            'yield': 'N/A',
-            'profit': 'N/A'
-        })
+        # Validate and encode the farm profile
+        numerical_inputs, categorical_encoded, error = parse_record(data, label_encoders)
+        if error is not None:
+            return error_response('/predict', *error, 400)
+        if input_sketch is not None:
+            input_sketch.update(numerical_inputs, [data[field] for field in CATEGORICAL_FIELDS])
+        timer.mark('validate')
+
+        # Specialist model of the farm's (state, season), when the version has one
+        shard_engine = None
+        if SHARDS_ENABLED and tier == 'accurate' and bundle.shards is not None:
+            shard_engine = bundle.shards.engine_for(categorical_encoded)
+            if shard_engine is not None:
+                engine = shard_engine
         
-        # Build alternatives list (top 3)
-        alternatives = []
-        for crop_name, prob in crop_probabilities[1:4]:  # Skip first (it's the main prediction)
-            alt_data = CROP_INFO.get(crop_name, {
-                'season': 'Unknown',
-                'yield': 'N/A',
-                'profit': 'N/A'
-            })
-            alternatives.append({
-                'crop': crop_name.capitalize(),
-                'confidence': round(float(prob), 3),
-                'season': alt_data['season'],
-                'yield': alt_data['yield'],
-                'profit': alt_data['profit']
-            })
+        # Precomputed answer for this input cell, if the table covers it (built from the global model)
+        probabilities = None
+        if LOOKUP_TABLE_ENABLED and tier == 'accurate' and shard_engine is None and bundle.lookup_table is not None:
+            probabilities = bundle.lookup_table.lookup(numerical_inputs, categorical_encoded)
+            lookup_counter.inc('hit' if probabilities is not None else 'miss')
+
+        if probabilities is None:
+            # Get prediction, shared with other requests for the same cache key
+            cache_key = (bundle.version, tier) + prediction_cache.key_part(numerical_inputs) \
+                + tuple(categorical_encoded)
+            probabilities = prediction_cache.get_or_compute(
+                cache_key,
+                lambda: predict_row(engine, numerical_inputs + categorical_encoded)
+            )
+            log_fields(source='model' if shard_engine is None else 'shard')
+        else:
+            log_fields(source='lookup_table')
+        timer.mark('inference')
+        tier_counter.inc(requested_tier, tier)
+        shadow.offer(bundle, numerical_inputs + categorical_encoded)
+        prediction = build_prediction(engine.classes, probabilities)
         
         # Build response
         response = {
             'success': True,
-            'prediction': {
-                'crop': top_crop.capitalize(),
-                'confidence': round(float(confidence), 3),
-                'season': crop_data['season'],
-                'yield_estimate': crop_data['yield'],
-                'profit_margin': crop_data['profit'],
-                'alternatives': alternatives
-            },
+            'tier': tier,
+            'prediction': prediction,
             'input': {
                 'N': numerical_inputs[0],
                 'P': numerical_inputs[1],
@@ -273,42 +634,759 @@ def predict():
                 'humidity': numerical_inputs[4],
                 'ph': numerical_inputs[5],
                 'rainfall': numerical_inputs[6],
-                'state': state,
-                'season': season,
-                'soil_type': soil_type,
-                'irrigation': irrigation,
-                'farm_size': farm_size
+                'state': data['state'],
+                'season': data['season'],
+                'soil_type': data['soil_type'],
+                'irrigation': data['irrigation'],
+                'farm_size': data['farm_size']
             },
             'timestamp': datetime.now().isoformat()
         }
         
-        print(f"✅ Prediction: {top_crop} (confidence: {confidence:.2%})")
-        return jsonify(response)
+        log_fields(model_version=bundle.version, tier=tier, crop=prediction['crop'],
+                   confidence=prediction['confidence'])
+        response = jsonify(response)
+        timer.mark('serialize')
+        return response
         
     except Exception as e:
-        print(f"❌ Error during prediction: {str(e)}")
+        return error_response('/predict', 'internal', f'Prediction failed: {str(e)}', 500)
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    """
+    Predict crop recommendations for many farms in one call
+
+    Expected JSON input (or a bare JSON array of records):
+    {
+        "records": [
+            {"N": 90, "P": 42, ..., "farm_size": "Medium"},
+            ...
+        ]
+    }
+
+    All records are validated and encoded together and scored with a single
+    model call. Invalid records get an error entry instead of failing the batch.
+
+    Returns:
+    {
+        "success": true,
+        "count": 2,
+        "succeeded": 1,
+        "failed": 1,
+        "results": [
+            {"index": 0, "success": true, "prediction": {...}},
+            {"index": 1, "success": false, "error": "pH must be between 3.5-9.9"}
+        ]
+    }
+    """
+    try:
+        # One model version for the whole request, even if a reload swaps it meanwhile
+        timer = g.stage_timer = StageTimer(stage_duration, '/predict/batch')
+        bundle = registry.active
+        if bundle is None:
+            return error_response('/predict/batch', 'model_not_loaded',
+                                  'Model not loaded. Please run train_model.py first.', 500)
+        engine = bundle.engine
+        label_encoders = bundle.label_encoders
+
+        data = request.get_json()
+        timer.mark('parse')
+        records = data.get('records') if isinstance(data, dict) else data
+
+        if not isinstance(records, list) or not records:
+            return error_response('/predict/batch', 'invalid_body',
+                                  'Request body must contain a non-empty "records" array', 400)
+
+        if len(records) > MAX_BATCH_SIZE:
+            return error_response('/predict/batch', 'too_many_records',
+                                  f'Too many records. Maximum batch size is {MAX_BATCH_SIZE}', 400)
+
+        num_records = len(records)
+        errors = [None] * num_records
+        numerical_inputs = np.full((num_records, len(NUMERICAL_FIELDS)), np.nan)
+        categorical_inputs = {field: [None] * num_records for field in CATEGORICAL_FIELDS}
+
+        # Pull the raw values out of each JSON object
+        for i, record in enumerate(records):
+            if not isinstance(record, dict):
+                errors[i] = ('not_an_object', 'Record must be a JSON object')
+                continue
+
+            missing_fields = [field for field in REQUIRED_FIELDS if field not in record]
+            if missing_fields:
+                errors[i] = ('missing_fields', f'Missing required fields: {", ".join(missing_fields)}')
+                continue
+
+            try:
+                numerical_inputs[i] = [float(record[field]) for field in NUMERICAL_FIELDS]
+            except (ValueError, TypeError) as e:
+                errors[i] = ('invalid_value', f'Invalid input values. {str(e)}')
+                continue
+
+            for field in CATEGORICAL_FIELDS:
+                categorical_inputs[field][i] = record[field]
+
+        # Validate and encode all parsed records column by column
+        categorical_encoded, valid = validate_columns(numerical_inputs, categorical_inputs, errors, label_encoders)
+        error_types = {}
+        for error in errors:
+            if error is not None:
+                error_types[error[0]] = error_types.get(error[0], 0) + 1
+        for error_type, count in error_types.items():
+            batch_record_error_counter.inc(error_type, amount=count)
+        if input_sketch is not None:
+            input_sketch.update_many(numerical_inputs[valid], {
+                field: np.asarray(label_encoders[field])[categorical_encoded[valid, j]]
+                for j, field in enumerate(CATEGORICAL_FIELDS)
+            })
+        timer.mark('validate')
+
+        # Score every valid record with one model call
+        valid_indices = np.flatnonzero(valid)
+        predictions = {}
+        if valid_indices.size:
+            input_array = np.hstack([numerical_inputs[valid], categorical_encoded[valid]])
+            if SHARDS_ENABLED and bundle.shards is not None:
+                engine = ShardRouter(bundle.shards, engine)
+            probabilities = run_model(engine, input_array, '/predict/batch')
+            timer.mark('inference')
+            for i, row in zip(valid_indices, probabilities):
+                predictions[i] = build_prediction(engine.classes, row)
+
+        results = []
+        for i in range(num_records):
+            if i in predictions:
+                results.append({'index': i, 'success': True, 'prediction': predictions[i]})
+            else:
+                results.append({'index': i, 'success': False, 'error': errors[i][1]})
+
+        log_fields(model_version=bundle.version, records=num_records, succeeded=len(predictions),
+                   failed=num_records - len(predictions), record_error_types=error_types)
+        response = jsonify({
+            'success': True,
+            'count': num_records,
+            'succeeded': len(predictions),
+            'failed': num_records - len(predictions),
+            'results': results,
+            'timestamp': datetime.now().isoformat()
+        })
+        timer.mark('serialize')
+        return response
+
+    except Exception as e:
+        return error_response('/predict/batch', 'internal', f'Batch prediction failed: {str(e)}', 500)
+
+@app.route('/predict/sweep', methods=['POST'])
+def predict_sweep():
+    """
+    What-if sweep: crop probabilities over a grid of one or two varied inputs
+
+    Expected JSON input:
+    {
+        "base": {"N": 90, "P": 42, ..., "farm_size": "Medium"},
+        "vary": [
+            {"field": "rainfall", "min": 80, "max": 200, "steps": 13},
+            {"field": "irrigation", "values": ["Flood", "Drip"]}
+        ],
+        "crops": ["rice", "maize"],     // optional, default: the `top` most likely crops
+        "top": 5,                       // optional
+        "tier": "accurate"              // optional, as in /predict
+    }
+
+    Varied fields may be left out of "base". The whole grid is scored with one
+    model call. Curves are nested lists shaped like the grid: one entry per
+    value of the first axis, each a list over the second axis.
+
+    Returns:
+    {
+        "success": true,
+        "axes": [{"field": "rainfall", "values": [80.0, ...]}, {"field": "irrigation", "values": [...]}],
+        "points": 26,
+        "curves": [{"crop": "Rice", "max_probability": 0.99, "probabilities": [[0.12, 0.1], ...]}, ...],
+        "top_crop": [["Maize", "Maize"], ...]
+    }
+    """
+    try:
+        timer = g.stage_timer = StageTimer(stage_duration, '/predict/sweep')
+        bundle = registry.active
+        if bundle is None:
+            return error_response('/predict/sweep', 'model_not_loaded',
+                                  'Model not loaded. Please run train_model.py first.', 500)
+        label_encoders = bundle.label_encoders
+
+        data = request.get_json()
+        timer.mark('parse')
+        if not isinstance(data, dict) or not isinstance(data.get('base'), dict):
+            return error_response('/predict/sweep', 'invalid_body',
+                                  'Request body must contain a "base" farm profile object', 400)
+        vary = data.get('vary')
+        vary = [vary] if isinstance(vary, dict) else vary
+        if not isinstance(vary, list) or not 1 <= len(vary) <= MAX_SWEEP_AXES:
+            return error_response('/predict/sweep', 'invalid_body',
+                                  f'"vary" must list 1-{MAX_SWEEP_AXES} fields to vary', 400)
+
+        requested_tier, tier, engine = select_tier(bundle, data)
+        if engine is None:
+            return error_response('/predict/sweep', 'invalid_tier',
+                                  f'Invalid tier. Must be one of: {", ".join(TIERS)}', 400)
+
+        axes = []
+        for axis in vary:
+            field, values, encoded, error = parse_sweep_axis(axis, label_encoders)
+            if error is not None:
+                return error_response('/predict/sweep', *error, 400)
+            if any(field == other for other, _, _ in axes):
+                return error_response('/predict/sweep', 'invalid_axis', f'{field} is varied more than once', 400)
+            axes.append((field, values, encoded))
+
+        # The base profile only needs the fields that are not varied
+        base = dict(data['base'])
+        for field, values, _ in axes:
+            base[field] = values[0]
+        numerical_inputs, categorical_encoded, error = parse_record(base, label_encoders)
+        if error is not None:
+            return error_response('/predict/sweep', *error, 400)
+
+        classes = [str(crop) for crop in engine.classes]
+        crops = data.get('crops')
+        if crops is not None:
+            if not isinstance(crops, list) or not crops or \
+                    not all(isinstance(crop, str) and crop.lower() in classes for crop in crops):
+                return error_response('/predict/sweep', 'invalid_crop',
+                                      f'"crops" must list crops from: {", ".join(classes)}', 400)
+        try:
+            top = int(data.get('top', DEFAULT_SWEEP_CROPS))
+        except (ValueError, TypeError):
+            top = 0
+        if not 1 <= top <= len(classes):
+            return error_response('/predict/sweep', 'invalid_value',
+                                  f'"top" must be between 1-{len(classes)}', 400)
+        timer.mark('validate')
+
+        # One feature row per grid point, the first axis varying slowest
+        shape = [len(values) for _, values, _ in axes]
+        points = int(np.prod(shape))
+        input_array = np.tile(np.array(numerical_inputs + categorical_encoded, dtype=np.float64), (points, 1))
+        grids = np.meshgrid(*[np.asarray(encoded, dtype=np.float64) for _, _, encoded in axes], indexing='ij')
+        for (field, _, _), grid in zip(axes, grids):
+            input_array[:, REQUIRED_FIELDS.index(field)] = grid.ravel()
+
+        probabilities = run_model(engine, input_array, '/predict/sweep')
+        timer.mark('inference')
+
+        if crops is not None:
+            crop_indices = list(dict.fromkeys(classes.index(crop.lower()) for crop in crops))
+        else:
+            crop_indices = np.argsort(-probabilities.max(axis=0), kind='stable')[:top].tolist()
+        names = np.array([crop.capitalize() for crop in classes])
+
+        log_fields(model_version=bundle.version, tier=tier, axes=[field for field, _, _ in axes], points=points)
+        response = jsonify({
+            'success': True,
+            'tier': tier,
+            'axes': [{'field': field, 'values': values} for field, values, _ in axes],
+            'points': points,
+            'curves': [{
+                'crop': names[i],
+                'max_probability': round(float(probabilities[:, i].max()), 4),
+                'probabilities': probabilities[:, i].reshape(shape).round(4).tolist()
+            } for i in crop_indices],
+            'top_crop': names[probabilities.argmax(axis=1)].reshape(shape).tolist(),
+            'timestamp': datetime.now().isoformat()
+        })
+        timer.mark('serialize')
+        return response
+
+    except Exception as e:
+        return error_response('/predict/sweep', 'internal', f'Sweep failed: {str(e)}', 500)
+
+@app.route('/predict/reverse', methods=['POST'])
+def predict_reverse():
+    """
+    Reverse query: which state, season, soil type, irrigation and farm size
+    combinations give a target crop the highest probability for one soil test
+
+    Expected JSON input:
+    {
+        "N": 90, "P": 42, "K": 43, "ph": 6.5,
+        "temperature": 28, "humidity": 80, "rainfall": 200,
+        "crop": "rice",
+        "pin": {"state": "Punjab", "irrigation": ["Drip", "Sprinkler"]},   // optional
+        "top": 10,                                                         // optional
+        "tier": "accurate"                                                 // optional
+    }
+
+    Every combination of the categorical values in the label encoders is
+    scored; pinned fields only keep the given value(s). All combinations are
+    scored together from the trees' reachable leaves (see
+    ForestEngine.predict_proba_product), not one row at a time.
+
+    Returns:
+    {
+        "success": true,
+        "crop": "Rice",
+        "combinations": 4560,
+        "results": [
+            {"state": "Punjab", "season": "Kharif", "soil_type": "Clay", "irrigation": "Flood",
+             "farm_size": "Medium", "probability": 0.995, "top_crop": "Rice"},
+            ...
+        ]
+    }
+    """
+    try:
+        timer = g.stage_timer = StageTimer(stage_duration, '/predict/reverse')
+        bundle = registry.active
+        if bundle is None:
+            return error_response('/predict/reverse', 'model_not_loaded',
+                                  'Model not loaded. Please run train_model.py first.', 500)
+        label_encoders = bundle.label_encoders
+
+        data = request.get_json()
+        timer.mark('parse')
+        if not isinstance(data, dict):
+            return error_response('/predict/reverse', 'invalid_body', 'Request body must be a JSON object', 400)
+
+        requested_tier, tier, engine = select_tier(bundle, data)
+        if engine is None:
+            return error_response('/predict/reverse', 'invalid_tier',
+                                  f'Invalid tier. Must be one of: {", ".join(TIERS)}', 400)
+
+        missing_fields = [field for field in NUMERICAL_FIELDS + ['crop'] if field not in data]
+        if missing_fields:
+            return error_response('/predict/reverse', 'missing_fields',
+                                  f'Missing required fields: {", ".join(missing_fields)}', 400)
+        try:
+            numerical_inputs = [float(data[field]) for field in NUMERICAL_FIELDS]
+        except (ValueError, TypeError) as e:
+            return error_response('/predict/reverse', 'invalid_value', f'Invalid input values. {str(e)}', 400)
+        error = range_error(numerical_inputs)
+        if error is not None:
+            return error_response('/predict/reverse', *error, 400)
+
+        classes = [str(crop) for crop in engine.classes]
+        crop = data['crop']
+        if not isinstance(crop, str) or crop.lower() not in classes:
+            return error_response('/predict/reverse', 'invalid_crop',
+                                  f'Invalid crop. Must be one of: {", ".join(classes)}', 400)
+        crop_index = classes.index(crop.lower())
+
+        try:
+            top = int(data.get('top', DEFAULT_REVERSE_RESULTS))
+        except (ValueError, TypeError):
+            top = 0
+        if not 1 <= top <= MAX_REVERSE_RESULTS:
+            return error_response('/predict/reverse', 'invalid_value',
+                                  f'"top" must be between 1-{MAX_REVERSE_RESULTS}', 400)
+
+        # Codes each categorical field may take: all of them unless pinned
+        pin = data.get('pin') or {}
+        if not isinstance(pin, dict) or any(field not in CATEGORICAL_FIELDS for field in pin):
+            return error_response('/predict/reverse', 'invalid_body',
+                                  f'"pin" must map fields from {", ".join(CATEGORICAL_FIELDS)} to values', 400)
+        allowed = {}
+        for field in CATEGORICAL_FIELDS:
+            values = pin.get(field, label_encoders[field])
+            values = values if isinstance(values, list) else [values]
+            if not values or not all(isinstance(value, str) and value in label_encoders[field] for value in values):
+                return error_response('/predict/reverse', 'invalid_category',
+                                      invalid_category_message(label_encoders, field), 400)
+            allowed[field] = [label_encoders[field].index(value) for value in dict.fromkeys(values)]
+        timer.mark('validate')
+
+        # Fields pinned to one value are fixed like the soil test, the rest span all their codes
+        offset = len(NUMERICAL_FIELDS)
+        fixed = dict(enumerate(numerical_inputs))
+        free = {}
+        for j, field in enumerate(CATEGORICAL_FIELDS):
+            if len(allowed[field]) == 1:
+                fixed[offset + j] = allowed[field][0]
+            else:
+                free[offset + j] = len(label_encoders[field])
+
+        started = time.perf_counter()
+        probabilities = engine.predict_proba_product(fixed, free)
+        inference_duration.observe(time.perf_counter() - started, '/predict/reverse')
+
+        # Keep only the allowed codes of fields pinned to several values
+        free_fields = [CATEGORICAL_FIELDS[index - offset] for index in free]
+        for axis, field in enumerate(free_fields):
+            probabilities = probabilities.take(allowed[field], axis=axis)
+        timer.mark('inference')
+
+        crop_probabilities = probabilities[..., crop_index].ravel()
+        best = np.argsort(-crop_probabilities, kind='stable')[:top]
+        positions = np.unravel_index(best, probabilities.shape[:-1]) if free_fields else ()
+        top_crops = probabilities.reshape(-1, probabilities.shape[-1])[best].argmax(axis=1)
+
+        results = []
+        for rank, index in enumerate(best):
+            combination = {}
+            for field in CATEGORICAL_FIELDS:
+                if field in free_fields:
+                    code = allowed[field][positions[free_fields.index(field)][rank]]
+                else:
+                    code = allowed[field][0]
+                combination[field] = label_encoders[field][code]
+            combination['probability'] = round(float(crop_probabilities[index]), 4)
+            combination['top_crop'] = classes[top_crops[rank]].capitalize()
+            results.append(combination)
+
+        log_fields(model_version=bundle.version, tier=tier, crop=classes[crop_index],
+                   combinations=len(crop_probabilities))
+        response = jsonify({
+            'success': True,
+            'tier': tier,
+            'crop': classes[crop_index].capitalize(),
+            'combinations': len(crop_probabilities),
+            'results': results,
+            'timestamp': datetime.now().isoformat()
+        })
+        timer.mark('serialize')
+        return response
+
+    except Exception as e:
+        return error_response('/predict/reverse', 'internal', f'Reverse query failed: {str(e)}', 500)
+
+@app.route('/feedback', methods=['POST'])
+def feedback():
+    """
+    Record which crop a farmer planted on a farm profile and how it went
+
+    Expected JSON input: the /predict farm profile fields, plus
+    {
+        ...
+        "planted_crop": "rice",
+        "outcome": "good"       // failed, poor, average, good or excellent
+    }
+
+    Returns:
+    {
+        "success": true,
+        "model_version": "20251123-101500"
+    }
+    """
+    try:
+        if feedback_log is None:
+            return error_response('/feedback', 'disabled', 'Feedback logging is disabled', 404)
+        bundle = registry.active
+        if bundle is None:
+            return error_response('/feedback', 'model_not_loaded',
+                                  'Model not loaded. Please run train_model.py first.', 500)
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return error_response('/feedback', 'invalid_body', 'Request body must be a JSON object', 400)
+
+        numerical_inputs, categorical_encoded, error = parse_record(data, bundle.label_encoders)
+        if error is not None:
+            return error_response('/feedback', *error, 400)
+        crops = [str(crop) for crop in bundle.engine.classes]
+        crop = data.get('planted_crop')
+        # /predict returns capitalized crop names; accept them echoed back
+        crop = crop.strip().lower() if isinstance(crop, str) else crop
+        if crop not in crops:
+            return error_response('/feedback', 'invalid_crop',
+                                  f'Invalid planted_crop. Must be one of: {", ".join(crops)}', 400)
+        outcome = data.get('outcome')
+        if outcome not in OUTCOMES:
+            return error_response('/feedback', 'invalid_outcome',
+                                  f'Invalid outcome. Must be one of: {", ".join(OUTCOMES)}', 400)
+
+        feedback_log.append(bundle, numerical_inputs, categorical_encoded, crops.index(crop), OUTCOMES.index(outcome))
+        log_fields(model_version=bundle.version, crop=crop, outcome=outcome)
+        return jsonify({'success': True, 'model_version': bundle.version})
+
+    except Exception as e:
+        return error_response('/feedback', 'internal', f'Recording feedback failed: {str(e)}', 500)
+
+def admin_authorized():
+    """Admin endpoints need the ADMIN_TOKEN header; without a configured token they are off"""
+    if not ADMIN_TOKEN:
+        return False
+    return hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode('utf-8'), ADMIN_TOKEN.encode('utf-8'))
+
+@app.route('/admin/reload', methods=['POST'])
+def admin_reload():
+    """
+    Load a model version in the background and swap it in once it is warm
+
+    Optional JSON input:
+    {
+        "version": "20251123-101500",   // default: the version in models/CURRENT
+        "wait": false                    // true blocks until the swap is done
+    }
+    """
+    if not admin_authorized():
+        return jsonify({'success': False, 'error': 'Not authorized'}), 403
+
+    data = request.get_json(silent=True) or {}
+    version = data.get('version')
+
+    if data.get('wait'):
+        try:
+            bundle = registry.reload(version, blocking=False)
+        except Exception as e:
+            return jsonify({'success': False, 'error': f'Reload failed: {str(e)}'}), 500
+        if bundle is None:
+            return jsonify({'success': False, 'error': 'A reload is already in progress'}), 409
         return jsonify({
-            'success': False,
-            'error': f'Prediction failed: {str(e)}'
-        }), 500
+            'success': True,
+            'status': 'active',
+            'model_version': bundle.version,
+            'model_loaded_at': bundle.loaded_at
+        })
+
+    if not registry.reload_in_background(version):
+        return jsonify({'success': False, 'error': 'A reload is already in progress'}), 409
+    return jsonify({
+        'success': True,
+        'status': 'reloading',
+        'requested_version': version or 'CURRENT'
+    }), 202
+
+@app.route('/admin/profiler', methods=['GET', 'POST'])
+def admin_profiler():
+    """
+    Control the sampling profiler without restarting the service
+
+    POST {"action": "start", "interval_ms": 10} starts sampling (clears old samples)
+    POST {"action": "stop"} stops sampling
+    GET  returns the status, or collapsed stacks with ?format=collapsed&limit=100
+    """
+    if not admin_authorized():
+        return jsonify({'success': False, 'error': 'Not authorized'}), 403
+
+    if request.method == 'GET':
+        if request.args.get('format') == 'collapsed':
+            limit = request.args.get('limit', type=int)
+            return profiler.collapsed(limit), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+        return jsonify({'success': True, 'profiler': profiler.status()})
+
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    if action == 'start':
+        try:
+            interval_ms = float(data.get('interval_ms', 10))
+        except (ValueError, TypeError):
+            interval_ms = 0
+        if not 1 <= interval_ms <= 1000:
+            return jsonify({'success': False, 'error': 'interval_ms must be between 1-1000'}), 400
+        if not profiler.start(interval_ms / 1000):
+            return jsonify({'success': False, 'error': 'Profiler is already running'}), 409
+    elif action == 'stop':
+        if not profiler.stop():
+            return jsonify({'success': False, 'error': 'Profiler is not running'}), 409
+    else:
+        return jsonify({'success': False, 'error': 'action must be "start" or "stop"'}), 400
+    return jsonify({'success': True, 'profiler': profiler.status()})
+
+@app.route('/admin/shadow', methods=['POST'])
+def admin_shadow():
+    """
+    Start shadowing a candidate model version, or stop
+
+    JSON input:
+    {
+        "version": "20251123-101500"    // null stops shadowing
+    }
+    """
+    if not admin_authorized():
+        return jsonify({'success': False, 'error': 'Not authorized'}), 403
+
+    data = request.get_json(silent=True) or {}
+    version = data.get('version')
+    if version is None:
+        shadow.set_candidate(None)
+        return jsonify({'success': True, 'shadow': shadow.stats()})
+    if not isinstance(version, str) or os.sep in version or version.startswith('.'):
+        return jsonify({'success': False, 'error': 'Invalid model version'}), 400
+
+    try:
+        load_shadow_candidate(version)
+    except LookupError as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': f'Loading shadow model failed: {str(e)}'}), 500
+    return jsonify({'success': True, 'shadow': shadow.stats()})
+
+@app.route('/admin/retrain', methods=['GET', 'POST'])
+def admin_retrain():
+    """
+    Grow extra trees on the active model from the feedback log (retrain_feedback.py)
+    in a child process, then serve the new version
+
+    Optional JSON input:
+    {
+        "extra_trees": 20,
+        "min_outcome": "good",
+        "activate": true        // false publishes it and shadows it instead
+    }
+
+    GET returns the state and result of the last run started by this process.
+    """
+    if not admin_authorized():
+        return jsonify({'success': False, 'error': 'Not authorized'}), 403
+    if request.method == 'GET':
+        return jsonify({'success': True, 'retrain': retrain_job.status()})
+
+    bundle = registry.active
+    if bundle is None or bundle.version == LEGACY_VERSION:
+        return jsonify({'success': False, 'error': 'Retraining needs a model version published under models/'}), 409
+    data = request.get_json(silent=True) or {}
+    extra_trees = data.get('extra_trees', 20)
+    if not isinstance(extra_trees, int) or not 1 <= extra_trees <= MAX_RETRAIN_TREES:
+        return jsonify({'success': False, 'error': f'extra_trees must be between 1-{MAX_RETRAIN_TREES}'}), 400
+    min_outcome = data.get('min_outcome', 'good')
+    if min_outcome not in OUTCOMES:
+        return jsonify({'success': False, 'error': f'min_outcome must be one of: {", ".join(OUTCOMES)}'}), 400
+
+    arguments = ['--version', bundle.version, '--extra-trees', str(extra_trees), '--min-outcome', min_outcome,
+                 '--jobs', str(RETRAIN_JOBS), '--nice', str(RETRAIN_NICE)]
+    if not data.get('activate', True):
+        arguments.append('--no-activate')
+    if not retrain_job.start(arguments):
+        return jsonify({'success': False, 'error': 'A retraining run is already in progress'}), 409
+    return jsonify({'success': True, 'retrain': retrain_job.status()}), 202
+
+@app.route('/shadow', methods=['GET'])
+def shadow_report():
+    """Agreement and latency of the shadowed candidate model against the active model in this process"""
+    return jsonify({
+        'success': True,
+        'pid': os.getpid(),
+        'shadow': shadow.stats(),
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/admin/drift/reset', methods=['POST'])
+def admin_drift_reset():
+    """Start a new live input sketch, e.g. after a data source was fixed"""
+    if not admin_authorized():
+        return jsonify({'success': False, 'error': 'Not authorized'}), 403
+    if input_sketch is None:
+        return jsonify({'success': False, 'error': 'Drift sketches are disabled'}), 404
+    input_sketch.reset()
+    return jsonify({'success': True, 'since': input_sketch.since})
+
+@app.route('/drift', methods=['GET'])
+def drift():
+    """
+    Live input distribution of this process since startup (or the last reset)
+    compared with the training inputs of the active model version
+
+    Per feature: population stability index (psi), the share of live inputs
+    where the training data had none, approximate live and training mean and
+    quantiles (numerical) or value shares (categorical), and a status.
+    ?histograms=1 adds the raw sketches.
+    """
+    if input_sketch is None:
+        return jsonify({'success': False, 'error': 'Drift sketches are disabled'}), 404
+    bundle = registry.active
+    live = input_sketch.to_dict()
+    training = bundle.training_profile if bundle else None
+
+    response = {
+        'success': True,
+        'pid': os.getpid(),
+        'model_version': bundle.version if bundle else None,
+        'since': live['since'],
+        'live_count': live['count'],
+        'min_live_count': MIN_LIVE_COUNT,
+        'training_count': training['count'] if training else None
+    }
+    if training is None:
+        response.update(status='no_training_profile', numerical=None, categorical=None)
+    else:
+        try:
+            comparison = compare_to_training(live, training)
+        except (KeyError, ValueError) as e:
+            return jsonify({'success': False, 'error': f'Training profile cannot be compared: {str(e)}'}), 500
+        statuses = [entry['status'] for group in comparison.values() for entry in group.values()]
+        response['status'] = next(
+            (status for status in ['insufficient_data', 'drifted', 'shifting'] if status in statuses), 'stable')
+        response.update(comparison)
+    if request.args.get('histograms') == '1':
+        response['histograms'] = {'live': live, 'training': training}
+    response['timestamp'] = datetime.now().isoformat()
+    return jsonify(response)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Request, stage, error and model inference metrics in Prometheus text format"""
+    return metrics.render(), 200, {'Content-Type': CONTENT_TYPE}
+
+@app.route('/health/live', methods=['GET'])
+def health_live():
+    """Liveness: the process is up and answering requests"""
+    return jsonify({'status': 'alive', 'pid': os.getpid()})
+
+@app.route('/health/ready', methods=['GET'])
+def health_ready():
+    """Readiness: a model is loaded and warmed up in this process (503 until then)"""
+    bundle = registry.active
+    ready = is_ready()
+    return jsonify({
+        'status': 'ready' if ready else 'not_ready',
+        'ready': ready,
+        'pid': os.getpid(),
+        'model_version': bundle.version if bundle else None
+    }), 200 if ready else 503
 
 @app.route('/health', methods=['GET'])
 def health():
     """Detailed health check"""
+    bundle = registry.active
     return jsonify({
         'status': 'healthy',
-        'model_loaded': model is not None,
-        'model_path': MODEL_PATH,
-        'model_exists': os.path.exists(MODEL_PATH),
-        'features': feature_names if feature_names else [],
-        'num_features': len(feature_names) if feature_names else 0,
+        'live': True,
+        'ready': is_ready(),
+        'pid': os.getpid(),
+        'model_loaded': bundle is not None,
+        'model_version': bundle.version if bundle else None,
+        'model_loaded_at': bundle.loaded_at if bundle else None,
+        'model_path': bundle.path if bundle else None,
+        'model_format': bundle.model_format if bundle else None,
+        'reload_in_progress': registry.reloading,
+        'last_reload_error': registry.last_error,
+        'features': bundle.feature_names if bundle else [],
+        'num_features': len(bundle.feature_names) if bundle else 0,
+        'prediction_cache': prediction_cache.stats(),
+        'micro_batching': micro_batcher.stats() if micro_batcher else {'enabled': False},
+        'fast_tier_available': bundle is not None and bundle.student_engine is not None,
+        'lookup_table': {
+            'enabled': LOOKUP_TABLE_ENABLED,
+            'loaded': bundle is not None and bundle.lookup_table is not None,
+            'cells': bundle.lookup_table.n_cells if bundle and bundle.lookup_table else 0,
+            'bytes': bundle.lookup_table.nbytes if bundle and bundle.lookup_table else 0,
+            'coverage': bundle.lookup_table.report.get('coverage') if bundle and bundle.lookup_table else None,
+            'top1_agreement': bundle.lookup_table.report.get('top1_agreement')
+            if bundle and bundle.lookup_table else None
+        },
+        'request_log': request_log.stats() if request_log else {'enabled': False},
+        'drift_sketch': {
+            'enabled': input_sketch is not None,
+            'live_count': input_sketch.count if input_sketch else 0,
+            'training_profile': bundle is not None and bundle.training_profile is not None
+        },
+        'shadow': {
+            'candidate_version': shadow.candidate.version if shadow.candidate else None,
+            'scored': shadow.scored,
+            'dropped': shadow.dropped
+        },
+        'shards': dict(shard_stats() or {}, enabled=SHARDS_ENABLED,
+                       available=bundle is not None and bundle.shards is not None),
+        'feedback_log': feedback_log.stats() if feedback_log else {'enabled': False},
+        'retrain_state': retrain_job.state,
         'timestamp': datetime.now().isoformat()
     })
 
 if __name__ == '__main__':
     print("🌾 Krishi Mitra ML Service")
     print("=" * 50)
-    print(f"Model loaded: {model is not None}")
+    print(f"Model loaded: {registry.active is not None}")
     print(f"Listening on: http://localhost:5001")
+    print("Development server only; use `gunicorn -c gunicorn.conf.py` in production")
     print("=" * 50)
     app.run(host='0.0.0.0', port=5001, debug=True)
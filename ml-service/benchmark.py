@@ -0,0 +1,432 @@
+"""
+Reproducible load benchmark for the ML service
+
+Runs the same request mix against two targets:
+- inprocess: app.py imported in a child process and driven through Flask's test client
+- server:    app.py started as a local HTTP server and driven over sockets
+
+Payloads are drawn from the same distributions as crop_patterns in
+train_model.py, with a configurable share of invalid requests (missing
+fields, non-numeric values, out-of-range values, unknown categories). The
+same seed always produces the same payloads. Results are written as JSON
+together with the git commit, so two runs can be compared side by side.
+
+Usage:
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --targets inprocess --requests 5000
+    python benchmark.py --compare before.json after.json
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from metrics import peak_rss_mb
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULT_PREFIX = 'BENCHMARK_RESULT '
+BENCHMARK_FORMAT_VERSION = 1
+
+# Payload keys for the crop_patterns entries
+NUMERICAL_PAYLOAD_KEYS = {'N': 'N', 'P': 'P', 'K': 'K', 'temperature': 'temp',
+                          'humidity': 'humidity', 'ph': 'ph', 'rainfall': 'rainfall'}
+CATEGORICAL_PAYLOAD_KEYS = {'state': 'states', 'season': 'seasons', 'soil_type': 'soil_types',
+                            'irrigation': 'irrigation', 'farm_size': 'farm_sizes'}
+INVALID_KINDS = ['missing_field', 'not_a_number', 'out_of_range', 'unknown_category']
+
+WARMUP_REQUESTS = 50
+SERVER_START_TIMEOUT = 120
+
+
+def generate_payloads(count, invalid_fraction=0.1, seed=42):
+    """
+    `count` /predict payloads drawn from crop_patterns. Returns a list of
+    (payload, expected_status) pairs.
+    """
+    from train_model import CLIP_RANGES, crop_patterns
+
+    rng = np.random.default_rng(seed)
+    crops = list(crop_patterns)
+    weights = np.array([crop_patterns[crop]['count'] for crop in crops], dtype=float)
+    crop_choices = rng.choice(len(crops), size=count, p=weights / weights.sum())
+
+    payloads = []
+    for crop_index in crop_choices:
+        pattern = crop_patterns[crops[crop_index]]
+        payload = {}
+        for field, key in NUMERICAL_PAYLOAD_KEYS.items():
+            low, high = CLIP_RANGES[field]
+            payload[field] = round(float(np.clip(rng.uniform(*pattern[key]), low, high)), 2)
+        for field, key in CATEGORICAL_PAYLOAD_KEYS.items():
+            payload[field] = str(rng.choice(pattern[key]))
+
+        if rng.random() >= invalid_fraction:
+            payloads.append((payload, 200))
+            continue
+
+        kind = INVALID_KINDS[rng.integers(len(INVALID_KINDS))]
+        numerical_field = list(NUMERICAL_PAYLOAD_KEYS)[rng.integers(len(NUMERICAL_PAYLOAD_KEYS))]
+        if kind == 'missing_field':
+            del payload[list(payload)[rng.integers(len(payload))]]
+        elif kind == 'not_a_number':
+            payload[numerical_field] = 'unknown'
+        elif kind == 'out_of_range':
+            payload[numerical_field] = CLIP_RANGES[numerical_field][1] + 50
+        else:
+            payload[list(CATEGORICAL_PAYLOAD_KEYS)[rng.integers(len(CATEGORICAL_PAYLOAD_KEYS))]] = 'Atlantis'
+        payloads.append((payload, 400))
+    return payloads
+
+
+def summarize_latencies(latencies, statuses, expected, duration):
+    """Throughput, latency percentiles and status counts of one scenario"""
+    latencies_ms = np.array(latencies) * 1000
+    status_counts = {}
+    for status in statuses:
+        status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+    return {
+        'requests': len(latencies),
+        'duration_seconds': duration,
+        'throughput_rps': len(latencies) / duration if duration else None,
+        'mean_ms': float(latencies_ms.mean()),
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p95_ms': float(np.percentile(latencies_ms, 95)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+        'max_ms': float(latencies_ms.max()),
+        'status_counts': status_counts,
+        'unexpected_status': int(sum(status != want for status, want in zip(statuses, expected)))
+    }
+
+
+def run_scenario(make_sender, requests, concurrency):
+    """
+    Send (path, payload, expected_status) requests from `concurrency` threads.
+    make_sender() is called once per thread and returns send(path, payload) -> status.
+    """
+    latencies = [0.0] * len(requests)
+    statuses = [0] * len(requests)
+    next_index = iter(range(len(requests)))
+    index_lock = threading.Lock()
+
+    def worker():
+        send = make_sender()
+        while True:
+            with index_lock:
+                i = next(next_index, None)
+            if i is None:
+                return
+            path, payload, _ = requests[i]
+            start = time.perf_counter()
+            statuses[i] = send(path, payload)
+            latencies[i] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+
+    return summarize_latencies(latencies, statuses, [want for _, _, want in requests], duration)
+
+
+def build_scenarios(payloads, settings):
+    """
+    Request lists for each scenario. The single and concurrent scenarios use
+    different payloads, so the second one does not just hit the prediction cache.
+    """
+    n = settings['requests']
+    single = [('/predict', payload, status) for payload, status in payloads[:n]]
+    concurrent = [('/predict', payload, status) for payload, status in payloads[n:2 * n]]
+    batches = []
+    batch_size = settings['batch_size']
+    for b in range(settings['batch_requests']):
+        records = [payload for payload, _ in payloads[b * batch_size:(b + 1) * batch_size]]
+        batches.append(('/predict/batch', {'records': records}, 200))
+    return {
+        'single': (single, 1),
+        'concurrent': (concurrent, settings['concurrency']),
+        'batch': (batches, 1)
+    }
+
+
+def run_scenarios(make_sender, payloads, settings):
+    """Warm up, then run every scenario against one target"""
+    warmup = [('/predict', payload, status) for payload, status in payloads[-WARMUP_REQUESTS:]]
+    run_scenario(make_sender, warmup, 1)
+
+    results = {}
+    for name, (requests, concurrency) in build_scenarios(payloads, settings).items():
+        print(f"  ▶ {name}: {len(requests)} requests, concurrency {concurrency}", file=sys.stderr)
+        results[name] = run_scenario(make_sender, requests, concurrency)
+        results[name]['concurrency'] = concurrency
+    return results
+
+
+def run_inprocess_worker(payload_file, settings):
+    """Child process: import app, drive it through the test client and report"""
+    with open(payload_file, 'r') as f:
+        payloads = [tuple(item) for item in json.load(f)]
+
+    start = time.perf_counter()
+    import app
+    load_seconds = time.perf_counter() - start
+
+    def make_sender():
+        client = app.app.test_client()
+
+        def send(path, payload):
+            return client.post(path, json=payload).status_code
+        return send
+
+    scenarios = run_scenarios(make_sender, payloads, settings)
+    health = app.app.test_client().get('/health').get_json()
+    result = {
+        'model_load_seconds': load_seconds,
+        'model_version': health['model_version'],
+        'model_format': health['model_format'],
+        'prediction_cache': health['prediction_cache'],
+        'micro_batching': health.get('micro_batching'),
+        'peak_rss_mb': peak_rss_mb(),
+        'scenarios': scenarios
+    }
+    print(RESULT_PREFIX + json.dumps(result), flush=True)
+
+
+def run_inprocess(payload_file, settings):
+    """Run the in-process target in a fresh interpreter so its memory is its own"""
+    process = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--worker', payload_file,
+         '--settings', json.dumps(settings)],
+        cwd=SERVICE_DIR, stdout=subprocess.PIPE, text=True
+    )
+    for line in process.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise SystemExit(f'In-process benchmark failed (exit code {process.returncode})')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def http_sender(host, port):
+    """Factory for send(path, payload) over one keep-alive connection per thread"""
+    def make_sender():
+        connection = http.client.HTTPConnection(host, port, timeout=60)
+
+        def send(path, payload):
+            nonlocal connection
+            body = json.dumps(payload)
+            for attempt in range(2):
+                try:
+                    connection.request('POST', path, body=body, headers={'Content-Type': 'application/json'})
+                    response = connection.getresponse()
+                    response.read()
+                    if response.getheader('Connection', '').lower() == 'close' or response.version == 10:
+                        connection.close()
+                    return response.status
+                except (http.client.HTTPException, ConnectionError):
+                    # The server closed the connection, reconnect once
+                    connection.close()
+                    connection = http.client.HTTPConnection(host, port, timeout=60)
+                    if attempt:
+                        raise
+        return send
+    return make_sender
+
+
+def get_json(host, port, path):
+    connection = http.client.HTTPConnection(host, port, timeout=5)
+    try:
+        connection.request('GET', path)
+        return json.loads(connection.getresponse().read())
+    finally:
+        connection.close()
+
+
+def run_server(payloads, settings):
+    """Start app.py as a local HTTP server, wait for the model and drive it over sockets"""
+    port = free_port()
+    command = [sys.executable, '-c',
+               f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    start = time.perf_counter()
+    server = subprocess.Popen(command, cwd=SERVICE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if server.poll() is not None:
+                raise SystemExit(f'Server exited during startup (exit code {server.returncode})')
+            if time.perf_counter() - start > SERVER_START_TIMEOUT:
+                raise SystemExit('Server did not become ready in time')
+            try:
+                if get_json('127.0.0.1', port, '/health')['model_loaded']:
+                    break
+            except (OSError, ValueError):
+                pass
+            time.sleep(0.05)
+        load_seconds = time.perf_counter() - start
+
+        scenarios = run_scenarios(http_sender('127.0.0.1', port), payloads, settings)
+        health = get_json('127.0.0.1', port, '/health')
+        return {
+            'model_load_seconds': load_seconds,
+            'model_version': health['model_version'],
+            'model_format': health['model_format'],
+            'prediction_cache': health['prediction_cache'],
+            'micro_batching': health.get('micro_batching'),
+            'peak_rss_mb': peak_rss_mb(server.pid),
+            'scenarios': scenarios
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def git_revision():
+    """Commit the service was benchmarked at, and whether the tree had local changes"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SERVICE_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--', '.'], cwd=SERVICE_DIR,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def print_results(results):
+    print(f"\n{'Target':<10} {'Scenario':<11} {'Requests':>8} {'RPS':>9} {'p50 (ms)':>9} {'p95 (ms)':>9} "
+          f"{'p99 (ms)':>9} {'Unexpected':>10}")
+    for target, target_results in results['targets'].items():
+        for name, s in target_results['scenarios'].items():
+            print(f"{target:<10} {name:<11} {s['requests']:>8} {s['throughput_rps']:>9.1f} {s['p50_ms']:>9.2f} "
+                  f"{s['p95_ms']:>9.2f} {s['p99_ms']:>9.2f} {s['unexpected_status']:>10}")
+        print(f"{target:<10} model load {target_results['model_load_seconds']:.2f}s, "
+              f"peak RSS {target_results['peak_rss_mb']:.1f} MB")
+
+
+def compare(base_file, new_file):
+    """Print two benchmark result files side by side"""
+    with open(base_file, 'r') as f:
+        base = json.load(f)
+    with open(new_file, 'r') as f:
+        new = json.load(f)
+
+    print(f"Base: {base_file} ({(base.get('git_commit') or 'unknown')[:10]})")
+    print(f"New:  {new_file} ({(new.get('git_commit') or 'unknown')[:10]})")
+    if base.get('settings') != new.get('settings'):
+        print("⚠️  The two runs used different settings")
+
+    print(f"\n{'Target':<10} {'Metric':<24} {'Base':>10} {'New':>10} {'Change':>9}")
+    for target in base['targets']:
+        if target not in new['targets']:
+            continue
+        b, n = base['targets'][target], new['targets'][target]
+        rows = [('model_load_seconds', b['model_load_seconds'], n['model_load_seconds']),
+                ('peak_rss_mb', b['peak_rss_mb'], n['peak_rss_mb'])]
+        for name in b['scenarios']:
+            if name not in n['scenarios']:
+                continue
+            for metric in ['throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms']:
+                rows.append((f'{name}.{metric}', b['scenarios'][name][metric], n['scenarios'][name][metric]))
+        for metric, before, after in rows:
+            if before is None or after is None:
+                continue
+            change = f'{(after - before) / before * 100:+.1f}%' if before else 'n/a'
+            print(f"{target:<10} {metric:<24} {before:>10.2f} {after:>10.2f} {change:>9}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the ML service in-process and over HTTP')
+    parser.add_argument('--targets', default='inprocess,server', help='comma separated: inprocess,server')
+    parser.add_argument('--requests', type=int, default=2000, help='/predict requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='threads in the concurrent scenario')
+    parser.add_argument('--batch-requests', type=int, default=20, help='/predict/batch requests')
+    parser.add_argument('--batch-size', type=int, default=100, help='records per /predict/batch request')
+    parser.add_argument('--invalid-fraction', type=float, default=0.1, help='share of invalid payloads')
+    parser.add_argument('--seed', type=int, default=42, help='payload seed')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='compare two result files')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--settings', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.worker:
+        run_inprocess_worker(args.worker, json.loads(args.settings))
+        return
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    settings = {
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'batch_requests': args.batch_requests,
+        'batch_size': args.batch_size,
+        'invalid_fraction': args.invalid_fraction,
+        'seed': args.seed
+    }
+    count = max(2 * args.requests, args.batch_requests * args.batch_size) + WARMUP_REQUESTS
+    payloads = generate_payloads(count, args.invalid_fraction, args.seed)
+
+    commit, dirty = git_revision()
+    results = {
+        'benchmark_format': BENCHMARK_FORMAT_VERSION,
+        'created_at': datetime.now().isoformat(),
+        'git_commit': commit,
+        'git_dirty': dirty,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'environment': {name: os.environ[name] for name in
+                        ['MODEL_FORMAT', 'PREDICTION_CACHE_SIZE', 'PREDICTION_CACHE_RESOLUTION',
+                         'MICRO_BATCH_ENABLED', 'MICRO_BATCH_MAX_SIZE', 'MICRO_BATCH_MAX_WAIT_US',
+                         'REQUEST_LOG_ENABLED', 'REQUEST_LOG_SAMPLE_RATE', 'REQUEST_LOG_QUEUE_SIZE',
+                         'LOOKUP_TABLE_ENABLED']
+                        if name in os.environ},
+        'settings': settings,
+        'targets': {}
+    }
+
+    for target in args.targets.split(','):
+        print(f"⏱️  Benchmarking {target}...")
+        if target == 'inprocess':
+            with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+                json.dump(payloads, f)
+            try:
+                results['targets'][target] = run_inprocess(f.name, settings)
+            finally:
+                os.remove(f.name)
+        elif target == 'server':
+            results['targets'][target] = run_server(payloads, settings)
+        else:
+            raise SystemExit(f'Unknown target: {target}')
+
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Results saved to '{args.output}'")
+
+
+if __name__ == '__main__':
+    main()
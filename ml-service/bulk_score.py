@@ -0,0 +1,301 @@
+"""
+Offline bulk scoring of farm registries
+
+    python bulk_score.py farms.csv scored.csv
+    python bulk_score.py farms.parquet scored.parquet --workers 4 --chunk-size 50000
+    python bulk_score.py farms.csv scored.csv --version 20251123-101500 --tier fast
+
+The input is read in chunks of --chunk-size rows and each chunk is validated,
+encoded and scored in a worker process with the same rules and model as
+POST /predict/batch (validation.py, models/CURRENT). At most two chunks per
+worker are in flight and results are written in input order, so memory stays
+bounded by the chunk size whatever the size of the file.
+
+The output has every input column followed by the top crops and their
+probabilities, plus `error_type` and `error` columns for rows that failed
+validation (their crop columns are empty). Parquet files need pyarrow.
+"""
+
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from metrics import peak_rss_mb
+from model_registry import LEGACY_VERSION, MODELS_DIR, ModelRegistry
+from validation import CATEGORICAL_FIELDS, NUMERICAL_FIELDS, REQUIRED_FIELDS, validate_columns
+
+DEFAULT_CHUNK_SIZE = 50000
+
+# Chunks queued or being scored per worker process
+CHUNKS_IN_FLIGHT_PER_WORKER = 2
+
+# Seconds between progress lines
+PROGRESS_INTERVAL = 2.0
+
+# Crops and probabilities written per row
+DEFAULT_TOP_CROPS = 3
+
+# Model state of a scoring process, set by init_scorer
+_engine = None
+_label_encoders = None
+_top_crops = DEFAULT_TOP_CROPS
+
+
+def load_model(version, tier, model_format='auto', models_dir=MODELS_DIR):
+    """Load a model version (default: models/CURRENT) and pick the engine for `tier`"""
+    bundle = ModelRegistry(models_dir=models_dir, model_format=model_format).reload(version)
+    engine = bundle.student_engine if tier == 'fast' and bundle.student_engine is not None else bundle.engine
+    return bundle, engine
+
+
+def init_scorer(version, tier, model_format, models_dir, top_crops):
+    """Process pool initializer: every worker loads the model once"""
+    global _engine, _label_encoders, _top_crops
+    bundle, _engine = load_model(version, tier, model_format, models_dir)
+    _label_encoders = bundle.label_encoders
+    _top_crops = top_crops
+
+
+def crop_columns(top_crops):
+    """(crop, confidence) column names per rank: crop, confidence, crop_2, confidence_2, ..."""
+    suffixes = [''] + [f'_{rank}' for rank in range(2, top_crops + 1)]
+    return [(f'crop{suffix}', f'confidence{suffix}') for suffix in suffixes]
+
+
+def result_columns(top_crops):
+    return [column for pair in crop_columns(top_crops) for column in pair] + ['error_type', 'error']
+
+
+def score_chunk(chunk):
+    """
+    Validate and score one chunk of raw input rows (REQUIRED_FIELDS columns).
+    Returns a DataFrame of result_columns() with the chunk's index.
+    """
+    num_records = len(chunk)
+    errors = [None] * num_records
+
+    # Empty cells count as missing fields
+    missing = chunk[REQUIRED_FIELDS].isna().to_numpy()
+    for i in np.flatnonzero(missing.any(axis=1)):
+        missing_fields = [field for field, is_missing in zip(REQUIRED_FIELDS, missing[i]) if is_missing]
+        errors[i] = ('missing_fields', f'Missing required fields: {", ".join(missing_fields)}')
+
+    # Numerical values that do not parse get float()'s message, like /predict
+    numerical_inputs = np.full((num_records, len(NUMERICAL_FIELDS)), np.nan)
+    for j, field in enumerate(NUMERICAL_FIELDS):
+        numerical_inputs[:, j] = pd.to_numeric(chunk[field], errors='coerce').to_numpy(dtype=np.float64)
+        raw = chunk[field].to_numpy()
+        for i in np.flatnonzero(np.isnan(numerical_inputs[:, j]) & ~missing[:, j]):
+            if errors[i] is None:
+                try:
+                    numerical_inputs[i, j] = float(raw[i])
+                except (ValueError, TypeError) as e:
+                    errors[i] = ('invalid_value', f'Invalid input values. {str(e)}')
+
+    categorical_inputs = {field: chunk[field].to_numpy(dtype=object) for field in CATEGORICAL_FIELDS}
+    categorical_encoded, valid = validate_columns(numerical_inputs, categorical_inputs, errors, _label_encoders)
+
+    results = pd.DataFrame(index=chunk.index)
+    crops = np.full((num_records, _top_crops), None, dtype=object)
+    confidences = np.full((num_records, _top_crops), np.nan)
+    if valid.any():
+        probabilities = _engine.predict_proba(np.hstack([numerical_inputs[valid], categorical_encoded[valid]]))
+        top = np.argsort(-probabilities, axis=1, kind='stable')[:, :_top_crops]
+        class_names = np.array([str(crop).capitalize() for crop in _engine.classes], dtype=object)
+        crops[valid] = class_names[top]
+        # Python's round(), not np.round, so confidences match the API's to the last digit
+        confidences[valid] = [[round(float(probability), 3) for probability in row]
+                              for row in np.take_along_axis(probabilities, top, axis=1)]
+
+    for rank, (crop_column, confidence_column) in enumerate(crop_columns(_top_crops)):
+        results[crop_column] = crops[:, rank]
+        results[confidence_column] = confidences[:, rank]
+    results['error_type'] = [error[0] if error is not None else None for error in errors]
+    results['error'] = [error[1] if error is not None else None for error in errors]
+    return results
+
+
+def file_format(path, given):
+    if given:
+        return given
+    return 'parquet' if path.lower().endswith(('.parquet', '.pq')) else 'csv'
+
+
+def read_chunks(path, fmt, chunk_size):
+    """Yield the input as DataFrames of at most chunk_size rows"""
+    if fmt == 'parquet':
+        pq = import_pyarrow_parquet()
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+        return
+
+    # Read everything as text so bad values are reported per row instead of failing
+    # the read; only empty cells are missing values
+    yield from pd.read_csv(path, chunksize=chunk_size, dtype=str, keep_default_na=False, na_values=[''])
+
+
+class ChunkWriter:
+    """Appends scored chunks to a CSV or Parquet file"""
+
+    def __init__(self, path, fmt):
+        self.path = path
+        self.fmt = fmt
+        self._file = None
+        self._parquet_writer = None
+
+    def write(self, df):
+        if self.fmt == 'parquet':
+            import pyarrow as pa
+            table = pa.Table.from_pandas(
+                df, preserve_index=False,
+                schema=self._parquet_writer.schema if self._parquet_writer is not None else None)
+            if self._parquet_writer is None:
+                self._parquet_writer = import_pyarrow_parquet().ParquetWriter(self.path, table.schema)
+            self._parquet_writer.write_table(table)
+            return
+
+        header = self._file is None
+        if header:
+            self._file = open(self.path, 'w', newline='')
+        df.to_csv(self._file, index=False, header=header)
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+        if self._file is not None:
+            self._file.close()
+
+
+def import_pyarrow_parquet():
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit('❌ Parquet files need pyarrow: pip install pyarrow')
+    return pq
+
+
+class Progress:
+    """Rows scored so far and throughput, printed every PROGRESS_INTERVAL seconds"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.last_printed = self.started
+        self.rows = 0
+        self.failed = 0
+
+    def update(self, rows, failed):
+        self.rows += rows
+        self.failed += failed
+        now = time.perf_counter()
+        if now - self.last_printed >= PROGRESS_INTERVAL:
+            self.last_printed = now
+            print(f"⏳ {self.rows:,} rows scored ({self.failed:,} invalid), "
+                  f"{self.rows / (now - self.started):,.0f} rows/s", flush=True)
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def score_file(input_path, output_path, input_format=None, output_format=None, chunk_size=DEFAULT_CHUNK_SIZE,
+               workers=1, version=None, tier='accurate', model_format='auto', models_dir=MODELS_DIR,
+               top_crops=DEFAULT_TOP_CROPS):
+    """Score input_path into output_path chunk by chunk. Returns the Progress totals."""
+    input_format = file_format(input_path, input_format)
+    output_format = file_format(output_path, output_format)
+    if 'parquet' in (input_format, output_format):
+        import_pyarrow_parquet()
+    # Resolve the version once so every worker loads the same one even if CURRENT moves
+    bundle, engine = load_model(version, tier, model_format, models_dir)
+    version = None if bundle.version == LEGACY_VERSION else bundle.version
+    served_tier = 'fast' if engine is bundle.student_engine else 'accurate'
+    if served_tier != tier:
+        print("⚠️  Model version has no fast-tier model; scoring with the full model")
+    print(f"🌲 Scoring with model {bundle.version} ({served_tier} tier, {engine.n_trees} trees), "
+          f"{workers} worker(s), chunks of {chunk_size:,} rows")
+
+    chunks = read_chunks(input_path, input_format, chunk_size)
+    writer = ChunkWriter(output_path, output_format)
+    progress = Progress()
+
+    def write(chunk, results):
+        writer.write(pd.concat([chunk.reset_index(drop=True), results.reset_index(drop=True)], axis=1))
+        progress.update(len(chunk), int(results['error'].notna().sum()))
+
+    def check_columns(chunk):
+        missing_columns = [field for field in REQUIRED_FIELDS if field not in chunk.columns]
+        if missing_columns:
+            raise SystemExit(f"❌ Input is missing columns: {', '.join(missing_columns)}")
+        clashing = [column for column in result_columns(top_crops) if column in chunk.columns]
+        if clashing:
+            raise SystemExit(f"❌ Input already has output columns: {', '.join(clashing)}")
+
+    try:
+        if workers <= 1:
+            init_scorer(version, tier, model_format, models_dir, top_crops)
+            for chunk in chunks:
+                check_columns(chunk)
+                write(chunk, score_chunk(chunk[REQUIRED_FIELDS]))
+        else:
+            # Results come back in submission order; reading stops while the window is full
+            pending = deque()
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_scorer,
+                                     initargs=(version, tier, model_format, models_dir, top_crops)) as pool:
+                for chunk in chunks:
+                    check_columns(chunk)
+                    pending.append((chunk, pool.submit(score_chunk, chunk[REQUIRED_FIELDS])))
+                    if len(pending) >= workers * CHUNKS_IN_FLIGHT_PER_WORKER:
+                        chunk, future = pending.popleft()
+                        write(chunk, future.result())
+                while pending:
+                    chunk, future = pending.popleft()
+                    write(chunk, future.result())
+    finally:
+        writer.close()
+    return progress
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Score a CSV or Parquet file of farm profiles')
+    parser.add_argument('input', help='input .csv or .parquet file')
+    parser.add_argument('output', help='output .csv or .parquet file')
+    parser.add_argument('--input-format', choices=['csv', 'parquet'], help='default: from the file extension')
+    parser.add_argument('--output-format', choices=['csv', 'parquet'], help='default: from the file extension')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f'rows read and scored at a time (default: {DEFAULT_CHUNK_SIZE})')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='scoring processes (default: all CPUs; 1 scores in this process)')
+    parser.add_argument('--version', help='model version (default: models/CURRENT)')
+    parser.add_argument('--tier', choices=['accurate', 'fast'], default='accurate',
+                        help='model tier, as in /predict (default: accurate)')
+    parser.add_argument('--model-format', choices=['auto', 'mmap', 'pickle'], default='auto',
+                        help='model artifact to load, as MODEL_FORMAT (default: auto)')
+    parser.add_argument('--top-crops', type=int, default=DEFAULT_TOP_CROPS,
+                        help=f'crops written per row (default: {DEFAULT_TOP_CROPS})')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.chunk_size < 1 or args.top_crops < 1:
+        raise SystemExit('--chunk-size and --top-crops must be at least 1')
+
+    progress = score_file(args.input, args.output, args.input_format, args.output_format, args.chunk_size,
+                          args.workers, args.version, args.tier, args.model_format, top_crops=args.top_crops)
+
+    print(f"✅ Scored {progress.rows:,} rows ({progress.failed:,} invalid) in {progress.elapsed:.1f}s, "
+          f"{progress.rows / max(progress.elapsed, 1e-9):,.0f} rows/s → {args.output}")
+    peak_main = peak_rss_mb()
+    peak_workers = peak_rss_mb(children=True)
+    if peak_main is not None:
+        print(f"📈 Peak memory: {peak_main:.0f} MB main process"
+              + (f", {peak_workers:.0f} MB largest worker" if args.workers > 1 else ''))
+
+
+if __name__ == '__main__':
+    main()
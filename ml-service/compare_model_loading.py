@@ -0,0 +1,171 @@
+"""
+Compare ML service startup time and memory for the pickle and mmap model formats
+
+Starts several worker processes per format at the same time. Each one imports
+app.py (which loads the model), runs one prediction and reports how long the
+import took and how much memory it uses. Workers stay alive until all of them
+have reported, so shared pages show up in the proportional (PSS) numbers.
+
+Usage:
+    python compare_model_loading.py --workers 4
+    python compare_model_loading.py --workers 4 --json results.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from model_registry import ARRAYS_DIRNAME, MODELS_DIR, read_current_version
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULT_PREFIX = 'LOAD_RESULT '
+
+
+def read_memory_kb():
+    """Resident, proportional, shared and private memory of this process in kB"""
+    memory = {}
+    try:
+        # Linux: smaps_rollup splits resident memory into shared and private pages
+        with open('/proc/self/smaps_rollup', 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                    memory[parts[0][:-1]] = int(parts[1])
+        return {
+            'rss_kb': memory.get('Rss', 0),
+            'pss_kb': memory.get('Pss', 0),
+            'shared_kb': memory.get('Shared_Clean', 0) + memory.get('Shared_Dirty', 0),
+            'private_kb': memory.get('Private_Clean', 0) + memory.get('Private_Dirty', 0)
+        }
+    except OSError:
+        import resource
+        rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            rss_kb //= 1024
+        return {'rss_kb': rss_kb, 'pss_kb': None, 'shared_kb': None, 'private_kb': None}
+
+
+def run_worker(model_format):
+    """Child process: import the app with the given model format and report"""
+    os.environ['MODEL_FORMAT'] = model_format
+    start = time.perf_counter()
+    import app
+    startup_seconds = time.perf_counter() - start
+
+    bundle = app.registry.active
+    if bundle is None:
+        raise SystemExit(f'Model failed to load with MODEL_FORMAT={model_format}')
+
+    # One prediction touches the node arrays the way real traffic does
+    sample = [[90, 42, 43, 28, 80, 6.5, 200, 12, 0, 0, 1, 1]]
+    start = time.perf_counter()
+    bundle.engine.predict_proba(sample)
+    first_prediction_ms = (time.perf_counter() - start) * 1000
+
+    result = {
+        'format': bundle.model_format,
+        'startup_seconds': startup_seconds,
+        'first_prediction_ms': first_prediction_ms,
+        'sklearn_imported': 'sklearn' in sys.modules
+    }
+    result.update(read_memory_kb())
+    print(RESULT_PREFIX + json.dumps(result), flush=True)
+
+    # Stay alive until the parent has heard from every worker
+    sys.stdin.read()
+
+
+def measure_format(model_format, workers):
+    """Start `workers` processes for one format and collect their reports"""
+    processes = [
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--worker', model_format],
+            cwd=SERVICE_DIR,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True
+        )
+        for _ in range(workers)
+    ]
+
+    results = []
+    for process in processes:
+        for line in process.stdout:
+            if line.startswith(RESULT_PREFIX):
+                results.append(json.loads(line[len(RESULT_PREFIX):]))
+                break
+
+    for process in processes:
+        process.stdin.close()
+        process.wait()
+
+    if len(results) != workers:
+        raise SystemExit(f'Only {len(results)}/{workers} {model_format} workers reported')
+    return results
+
+
+def summarize(model_format, results):
+    """Average and total the per-worker numbers"""
+    def mean(key):
+        values = [r[key] for r in results if r[key] is not None]
+        return sum(values) / len(values) if values else None
+
+    pss_values = [r['pss_kb'] for r in results if r['pss_kb'] is not None]
+    return {
+        'format': model_format,
+        'workers': len(results),
+        'mean_startup_seconds': mean('startup_seconds'),
+        'mean_first_prediction_ms': mean('first_prediction_ms'),
+        'mean_rss_mb': mean('rss_kb') / 1024,
+        'mean_private_mb': mean('private_kb') / 1024 if mean('private_kb') is not None else None,
+        'total_pss_mb': sum(pss_values) / 1024 if pss_values else None,
+        'sklearn_imported': any(r['sklearn_imported'] for r in results)
+    }
+
+
+def format_mb(value):
+    return f'{value:.1f}' if value is not None else 'n/a'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare pickle and mmap model loading')
+    parser.add_argument('--workers', type=int, default=4, help='worker processes per format')
+    parser.add_argument('--formats', default='pickle,mmap', help='comma separated formats to compare')
+    parser.add_argument('--json', help='also write the summary to this JSON file')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker)
+        return
+
+    version = read_current_version(os.path.join(SERVICE_DIR, MODELS_DIR))
+    model_dir = os.path.join(SERVICE_DIR, MODELS_DIR, version) if version else SERVICE_DIR
+    if not os.path.isdir(os.path.join(model_dir, ARRAYS_DIRNAME)):
+        print(f"❌ {ARRAYS_DIRNAME}/ not found in {model_dir}. Run 'python train_model.py' first.")
+        sys.exit(1)
+
+    summaries = []
+    for model_format in args.formats.split(','):
+        print(f"⏱️  Measuring {model_format} with {args.workers} workers...")
+        summaries.append(summarize(model_format, measure_format(model_format, args.workers)))
+
+    print()
+    print(f"{'Format':<8} {'Startup (s)':>12} {'1st pred (ms)':>14} {'RSS/worker (MB)':>16} "
+          f"{'Private/worker (MB)':>20} {'Total PSS (MB)':>15} {'sklearn':>8}")
+    for s in summaries:
+        print(f"{s['format']:<8} {s['mean_startup_seconds']:>12.3f} {s['mean_first_prediction_ms']:>14.2f} "
+              f"{format_mb(s['mean_rss_mb']):>16} {format_mb(s['mean_private_mb']):>20} "
+              f"{format_mb(s['total_pss_mb']):>15} {str(s['sklearn_imported']):>8}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summaries, f, indent=2)
+        print(f"\n💾 Results saved to '{args.json}'")
+
+
+if __name__ == '__main__':
+    main()
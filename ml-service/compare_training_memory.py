@@ -0,0 +1,125 @@
+"""
+Compare peak training memory of the DataFrame and compact (--compact) data paths
+
+Each measurement runs in a fresh process. The process builds the dataset the way
+train_model.py does for that path, splits it, and fits the forest. Peak resident
+memory is recorded after the data is ready for training and again after the fit.
+Neither path uses the dataset cache, and nothing is published.
+
+The fitted forest itself grows with the dataset (min_samples_leaf=1), so
+--n-estimators can fit fewer trees to keep large runs short; the data
+preparation peak does not depend on it.
+
+Usage:
+    python compare_training_memory.py                      # 10x and 100x, 200 trees
+    python compare_training_memory.py --rows-multipliers 10,100 --n-estimators 10
+    python compare_training_memory.py --json results.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from metrics import peak_rss_mb
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULT_PREFIX = 'MEMORY_RESULT '
+PATHS = ['dataframe', 'compact']
+
+
+def run_worker(path, rows_multiplier, n_estimators, seed):
+    """Child process: prepare the data and fit the forest on one path, then report"""
+    import numpy as np
+    from sklearn.ensemble import RandomForestClassifier
+    from train_model import (FOREST_PARAMS, crop_patterns, generate_compact_dataset, generate_dataset,
+                             prepare_dataset, split_compact_dataset, split_dataset)
+
+    baseline_mb = peak_rss_mb()
+    start = time.perf_counter()
+    if path == 'compact':
+        dataset = generate_compact_dataset(crop_patterns, seed, rows_multiplier)
+        rows = dataset.n_rows
+        X_train, X_test, y_train, y_test = split_compact_dataset(dataset)
+        del dataset
+    else:
+        df, _ = prepare_dataset(generate_dataset(crop_patterns, seed, rows_multiplier))
+        rows = len(df)
+        X_train, X_test, y_train, y_test = split_dataset(df)
+    data_seconds = time.perf_counter() - start
+    data_peak_mb = peak_rss_mb()
+
+    start = time.perf_counter()
+    model = RandomForestClassifier(**dict(FOREST_PARAMS, n_estimators=n_estimators), n_jobs=-1)
+    model.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+    accuracy = float(np.mean(model.predict(X_test) == np.asarray(y_test)))
+
+    result = {
+        'path': path,
+        'rows_multiplier': rows_multiplier,
+        'rows': rows,
+        'n_estimators': n_estimators,
+        'baseline_mb': baseline_mb,
+        'data_peak_mb': data_peak_mb,
+        'fit_peak_mb': peak_rss_mb(),
+        'data_seconds': data_seconds,
+        'fit_seconds': fit_seconds,
+        'accuracy': accuracy
+    }
+    print(RESULT_PREFIX + json.dumps(result), flush=True)
+
+
+def measure(path, rows_multiplier, n_estimators, seed):
+    """Run one path in a fresh process and return its report"""
+    process = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--worker', path,
+         '--rows-multipliers', str(rows_multiplier), '--n-estimators', str(n_estimators), '--seed', str(seed)],
+        cwd=SERVICE_DIR, stdout=subprocess.PIPE, text=True
+    )
+    for line in process.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise SystemExit(f'{path} run at {rows_multiplier}x failed (exit code {process.returncode})')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare peak training memory of the DataFrame and compact paths')
+    parser.add_argument('--rows-multipliers', default='10,100',
+                        help='comma separated dataset sizes, as in train_model.py (default: 10,100)')
+    parser.add_argument('--n-estimators', type=int, default=200, help='trees fitted per run (default: 200)')
+    parser.add_argument('--seed', type=int, default=42, help='seed for the synthetic dataset (default: 42)')
+    parser.add_argument('--paths', default=','.join(PATHS), help='comma separated paths to compare')
+    parser.add_argument('--json', help='also write the results to this JSON file')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, float(args.rows_multipliers), args.n_estimators, args.seed)
+        return
+
+    results = []
+    for rows_multiplier in [float(value) for value in args.rows_multipliers.split(',')]:
+        for path in args.paths.split(','):
+            print(f"⏱️  Measuring {path} path at {rows_multiplier:g}x with {args.n_estimators} trees...")
+            results.append(measure(path, rows_multiplier, args.n_estimators, args.seed))
+
+    print()
+    print(f"{'Path':<10} {'Size':>6} {'Rows':>11} {'Imports (MB)':>13} {'Data peak (MB)':>15} {'Fit peak (MB)':>14} "
+          f"{'Data (s)':>9} {'Fit (s)':>8} {'Accuracy':>9}")
+    for r in results:
+        print(f"{r['path']:<10} {r['rows_multiplier']:>5g}x {r['rows']:>11,} {r['baseline_mb']:>13.0f} "
+              f"{r['data_peak_mb']:>15.0f} "
+              f"{r['fit_peak_mb']:>14.0f} {r['data_seconds']:>9.1f} {r['fit_seconds']:>8.1f} "
+              f"{r['accuracy'] * 100:>8.2f}%")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Results saved to '{args.json}'")
+
+
+if __name__ == '__main__':
+    main()
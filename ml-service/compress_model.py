@@ -0,0 +1,227 @@
+"""
+Forest compression for the crop recommendation model
+
+Shrinks a trained forest in three ways and reports what each step costs:
+- greedy tree dropping: trees are removed one at a time, always the one whose
+  removal hurts accuracy on a selection split the least
+- depth capping: nodes below the cap become leaves and keep the class
+  distribution stored for them
+- compact storage: float32 thresholds (exact for float32 features), uint16
+  class distributions and uint8 feature ids
+
+Every (tree count, depth cap) level is scored on a separate evaluation split
+for accuracy, top-1 / top-3 agreement with the full model, node array size and
+latency. The smallest level within the allowed accuracy loss whose top-3
+agreement stays above a floor is picked, so the alternatives /predict lists
+next to the top crop do not change for most requests.
+"""
+
+import numpy as np
+
+from forest_engine import measure_latency
+
+# Tree counts and depth caps tried by compression_report (None keeps full depth)
+TREE_COUNTS = [150, 100, 75, 50, 25, 10]
+DEPTH_CAPS = [None, 18, 14, 10, 8]
+
+# Single-row predictions timed per compression level
+LATENCY_CALLS = 300
+
+# Selection rows tree dropping looks at. Its memory grows with trees x rows x
+# classes, so larger selection splits are sampled down to this many rows.
+MAX_SELECTION_ROWS = 2000
+
+# Share of rows whose full-model top 3 crops a chosen level must keep listing
+DEFAULT_MIN_TOP3_AGREEMENT = 0.95
+
+
+def tree_probabilities(engine, X):
+    """Class distribution of the leaf every row reaches, shape (n_trees, n_rows, n_classes)"""
+    leaves = engine.apply(X).T
+    return np.asarray(engine.value, dtype=np.float32)[leaves] / np.float32(engine.value_scale)
+
+
+def greedy_tree_order(engine, X, y, keep=()):
+    """
+    Trees ordered from most to least useful. Repeatedly drops the tree whose
+    removal leaves the highest accuracy on (X, y), breaking ties by staying
+    closest to the full forest's probabilities. Trees in `keep` always stay in
+    the forest and are left out of the order.
+
+    Nothing of size (trees, rows, classes) is built per step. Each tree adds at
+    most 1 to a class's summed votes, so removing one tree can only change
+    whether a row is right when the true class leads or trails by at most 1;
+    only those rows are re-scored. The squared distance to the full forest's
+    probabilities follows from running sums of tree-by-tree dot products.
+    """
+    per_tree = tree_probabilities(engine, X)
+    n_trees = engine.n_trees
+    rows = np.arange(len(X))
+    y_index = np.searchsorted(engine.classes, y)
+
+    flat = per_tree.reshape(n_trees, -1)
+    gram = (flat @ flat.T).astype(np.float64)
+    full_dot = (flat @ flat.mean(axis=0)).astype(np.float64)
+    # <forest sum, tree> per tree, |forest sum|^2 and <forest sum, full mean>
+    sum_dot = gram.sum(axis=1)
+    sum_sq = sum_dot.sum()
+    sum_full = full_dot.sum()
+
+    kept = set(keep)
+    remaining = [tree for tree in range(n_trees) if tree not in kept]
+    total = per_tree.sum(axis=0)
+    size = n_trees
+    dropped = []
+    while len(remaining) > 1:
+        candidates = np.array(remaining)
+
+        true_votes = total[rows, y_index]
+        others = total.copy()
+        others[rows, y_index] = -np.inf
+        margin = true_votes - others.max(axis=1)
+        # Rows no single removal can flip; the slack covers float32 rounding
+        safe_correct = int(np.count_nonzero(margin > 1 + 1e-4))
+        boundary = np.flatnonzero(np.abs(margin) <= 1 + 1e-4)
+        correct = np.full(len(candidates), safe_correct)
+        if len(boundary):
+            chunk = max(1, 4_000_000 // (len(boundary) * total.shape[1]))
+            for first in range(0, len(candidates), chunk):
+                trees = candidates[first:first + chunk]
+                votes = total[boundary][np.newaxis, :, :] - per_tree[trees][:, boundary, :]
+                correct[first:first + chunk] += (np.argmax(votes, axis=2) == y_index[boundary]).sum(axis=1)
+
+        m = size - 1
+        candidate_sq = sum_sq - 2 * sum_dot[candidates] + gram[candidates, candidates]
+        drift = candidate_sq / m ** 2 - 2 * (sum_full - full_dot[candidates]) / m
+        best = np.lexsort((drift, -correct))[0]
+
+        tree = remaining.pop(best)
+        total -= per_tree[tree]
+        sum_sq -= 2 * sum_dot[tree] - gram[tree, tree]
+        sum_dot -= gram[tree]
+        sum_full -= full_dot[tree]
+        size -= 1
+        dropped.append(tree)
+
+    return remaining + dropped[::-1]
+
+
+def top_k(probabilities, k):
+    """Indices of the k most likely classes per row, in the order the API ranks them"""
+    return np.argsort(-probabilities, axis=1, kind='stable')[:, :k]
+
+
+def top3_agreement(probabilities, full_probabilities):
+    """
+    Share of rows whose top 3 crops include every crop in the full model's top 3.
+    Crops the full model gives zero probability are ties in arbitrary order,
+    so they are not compared.
+    """
+    full_top3 = top_k(full_probabilities, 3)
+    relevant = np.take_along_axis(full_probabilities, full_top3, axis=1) > 0
+    listed = (full_top3[:, :, np.newaxis] == top_k(probabilities, 3)[:, np.newaxis, :]).any(axis=2)
+    return float((listed | ~relevant).all(axis=1).mean())
+
+
+def score_level(engine, full_probabilities, X, y):
+    """Accuracy and agreement with the full model on the evaluation split"""
+    labels, probabilities = engine.predict_with_proba(X)
+    return {
+        'accuracy': float((labels == y).mean()),
+        'top1_agreement': float((np.argmax(probabilities, axis=1) == np.argmax(full_probabilities, axis=1)).mean()),
+        'top3_agreement': top3_agreement(probabilities, full_probabilities)
+    }
+
+
+def compression_report(engine, X_select, y_select, X_eval, y_eval, tree_counts=TREE_COUNTS,
+                       depth_caps=DEPTH_CAPS, keep=()):
+    """
+    Score the full engine and every compression level.
+    Returns (levels, build): one dict per level, and build(i) which rebuilds
+    the compressed engine of level i. Levels are built one at a time and not
+    kept, so memory holds one level's arrays at most. The first level is the
+    uncompressed forest for reference. Trees in `keep` are never dropped
+    (depth caps still apply to them); tree counts include them.
+    """
+    X_select = np.asarray(X_select, dtype=np.float32)
+    X_eval = np.asarray(X_eval, dtype=np.float32)
+    y_select = np.asarray(y_select)
+    y_eval = np.asarray(y_eval)
+
+    if len(X_select) > MAX_SELECTION_ROWS:
+        sample = np.sort(np.random.default_rng(42).choice(len(X_select), MAX_SELECTION_ROWS, replace=False))
+        X_select = X_select[sample]
+        y_select = y_select[sample]
+
+    keep = list(keep)
+    order = keep + greedy_tree_order(engine, X_select, y_select, keep)
+    full_probabilities = engine.predict_proba(X_eval)
+
+    levels = []
+    configurations = [(None, None, False)]
+    counts = [engine.n_trees] + [n for n in tree_counts if len(keep) < n < engine.n_trees]
+    configurations += [(n, cap, True) for n in counts for cap in depth_caps
+                       if cap is None or cap < engine.max_depth]
+
+    def build(index):
+        n_trees, max_depth, compact = configurations[index]
+        level_engine = engine
+        if n_trees is not None:
+            level_engine = engine.prune(trees=order[:n_trees], max_depth=max_depth)
+        if compact:
+            level_engine = level_engine.compact()
+        return level_engine
+
+    for index, (n_trees, max_depth, compact) in enumerate(configurations):
+        level_engine = build(index)
+
+        level = {
+            'n_trees': level_engine.n_trees,
+            'max_depth': level_engine.max_depth,
+            'depth_cap': max_depth,
+            'compact': compact,
+            'nodes': level_engine.n_nodes,
+            'arrays_bytes': level_engine.nbytes
+        }
+        level.update(score_level(level_engine, full_probabilities, X_eval, y_eval))
+        level.update(measure_latency(level_engine, X_eval, LATENCY_CALLS))
+        levels.append(level)
+        del level_engine
+
+    full_accuracy = levels[0]['accuracy']
+    for level in levels:
+        level['accuracy_loss'] = full_accuracy - level['accuracy']
+        level['p50_vs_full'] = level['single_row_p50_ms'] / levels[0]['single_row_p50_ms']
+    return levels, build
+
+
+def choose_level(levels, max_accuracy_loss, min_top3_agreement=DEFAULT_MIN_TOP3_AGREEMENT):
+    """
+    Index of the smallest level whose accuracy loss is within max_accuracy_loss
+    and whose top-3 agreement with the full model is at least min_top3_agreement
+    (both fractions). The uncompressed first level always qualifies.
+    """
+    within = [i for i, level in enumerate(levels)
+              if level['accuracy_loss'] <= max_accuracy_loss + 1e-12
+              and level['top3_agreement'] >= min_top3_agreement - 1e-12]
+    return min(within, key=lambda i: (levels[i]['arrays_bytes'], -levels[i]['accuracy']))
+
+
+def print_compression_report(levels, chosen=None, min_top3_agreement=None):
+    """Table of every level; with min_top3_agreement, levels below the top-3 floor are flagged"""
+    print(f"\n{'Trees':>5} {'Depth':>5} {'Storage':>8} {'Nodes':>9} {'Size (MB)':>10} {'Accuracy':>9} "
+          f"{'Top-1 agr':>10} {'Top-3 agr':>10} {'p50 (ms)':>9} {'vs full':>8} {'p99 (ms)':>9} {'Batch (ms)':>11}")
+    for i, level in enumerate(levels):
+        marker = '  ⬅ chosen' if i == chosen else ''
+        if min_top3_agreement is not None and level['top3_agreement'] < min_top3_agreement - 1e-12:
+            marker += '  (top-3 below floor)'
+        print(f"{level['n_trees']:>5} {level['max_depth']:>5} {'compact' if level['compact'] else 'float64':>8} "
+              f"{level['nodes']:>9,} {level['arrays_bytes'] / 1024 / 1024:>10.2f} {level['accuracy'] * 100:>8.2f}% "
+              f"{level['top1_agreement'] * 100:>9.2f}% {level['top3_agreement'] * 100:>9.2f}% "
+              f"{level['single_row_p50_ms']:>9.3f} {level['p50_vs_full']:>7.2f}x {level['single_row_p99_ms']:>9.3f} "
+              f"{level['batch_ms']:>11.2f}{marker}")
+    if len(levels) > 1 and levels[1]['compact'] and levels[1]['n_trees'] == levels[0]['n_trees'] \
+            and levels[1]['depth_cap'] is None:
+        # Narrow dtypes save memory, not time: compare the same forest in both storages
+        print(f"Compact storage alone: {levels[1]['arrays_bytes'] / levels[0]['arrays_bytes']:.2f}x the size, "
+              f"{levels[1]['p50_vs_full']:.2f}x the single-row p50 of float64 arrays")
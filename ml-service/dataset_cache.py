@@ -0,0 +1,118 @@
+"""
+Content-addressed on-disk cache for the generated training dataset
+
+The synthetic dataset only depends on crop_patterns, the seed, the rows
+multiplier, the clip ranges and the encoder settings. Those settings are hashed
+into a cache key; the generated, clipped and encoded dataset is stored under it
+as one raw .npy file per column, which loads back (memory-mapped) in a fraction
+of the time it takes to generate. Categorical and label columns are stored as
+integer codes plus their class lists.
+
+    .dataset_cache/
+    └── <sha256 of settings>/
+        ├── dataset.json        # settings, row count, class lists
+        ├── N.npy ... rainfall.npy
+        ├── state_encoded.npy ... farm_size_encoded.npy
+        └── label.npy
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import LabelEncoder
+
+DATASET_CACHE_DIR = '.dataset_cache'
+METADATA_FILENAME = 'dataset.json'
+CACHE_FORMAT_VERSION = 1
+
+
+def dataset_key(settings):
+    """Stable hash of everything the dataset depends on"""
+    payload = json.dumps(dict(settings, cache_format=CACHE_FORMAT_VERSION), sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def save_dataset(cache_dir, key, df, label_encoders, numerical_columns, settings):
+    """Write a prepared dataset as one .npy file per column"""
+    os.makedirs(cache_dir, exist_ok=True)
+    final_path = os.path.join(cache_dir, key)
+    staging_path = f'{final_path}.tmp-{os.getpid()}'
+    os.makedirs(staging_path, exist_ok=True)
+
+    for column in numerical_columns:
+        np.save(os.path.join(staging_path, f'{column}.npy'), df[column].to_numpy(dtype=np.float64))
+
+    categorical_classes = {}
+    for column, encoder in label_encoders.items():
+        codes = df[f'{column}_encoded'].to_numpy()
+        np.save(os.path.join(staging_path, f'{column}_encoded.npy'),
+                codes.astype(np.min_scalar_type(len(encoder.classes_) - 1)))
+        categorical_classes[column] = encoder.classes_.tolist()
+
+    label_classes, label_codes = np.unique(df['label'].to_numpy(dtype=str), return_inverse=True)
+    np.save(os.path.join(staging_path, 'label.npy'),
+            label_codes.astype(np.min_scalar_type(len(label_classes) - 1)))
+
+    metadata = {
+        'cache_format': CACHE_FORMAT_VERSION,
+        'rows': len(df),
+        'numerical_columns': list(numerical_columns),
+        'categorical_classes': categorical_classes,
+        'label_classes': label_classes.tolist(),
+        'settings': settings
+    }
+    with open(os.path.join(staging_path, METADATA_FILENAME), 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+    # Another run may have filled the same key meanwhile; either copy is valid
+    try:
+        os.rename(staging_path, final_path)
+    except OSError:
+        shutil.rmtree(staging_path, ignore_errors=True)
+    return final_path
+
+
+def load_dataset(cache_dir, key, mmap=True):
+    """
+    Load a cached dataset, or return None on a miss.
+    Returns (df, label_encoders) shaped like the freshly prepared dataset:
+    numerical columns, categorical columns (as pandas categoricals), their
+    `_encoded` codes and the `label` column.
+    """
+    path = os.path.join(cache_dir, key)
+    try:
+        with open(os.path.join(path, METADATA_FILENAME), 'r') as f:
+            metadata = json.load(f)
+    except FileNotFoundError:
+        return None
+    if metadata.get('cache_format') != CACHE_FORMAT_VERSION:
+        return None
+
+    mmap_mode = 'r' if mmap else None
+
+    def column_array(name):
+        return np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+
+    columns = {}
+    for column in metadata['numerical_columns']:
+        columns[column] = column_array(column)
+
+    label_encoders = {}
+    encoded_columns = {}
+    for column, classes in metadata['categorical_classes'].items():
+        codes = column_array(f'{column}_encoded')
+        columns[column] = pd.Categorical.from_codes(codes, classes)
+        encoded_columns[f'{column}_encoded'] = codes
+
+        encoder = LabelEncoder()
+        encoder.classes_ = np.array(classes)
+        label_encoders[column] = encoder
+
+    columns['label'] = pd.Categorical.from_codes(column_array('label'), metadata['label_classes'])
+    columns.update(encoded_columns)
+
+    return pd.DataFrame(columns, copy=False), label_encoders
@@ -0,0 +1,113 @@
+"""
+Distilled low-latency student model for the fast tier
+
+A small random forest regressor learns the full forest's predict_proba output
+(soft targets) instead of the hard labels, so it also picks up how sure the
+full model is and which crops it ranks next. The transfer set is the training
+split plus freshly generated samples labelled only by the full model. The
+student's leaves hold averaged class distributions, so it is served by the same
+ForestEngine as the full model and answers /predict?tier=fast.
+"""
+
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+
+from compress_model import DEFAULT_MIN_TOP3_AGREEMENT, score_level
+from forest_engine import ForestEngine, measure_latency
+
+# Few, shallow trees: a single-row walk costs a handful of array steps
+STUDENT_PARAMS = {
+    'n_estimators': 10,
+    'max_depth': 10,
+    'max_features': 0.5,
+    'random_state': 42
+}
+
+# Extra transfer samples, as a multiple of the training dataset size
+TRANSFER_ROWS_MULTIPLIER = 3.0
+
+# Single-row predictions timed per model for the latency comparison
+LATENCY_CALLS = 500
+
+# The student is only published when its single-row p50 is at most this share
+# of the accurate tier's and its node arrays are smaller
+MAX_LATENCY_RATIO = 0.8
+
+# ...and when it agrees with the accurate tier on the top crop for at least this
+# share of test rows (the top-3 floor is compress_model's DEFAULT_MIN_TOP3_AGREEMENT)
+MIN_TOP1_AGREEMENT = 0.95
+
+
+def train_student(X, teacher_probabilities, classes, params=STUDENT_PARAMS):
+    """Fit the student on the teacher's class probabilities and return it as a compact engine"""
+    student = RandomForestRegressor(**params, n_jobs=-1)
+    student.fit(np.asarray(X, dtype=np.float32), teacher_probabilities)
+    return ForestEngine.from_sklearn(student, classes=classes).compact()
+
+
+def distillation_report(student, teacher, X, y, served=None):
+    """
+    Accuracy, agreement with the full model (teacher) and single-row latency of
+    the fast tier next to the accurate tier. `served` is the engine that answers
+    the accurate tier when it is not the full model (e.g. compressed).
+    """
+    served = served if served is not None else teacher
+    X = np.asarray(X, dtype=np.float32)
+    y = np.asarray(y)
+    teacher_probabilities = teacher.predict_proba(X)
+    X_latency = X.astype(np.float64)
+
+    tiers = {}
+    for tier, engine in [('accurate', served), ('fast', student)]:
+        tiers[tier] = dict(score_level(engine, teacher_probabilities, X, y),
+                           **measure_latency(engine, X_latency, LATENCY_CALLS), arrays_bytes=engine.nbytes)
+
+    # tier=fast stands in for the accurate tier, so that is what the student has to agree with
+    served_scores = tiers['fast'] if served is teacher else score_level(student, served.predict_proba(X), X, y)
+    return dict(
+        tiers['fast'],
+        served_top1_agreement=served_scores['top1_agreement'],
+        served_top3_agreement=served_scores['top3_agreement'],
+        n_trees=student.n_trees,
+        max_depth=student.max_depth,
+        n_nodes=student.n_nodes,
+        arrays_bytes=student.nbytes,
+        params=STUDENT_PARAMS,
+        tiers=tiers
+    )
+
+
+def skip_reason(report, min_top1_agreement=MIN_TOP1_AGREEMENT, min_top3_agreement=DEFAULT_MIN_TOP3_AGREEMENT):
+    """
+    Why the student should not serve the fast tier, or None. A student that is
+    not clearly faster and smaller than the accurate tier only costs accuracy,
+    and one that often ranks crops differently gives different answers.
+    """
+    fast = report['tiers']['fast']
+    accurate = report['tiers']['accurate']
+    if report['served_top1_agreement'] < min_top1_agreement:
+        return (f"top-1 agreement with the accurate tier ({report['served_top1_agreement'] * 100:.2f}%) "
+                f"is below {min_top1_agreement * 100:g}%")
+    if report['served_top3_agreement'] < min_top3_agreement:
+        return (f"top-3 agreement with the accurate tier ({report['served_top3_agreement'] * 100:.2f}%) "
+                f"is below {min_top3_agreement * 100:g}%")
+    if fast['single_row_p50_ms'] > accurate['single_row_p50_ms'] * MAX_LATENCY_RATIO:
+        return (f"single-row p50 {fast['single_row_p50_ms']:.3f} ms is not below "
+                f"{MAX_LATENCY_RATIO:g}x the accurate tier's {accurate['single_row_p50_ms']:.3f} ms")
+    if fast['arrays_bytes'] >= accurate['arrays_bytes']:
+        return (f"node arrays ({fast['arrays_bytes'] / 1024:.1f} KB) are not smaller than the accurate tier's "
+                f"({accurate['arrays_bytes'] / 1024:.1f} KB)")
+    return None
+
+
+def print_distillation_report(report):
+    print(f"{'Tier':<10} {'Accuracy':>9} {'Top-1 agr':>10} {'Top-3 agr':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for tier, scores in report['tiers'].items():
+        print(f"{tier:<10} {scores['accuracy'] * 100:>8.2f}% {scores['top1_agreement'] * 100:>9.2f}% "
+              f"{scores['top3_agreement'] * 100:>9.2f}% "
+              f"{scores['single_row_p50_ms']:>8.3f} {scores['single_row_p99_ms']:>8.3f}")
+    print(f"Student: {report['n_trees']} trees up to depth {report['max_depth']}, "
+          f"{report['n_nodes']:,} nodes, {report['arrays_bytes'] / 1024:.1f} KB "
+          f"(agreement is with the full forest)")
+    print(f"Student agreement with the accurate tier: top-1 {report['served_top1_agreement'] * 100:.2f}%, "
+          f"top-3 {report['served_top3_agreement'] * 100:.2f}%")
@@ -0,0 +1,200 @@
+"""
+Constant-memory sketches of the input distribution, and drift checks
+
+InputSketch keeps a fixed-bin histogram over the validated range of each
+numerical feature and a count per value of each categorical feature. An update
+is one bin increment per feature under a lock. Memory depends only on the
+number of bins and categories, never on the number of requests.
+
+train_model.py stores the same sketch of the training split as
+training_profile.json in every model version. compare_to_training() compares
+live traffic with it feature by feature:
+
+- psi:                    population stability index between the two histograms
+                          (< 0.1 stable, 0.1-0.25 shifting, > 0.25 drifted)
+- outside_training_share: share of live inputs in bins or categories the
+                          training data never reached
+- live / training:        approximate mean and p5/p50/p95 of the values
+"""
+
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from validation import CATEGORICAL_FIELDS, NUMERICAL_FIELDS, NUMERICAL_RANGES
+
+TRAINING_PROFILE_FILENAME = 'training_profile.json'
+
+# Equal-width bins between each numerical feature's valid min and max
+DEFAULT_BINS = 50
+
+# PSI bounds between 'stable' / 'shifting' and 'shifting' / 'drifted'
+PSI_SHIFTING = 0.1
+PSI_DRIFTED = 0.25
+
+# Live inputs needed before a feature gets a status other than 'insufficient_data'.
+# Below about this many, sampling noise alone pushes the PSI of 50 bins past 0.1.
+MIN_LIVE_COUNT = 1000
+
+# Share floor for empty bins, so PSI stays finite
+PSI_EPSILON = 1e-4
+
+REPORTED_QUANTILES = [0.05, 0.5, 0.95]
+
+
+class InputSketch:
+    """Histograms of the numerical inputs and value counts of the categorical inputs"""
+
+    def __init__(self, bins=DEFAULT_BINS):
+        self.bins = bins
+        self._lows = [low for low, _, _ in NUMERICAL_RANGES]
+        self._scales = [bins / (high - low) for low, high, _ in NUMERICAL_RANGES]
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
+            self.since = datetime.now().isoformat()
+            self._histograms = [[0] * self.bins for _ in NUMERICAL_FIELDS]
+            self._categories = [{} for _ in CATEGORICAL_FIELDS]
+            # (histogram, low, scale) per numerical field, so update() does no indexing
+            self._bins_of = list(zip(self._histograms, self._lows, self._scales))
+
+    def update(self, numerical, categorical):
+        """Add one validated input: 7 numerical values and 5 categorical values, in field order"""
+        last_bin = self.bins - 1
+        with self._lock:
+            self.count += 1
+            for (histogram, low, scale), value in zip(self._bins_of, numerical):
+                index = int((value - low) * scale)
+                histogram[index if 0 <= index < last_bin else (last_bin if index > 0 else 0)] += 1
+            for counts, value in zip(self._categories, categorical):
+                counts[value] = counts.get(value, 0) + 1
+
+    def update_many(self, numerical, categorical):
+        """
+        Add many validated inputs at once: an (n, 7) array of numerical values
+        and {field: n categorical values}
+        """
+        numerical = np.asarray(numerical, dtype=np.float64)
+        if not len(numerical):
+            return
+        indices = ((numerical - self._lows) * self._scales).astype(np.int64).clip(0, self.bins - 1)
+        histograms = [np.bincount(indices[:, j], minlength=self.bins) for j in range(len(NUMERICAL_FIELDS))]
+        value_counts = [np.unique(np.asarray(categorical[field], dtype=str), return_counts=True)
+                        for field in CATEGORICAL_FIELDS]
+        with self._lock:
+            self.count += len(numerical)
+            for j, histogram in enumerate(histograms):
+                target = self._histograms[j]
+                for index in np.flatnonzero(histogram):
+                    target[index] += int(histogram[index])
+            for counts, (values, value_counts_) in zip(self._categories, value_counts):
+                for value, count in zip(values.tolist(), value_counts_.tolist()):
+                    counts[value] = counts.get(value, 0) + count
+
+    def to_dict(self):
+        """JSON-serializable snapshot, the format of training_profile.json"""
+        with self._lock:
+            return {
+                'count': self.count,
+                'since': self.since,
+                'bins': self.bins,
+                'numerical': {
+                    field: {
+                        'low': NUMERICAL_RANGES[j][0],
+                        'high': NUMERICAL_RANGES[j][1],
+                        'histogram': list(self._histograms[j])
+                    }
+                    for j, field in enumerate(NUMERICAL_FIELDS)
+                },
+                'categorical': {
+                    field: dict(sorted(counts.items()))
+                    for field, counts in zip(CATEGORICAL_FIELDS, self._categories)
+                }
+            }
+
+
+def histogram_summary(histogram, low, high, quantiles=REPORTED_QUANTILES):
+    """Approximate mean (bin midpoints) and quantiles (linear inside a bin) of binned values"""
+    histogram = np.asarray(histogram, dtype=np.float64)
+    total = histogram.sum()
+    if not total:
+        return dict(mean=None, **{f'p{round(q * 100)}': None for q in quantiles})
+    edges = np.linspace(low, high, len(histogram) + 1)
+    cumulative = np.concatenate([[0.0], np.cumsum(histogram)]) / total
+    summary = {'mean': round(float(np.dot(histogram, (edges[:-1] + edges[1:]) / 2) / total), 3)}
+    for q in quantiles:
+        summary[f'p{round(q * 100)}'] = round(float(np.interp(q, cumulative, edges)), 3)
+    return summary
+
+
+def psi(live_counts, training_counts):
+    """Population stability index between two count vectors over the same bins"""
+    live = np.asarray(live_counts, dtype=np.float64)
+    training = np.asarray(training_counts, dtype=np.float64)
+    live = np.maximum(live / live.sum(), PSI_EPSILON)
+    training = np.maximum(training / training.sum(), PSI_EPSILON)
+    return float(np.sum((live - training) * np.log(live / training)))
+
+
+def drift_status(live_count, value):
+    if live_count < MIN_LIVE_COUNT:
+        return 'insufficient_data'
+    if value > PSI_DRIFTED:
+        return 'drifted'
+    return 'shifting' if value > PSI_SHIFTING else 'stable'
+
+
+def compare_to_training(live, training):
+    """
+    Per-feature comparison of a live sketch with the training profile (both
+    InputSketch.to_dict() snapshots). Returns {'numerical': ..., 'categorical': ...}.
+    """
+    report = {'numerical': {}, 'categorical': {}}
+    for field in NUMERICAL_FIELDS:
+        live_feature = live['numerical'][field]
+        training_feature = training['numerical'][field]
+        live_histogram = np.asarray(live_feature['histogram'])
+        training_histogram = np.asarray(training_feature['histogram'])
+        if len(live_histogram) != len(training_histogram) or \
+                (live_feature['low'], live_feature['high']) != (training_feature['low'], training_feature['high']):
+            raise ValueError(f'Histograms of {field} do not use the same bins')
+
+        entry = {
+            'live': histogram_summary(live_histogram, live_feature['low'], live_feature['high']),
+            'training': histogram_summary(training_histogram, training_feature['low'], training_feature['high'])
+        }
+        if live['count']:
+            value = psi(live_histogram, training_histogram)
+            entry['psi'] = round(value, 4)
+            entry['outside_training_share'] = round(
+                float(live_histogram[training_histogram == 0].sum() / live_histogram.sum()), 4)
+            entry['status'] = drift_status(live['count'], value)
+        else:
+            entry.update(psi=None, outside_training_share=None, status='insufficient_data')
+        report['numerical'][field] = entry
+
+    for field in CATEGORICAL_FIELDS:
+        live_counts = live['categorical'][field]
+        training_counts = training['categorical'][field]
+        values = sorted(set(live_counts) | set(training_counts))
+        live_vector = np.array([live_counts.get(value, 0) for value in values], dtype=np.float64)
+        training_vector = np.array([training_counts.get(value, 0) for value in values], dtype=np.float64)
+
+        entry = {
+            'live_share': {value: round(count / live['count'], 4)
+                           for value, count in live_counts.items()} if live['count'] else {},
+        }
+        if live['count']:
+            value = psi(live_vector, training_vector)
+            entry['psi'] = round(value, 4)
+            entry['outside_training_share'] = round(
+                float(live_vector[training_vector == 0].sum() / live_vector.sum()), 4)
+            entry['status'] = drift_status(live['count'], value)
+        else:
+            entry.update(psi=None, outside_training_share=None, status='insufficient_data')
+        report['categorical'][field] = entry
+    return report
@@ -0,0 +1,268 @@
+"""
+Append-only binary log of farmer feedback, and the background retraining job
+
+POST /feedback records which crop a farmer planted on a farm profile and how it
+went. Each report is one fixed-size 43 byte record, written with a single
+os.write() to a file opened with O_APPEND, so server workers can share a log
+without locking each other out or tearing records:
+
+    timestamp (float64) | 7 numerical inputs (float32) | 5 categorical codes (uint8)
+    | planted crop code (uint8) | outcome code (uint8)
+
+Codes only mean something together with the label encoders and crop classes of
+the model that encoded them, so the log is split into segments by that
+vocabulary:
+
+    feedback/
+    ├── 3f2a9c1b7d40.bin        # records encoded with one vocabulary
+    ├── 3f2a9c1b7d40.json       # that vocabulary: label encoders and crop classes
+    └── retrain.log             # output of retraining runs started by the service
+
+feedback_training_rows() reads every segment back with one np.fromfile() and
+re-encodes the rows for the model being retrained. retrain_feedback.py turns
+them into new trees; RetrainJob runs it in a separate process for
+POST /admin/retrain.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+# Next to the service, whatever directory a script or server is started from
+FEEDBACK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'feedback')
+RETRAIN_LOG_FILENAME = 'retrain.log'
+RETRAIN_LOCK_FILENAME = 'retrain.lock'
+
+# Reported outcomes, worst to best; the code stored is the index
+OUTCOMES = ['failed', 'poor', 'average', 'good', 'excellent']
+
+N_NUMERICAL = 7
+N_CATEGORICAL = 5
+
+# Little-endian and unpadded: RECORD.pack() writes exactly the RECORD_DTYPE layout
+RECORD = struct.Struct(f'<d{N_NUMERICAL}f{N_CATEGORICAL}BBB')
+RECORD_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('numerical', '<f4', (N_NUMERICAL,)),
+    ('categorical', 'u1', (N_CATEGORICAL,)),
+    ('crop', 'u1'),
+    ('outcome', 'u1')
+])
+
+# Line printed last by retrain_feedback.py, followed by its JSON result
+RESULT_PREFIX = 'RETRAIN_RESULT '
+
+
+def vocabulary_of(label_encoders, classes):
+    """The vocabulary records are encoded with: {field: categories} and crop classes"""
+    return {'label_encoders': label_encoders, 'classes': [str(crop) for crop in classes]}
+
+
+def vocabulary_key(vocabulary):
+    return hashlib.sha1(json.dumps(vocabulary, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+
+class FeedbackLog:
+    """
+    Writer for the feedback segments in `directory`. One file descriptor per
+    segment stays open; an append is one struct.pack() and one os.write().
+    """
+
+    def __init__(self, directory=FEEDBACK_DIR):
+        self.directory = directory
+        self.recorded = 0
+        self.write_errors = 0
+        self._segments = {}
+        self._lock = threading.Lock()
+
+    def _segment(self, version, label_encoders, classes):
+        """File descriptor of the segment for a model version's vocabulary, opened on first use"""
+        fd = self._segments.get(version)
+        if fd is not None:
+            return fd
+        vocabulary = vocabulary_of(label_encoders, classes)
+        if max(len(classes), *(len(values) for values in label_encoders.values())) > 256:
+            raise ValueError('Feedback records store categories and crops as single bytes')
+        key = vocabulary_key(vocabulary)
+        os.makedirs(self.directory, exist_ok=True)
+        vocabulary_path = os.path.join(self.directory, key + '.json')
+        if not os.path.exists(vocabulary_path):
+            # Written in full before any record refers to it
+            with open(f'{vocabulary_path}.{os.getpid()}.tmp', 'w') as f:
+                json.dump(dict(vocabulary, first_model_version=version), f, indent=2)
+            os.replace(f'{vocabulary_path}.{os.getpid()}.tmp', vocabulary_path)
+        fd = os.open(os.path.join(self.directory, key + '.bin'), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._segments[version] = fd
+        return fd
+
+    def append(self, bundle, numerical, categorical_codes, crop_code, outcome_code):
+        """Record one report, encoded with `bundle`'s label encoders and crop classes"""
+        record = RECORD.pack(time.time(), *numerical, *categorical_codes, crop_code, outcome_code)
+        with self._lock:
+            try:
+                fd = self._segment(bundle.version, bundle.label_encoders, bundle.engine.classes)
+                os.write(fd, record)
+            except OSError:
+                self.write_errors += 1
+                raise
+            self.recorded += 1
+
+    def stats(self):
+        """Counters reported by /health"""
+        with self._lock:
+            return {
+                'enabled': True,
+                'directory': self.directory,
+                'recorded': self.recorded,
+                'write_errors': self.write_errors,
+                'segments_open': len(self._segments)
+            }
+
+
+def read_segments(directory=FEEDBACK_DIR):
+    """[(vocabulary, records)] for every segment in `directory`, records as a RECORD_DTYPE array"""
+    segments = []
+    if not os.path.isdir(directory):
+        return segments
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.bin'):
+            continue
+        vocabulary_path = os.path.join(directory, name[:-len('.bin')] + '.json')
+        if not os.path.exists(vocabulary_path):
+            continue
+        with open(vocabulary_path, 'r') as f:
+            vocabulary = json.load(f)
+        path = os.path.join(directory, name)
+        # A record cut short by a crash mid-write is ignored
+        count = os.path.getsize(path) // RECORD_DTYPE.itemsize
+        segments.append((vocabulary, np.fromfile(path, dtype=RECORD_DTYPE, count=count)))
+    return segments
+
+
+def feedback_training_rows(label_encoders, classes, min_outcome='good', directory=FEEDBACK_DIR):
+    """
+    Feedback turned into training rows for a model with these label encoders
+    ({field: categories}) and crop classes: every report with an outcome of at
+    least `min_outcome`, labelled with the planted crop. Worse outcomes say
+    what not to plant, which a classifier cannot learn from directly.
+
+    Returns (X, y, counts): float32 feature rows in model input order, crop
+    names, and how many records were read, used or skipped.
+    """
+    fields = list(label_encoders)
+    min_code = OUTCOMES.index(min_outcome)
+    counts = {'records': 0, 'used': 0, 'below_min_outcome': 0, 'unknown_category': 0}
+    X_parts, y_parts = [], []
+    for vocabulary, records in read_segments(directory):
+        counts['records'] += len(records)
+        keep = records['outcome'] >= min_code
+        counts['below_min_outcome'] += int(np.count_nonzero(~keep))
+
+        # Map each segment code to the target code; -1 where the target does not know the value
+        categorical = np.empty((len(records), len(fields)), dtype=np.int64)
+        for j, field in enumerate(fields):
+            target = {value: index for index, value in enumerate(label_encoders[field])}
+            mapping = np.array([target.get(value, -1) for value in vocabulary['label_encoders'][field]])
+            categorical[:, j] = mapping[records['categorical'][:, j]]
+        target_classes = {crop: index for index, crop in enumerate(classes)}
+        crops = np.array([target_classes.get(crop, -1) for crop in vocabulary['classes']])[records['crop']]
+        known = (categorical >= 0).all(axis=1) & (crops >= 0)
+        counts['unknown_category'] += int(np.count_nonzero(keep & ~known))
+
+        keep &= known
+        X_parts.append(np.hstack([records['numerical'][keep], categorical[keep].astype(np.float32)]))
+        y_parts.append(np.asarray(classes)[crops[keep]])
+
+    if not X_parts:
+        return np.empty((0, N_NUMERICAL + len(fields)), dtype=np.float32), np.empty(0, dtype=object), counts
+    X = np.vstack(X_parts).astype(np.float32)
+    y = np.concatenate(y_parts)
+    counts['used'] = len(X)
+    return X, y, counts
+
+
+class RetrainJob:
+    """
+    Runs retrain_feedback.py in a child process so training never competes with
+    request threads for the GIL, and reports its progress
+
+    - cwd:     directory the script runs in (the service directory)
+    - log_dir: where the script's output is appended to retrain.log
+    - on_done: optional callback(result) with the script's JSON result after a successful run
+    """
+
+    def __init__(self, cwd, log_dir=FEEDBACK_DIR, on_done=None):
+        self.cwd = cwd
+        self.log_dir = log_dir
+        self.on_done = on_done
+        self._lock = threading.Lock()
+        self._process = None
+        self.state = 'idle'
+        self.started_at = None
+        self.finished_at = None
+        self.returncode = None
+        self.result = None
+        self.error = None
+
+    def start(self, arguments):
+        """Start a run with extra command line arguments; False when one is already running here"""
+        with self._lock:
+            if self.state == 'running':
+                return False
+            os.makedirs(os.path.join(self.cwd, self.log_dir), exist_ok=True)
+            command = [sys.executable, 'retrain_feedback.py', '--feedback-dir', self.log_dir] + arguments
+            self._process = subprocess.Popen(command, cwd=self.cwd, stdout=subprocess.PIPE,
+                                             stderr=subprocess.STDOUT, text=True)
+            self.state = 'running'
+            self.started_at = datetime.now().isoformat()
+            self.finished_at = self.returncode = self.result = self.error = None
+        threading.Thread(target=self._wait, args=(self._process,), name='retrain', daemon=True).start()
+        return True
+
+    def _wait(self, process):
+        output, _ = process.communicate()
+        result = None
+        for line in output.splitlines():
+            if line.startswith(RESULT_PREFIX):
+                result = json.loads(line[len(RESULT_PREFIX):])
+        try:
+            with open(os.path.join(self.cwd, self.log_dir, RETRAIN_LOG_FILENAME), 'a', encoding='utf-8') as f:
+                f.write(f'--- {self.started_at} ---\n{output}')
+        except OSError:
+            pass
+
+        error = None
+        if process.returncode != 0:
+            error = (output.strip().splitlines() or [f'exit code {process.returncode}'])[-1]
+        elif result is not None and self.on_done is not None:
+            try:
+                self.on_done(result)
+            except Exception as e:
+                error = str(e)
+        with self._lock:
+            self.state = 'failed' if error else 'finished'
+            self.finished_at = datetime.now().isoformat()
+            self.returncode = process.returncode
+            self.result = result
+            self.error = error
+
+    def status(self):
+        """State of the last run, reported by GET /admin/retrain"""
+        with self._lock:
+            return {
+                'state': self.state,
+                'pid': self._process.pid if self._process else None,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'returncode': self.returncode,
+                'result': self.result,
+                'error': self.error
+            }
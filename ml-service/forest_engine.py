@@ -0,0 +1,501 @@
+"""
+Array-backed inference engine for the crop recommendation Random Forest
+
+Flattens every tree of a trained RandomForestClassifier into one set of NumPy
+node arrays, so scoring is a few vectorized array lookups per tree level
+instead of sklearn's per-tree estimator calls. Probabilities and the top class
+come out of the same pass.
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+
+# Rows scored together on the batch path (bounds temporary memory)
+BATCH_CHUNK_ROWS = 4096
+
+# measure_latency settings
+LATENCY_WARMUP_CALLS = 20
+BATCH_LATENCY_ROWS = 1000
+BATCH_LATENCY_REPEATS = 5
+
+# Node arrays written by ForestEngine.save, one .npy file each
+ARRAY_NAMES = ['feature', 'threshold', 'children', 'value', 'roots']
+ARTIFACT_VERSION = 2
+
+# Version 1 artifacts have no value_scale (always float probabilities)
+SUPPORTED_ARTIFACT_VERSIONS = (1, 2)
+
+# Leaf distributions stored as uint16 are scaled so each node sums to this
+COMPACT_VALUE_SCALE = 65535
+
+# Nodes whose class distributions compact() quantizes at a time
+COMPACT_BLOCK_NODES = 16384
+
+
+class ForestEngine:
+    """
+    Flat node-array representation of a RandomForestClassifier
+
+    All trees share the same arrays, with one entry per node:
+    - feature:   index of the feature tested at the node (0 for leaves)
+    - threshold: split threshold, rows with `x <= threshold` go left (+inf for leaves)
+    - children:  (n_nodes, 2) left/right child ids, leaves point back to themselves
+    - value:     (n_nodes, n_classes) class distribution of the node, normalized to 1
+    - roots:     id of the root node of each tree
+
+    `value` is either float probabilities (value_scale=1) or integers that sum
+    to value_scale for each node, as written by compact().
+    """
+
+    def __init__(self, feature, threshold, children, value, roots, classes, max_depth, value_scale=1):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.value = value
+        self.roots = roots
+        self.classes = np.asarray(classes)
+        self.max_depth = int(max_depth)
+        self.value_scale = value_scale
+        self.is_leaf = children[:, 0] == np.arange(len(children))
+        self.n_trees = len(roots)
+        self.n_nodes = len(feature)
+
+    @classmethod
+    def from_sklearn(cls, forest, classes=None):
+        """
+        Build an engine from a fitted sklearn RandomForestClassifier, or from a
+        multi-output RandomForestRegressor fitted on class probabilities, one
+        output per entry of `classes` (see distill_model.py)
+        """
+        features, thresholds, children, values, roots = [], [], [], [], []
+        offset = 0
+
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            node_ids = np.arange(tree.node_count) + offset
+            leaf = tree.children_left == -1
+
+            features.append(np.where(leaf, 0, tree.feature))
+            thresholds.append(np.where(leaf, np.inf, tree.threshold))
+            children.append(np.column_stack([
+                np.where(leaf, node_ids, tree.children_left + offset),
+                np.where(leaf, node_ids, tree.children_right + offset)
+            ]))
+
+            # Same per-tree normalization sklearn applies in predict_proba
+            value = tree.value[:, 0, :] if classes is None else tree.value[:, :, 0]
+            normalizer = value.sum(axis=1, keepdims=True)
+            normalizer[normalizer == 0] = 1
+            values.append(value / normalizer)
+
+            roots.append(offset)
+            offset += tree.node_count
+
+        return cls(
+            feature=np.concatenate(features).astype(np.intp),
+            threshold=np.concatenate(thresholds).astype(np.float64),
+            children=np.concatenate(children).astype(np.intp),
+            value=np.concatenate(values).astype(np.float64),
+            roots=np.array(roots, dtype=np.intp),
+            classes=forest.classes_ if classes is None else classes,
+            max_depth=max(estimator.tree_.max_depth for estimator in forest.estimators_)
+        )
+
+    def save(self, directory):
+        """
+        Write the node arrays as raw .npy files plus an engine.json metadata file.
+        Each file is written next to its final name and then renamed over it, so
+        processes that still have the old files memory-mapped keep a valid copy.
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAY_NAMES:
+            path = os.path.join(directory, f'{name}.npy')
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, np.ascontiguousarray(getattr(self, name)))
+            os.replace(path + '.tmp', path)
+
+        metadata = {
+            'artifact_version': ARTIFACT_VERSION,
+            'classes': self.classes.tolist(),
+            'max_depth': self.max_depth,
+            'value_scale': self.value_scale,
+            'n_trees': self.n_trees,
+            'n_nodes': self.n_nodes
+        }
+        path = os.path.join(directory, 'engine.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(metadata, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        Load an engine written by save(). With mmap=True the node arrays are
+        memory-mapped read-only, so worker processes share the same pages and
+        load time does not grow with model size.
+        """
+        with open(os.path.join(directory, 'engine.json'), 'r') as f:
+            metadata = json.load(f)
+        if metadata.get('artifact_version') not in SUPPORTED_ARTIFACT_VERSIONS:
+            raise ValueError(f'Unsupported model artifact version: {metadata.get("artifact_version")}')
+
+        # Plain ndarray views of the maps: same shared pages, without the np.memmap
+        # subclass overhead on every indexing step of a prediction
+        arrays = {
+            name: np.asarray(np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r' if mmap else None))
+            for name in ARRAY_NAMES
+        }
+        return cls(classes=metadata['classes'], max_depth=metadata['max_depth'],
+                   value_scale=metadata.get('value_scale', 1), **arrays)
+
+    @property
+    def nbytes(self):
+        """Total size of the node arrays"""
+        return int(sum(getattr(self, name).nbytes for name in ARRAY_NAMES))
+
+    def node_depths(self):
+        """Depth of every node, roots are at depth 0"""
+        depths = np.zeros(self.n_nodes, dtype=np.int32)
+        frontier = np.asarray(self.roots)
+        depth = 0
+        while frontier.size:
+            depths[frontier] = depth
+            frontier = self.children[frontier[~self.is_leaf[frontier]]].ravel()
+            depth += 1
+        return depths
+
+    def prune(self, trees=None, max_depth=None):
+        """
+        New engine with only the given trees (indices into roots) and every node
+        below max_depth cut off. Nodes at max_depth become leaves and keep the
+        class distribution stored for them, like a tree trained with that depth.
+        """
+        tree_of_node = np.repeat(np.arange(self.n_trees), np.diff(np.append(self.roots, self.n_nodes)))
+        keep = np.ones(self.n_nodes, dtype=bool)
+        if trees is not None:
+            keep &= np.isin(tree_of_node, trees)
+        depths = self.node_depths()
+        cut = np.zeros(self.n_nodes, dtype=bool)
+        if max_depth is not None:
+            keep &= depths <= max_depth
+            cut = depths == max_depth
+
+        node_ids = np.flatnonzero(keep)
+        new_ids = np.full(self.n_nodes, -1, dtype=np.intp)
+        new_ids[node_ids] = np.arange(len(node_ids))
+
+        leaf = self.is_leaf[node_ids] | cut[node_ids]
+        own_ids = np.arange(len(node_ids))
+        children = np.column_stack([
+            np.where(leaf, own_ids, new_ids[self.children[node_ids, 0]]),
+            np.where(leaf, own_ids, new_ids[self.children[node_ids, 1]])
+        ])
+        roots = np.asarray(self.roots)[np.sort(trees) if trees is not None else slice(None)]
+
+        return ForestEngine(
+            feature=np.where(leaf, 0, self.feature[node_ids]).astype(self.feature.dtype),
+            threshold=np.where(leaf, np.inf, self.threshold[node_ids]).astype(self.threshold.dtype),
+            children=children.astype(self.children.dtype),
+            value=np.asarray(self.value[node_ids]),
+            roots=new_ids[roots].astype(self.roots.dtype),
+            classes=self.classes,
+            max_depth=int(depths[node_ids].max()) if len(node_ids) else 0,
+            value_scale=self.value_scale
+        )
+
+    def specialize(self, fixed):
+        """
+        New engine for rows whose features in `fixed` ({feature index: value})
+        all take the given values. Splits on fixed features are decided once:
+        every child pointer is redirected to the first descendant that tests a
+        free feature (or to a leaf). Many rows that only differ in the free
+        features, such as every categorical combination for one soil test,
+        then only walk the splits on those. Rows scored with it must still
+        carry the fixed values. Node arrays other than children are shared.
+        """
+        n_features = max(int(self.feature.max()) if self.n_nodes else 0, max(fixed, default=0)) + 1
+        is_fixed = np.zeros(n_features, dtype=bool)
+        values = np.zeros(n_features, dtype=np.float32)
+        for index, value in fixed.items():
+            is_fixed[index] = True
+            values[index] = value
+
+        # Follow fixed splits one level per step until every node resolves to a free split or a leaf
+        resolved = np.arange(self.n_nodes)
+        pending = np.flatnonzero(~self.is_leaf & is_fixed[self.feature])
+        while pending.size:
+            nodes = resolved[pending]
+            go_right = values[self.feature[nodes]] > self.threshold[nodes]
+            resolved[pending] = self.children[nodes, go_right.astype(np.intp)]
+            nodes = resolved[pending]
+            pending = pending[~self.is_leaf[nodes] & is_fixed[self.feature[nodes]]]
+
+        return ForestEngine(
+            feature=self.feature,
+            threshold=self.threshold,
+            children=resolved[self.children].astype(self.children.dtype),
+            value=self.value,
+            roots=resolved[self.roots].astype(np.asarray(self.roots).dtype),
+            classes=self.classes,
+            max_depth=self.max_depth,
+            value_scale=self.value_scale
+        )
+
+    def predict_proba_product(self, fixed, free):
+        """
+        Class probabilities for every combination of the `free` features
+        ({feature index: n}, each taking the integer codes 0..n-1) with all
+        other features fixed ({feature index: value}). Returns an array of shape
+        (n_1, ..., n_k, n_classes), one axis per free feature in the given order.
+
+        Instead of walking every combination through every tree, the trees are
+        specialized to the fixed values and each reachable leaf is found
+        together with the box of codes that reaches it. Leaf values are added
+        to their boxes with a k-dimensional difference array, so the cost
+        follows the number of reachable leaves, not the number of combinations.
+        """
+        engine = self.specialize(fixed)
+        free_features = list(free)
+        sizes = np.array([free[index] for index in free_features], dtype=np.intp)
+        axis_of_feature = np.full(max(max(free_features, default=0), int(self.feature.max()) if self.n_nodes else 0) + 1, -1)
+        axis_of_feature[free_features] = np.arange(len(free_features))
+
+        # Frontier of (node, box) pairs; a box is an inclusive code range per free feature
+        nodes = np.asarray(engine.roots, dtype=np.intp)
+        low = np.zeros((len(nodes), len(sizes)), dtype=np.intp)
+        high = np.tile(sizes - 1, (len(nodes), 1))
+        leaves, leaf_low, leaf_high = [], [], []
+        while nodes.size:
+            leaf = engine.is_leaf[nodes]
+            leaves.append(nodes[leaf])
+            leaf_low.append(low[leaf])
+            leaf_high.append(high[leaf])
+            nodes, low, high = nodes[~leaf], low[~leaf], high[~leaf]
+
+            axes = axis_of_feature[engine.feature[nodes]]
+            if (axes < 0).any():
+                raise ValueError('Every feature the trees use must be fixed or free')
+            # Codes are integers, so `code <= threshold` means `code <= floor(threshold)`
+            split = np.floor(np.asarray(engine.threshold[nodes], dtype=np.float64)).astype(np.intp)
+            rows = np.arange(len(nodes))
+            left_high = high.copy()
+            left_high[rows, axes] = np.minimum(high[rows, axes], split)
+            right_low = low.copy()
+            right_low[rows, axes] = np.maximum(low[rows, axes], split + 1)
+
+            nodes = np.concatenate([engine.children[nodes, 0], engine.children[nodes, 1]])
+            low = np.concatenate([low, right_low])
+            high = np.concatenate([left_high, high])
+            nonempty = (low <= high).all(axis=1)
+            nodes, low, high = nodes[nonempty], low[nonempty], high[nonempty]
+
+        leaves = np.concatenate(leaves)
+        low = np.concatenate(leaf_low)
+        high = np.concatenate(leaf_high)
+        values = np.asarray(engine.value, dtype=np.float64)[leaves]
+        if not len(sizes):
+            return values.sum(axis=0) / (self.n_trees * self.value_scale)
+
+        # Difference array: +value at every box corner with an even number of
+        # upper bounds, -value at the others; prefix sums along every axis fill the box
+        n_classes = values.shape[1]
+        shape = tuple(sizes + 1)
+        corners = np.array(list(np.ndindex(*([2] * len(sizes)))), dtype=bool)
+        coordinates = np.where(corners[:, np.newaxis, :], high[np.newaxis] + 1, low[np.newaxis])
+        flat = np.ravel_multi_index(coordinates.reshape(-1, len(sizes)).T, shape)
+        signs = np.where(corners.sum(axis=1) % 2, -1.0, 1.0)
+        signed_values = (signs[:, np.newaxis, np.newaxis] * values[np.newaxis]).reshape(-1, n_classes)
+
+        order = np.argsort(flat, kind='stable')
+        flat = flat[order]
+        starts = np.flatnonzero(np.r_[True, flat[1:] != flat[:-1]])
+        difference = np.zeros((int(np.prod(shape)), n_classes))
+        difference[flat[starts]] = np.add.reduceat(signed_values[order], starts, axis=0)
+
+        totals = difference.reshape(shape + (n_classes,))
+        for axis in range(len(sizes)):
+            totals = np.cumsum(totals, axis=axis)
+        totals = totals[tuple(slice(0, size) for size in sizes)]
+        return totals / (self.n_trees * self.value_scale)
+
+    def compact(self):
+        """
+        New engine with narrow dtypes: uint8 feature ids, float32 thresholds
+        and uint16 class distributions. Child ids stay intp, narrower index
+        arrays make every tree step slower than they save.
+
+        Thresholds are rounded down to the nearest float32. Features are float32
+        too, so `x <= threshold` gives exactly the same split as before. Class
+        distributions are quantized to COMPACT_VALUE_SCALE steps with largest
+        remainder rounding, so every node still sums exactly to 1.
+        """
+        threshold = np.asarray(self.threshold, dtype=np.float32)
+        rounded_up = threshold > self.threshold
+        threshold[rounded_up] = np.nextafter(threshold[rounded_up], np.float32(-np.inf))
+
+        if self.value_scale == 1:
+            # In blocks of nodes: the float64 and rank temporaries of the whole forest would
+            # take several times the size of the uncompacted arrays
+            value = np.empty(self.value.shape, dtype=np.uint16)
+            for first in range(0, self.n_nodes, COMPACT_BLOCK_NODES):
+                scaled = np.asarray(self.value[first:first + COMPACT_BLOCK_NODES], dtype=np.float64) \
+                    * COMPACT_VALUE_SCALE
+                quantized = np.floor(scaled)
+                shortfall = COMPACT_VALUE_SCALE - quantized.sum(axis=1)
+                # Hand the leftover steps to the classes with the largest remainders
+                order = np.argsort(quantized - scaled, axis=1, kind='stable')
+                ranks = np.argsort(order, axis=1, kind='stable')
+                quantized += ranks < shortfall[:, np.newaxis]
+                value[first:first + COMPACT_BLOCK_NODES] = quantized
+        else:
+            value = np.asarray(self.value).astype(np.uint16)
+
+        return ForestEngine(
+            feature=np.asarray(self.feature).astype(np.min_scalar_type(int(self.feature.max()) if self.n_nodes else 0)),
+            threshold=threshold,
+            children=np.asarray(self.children).astype(np.intp),
+            value=value,
+            roots=np.asarray(self.roots).astype(np.intp),
+            classes=self.classes,
+            max_depth=self.max_depth,
+            value_scale=COMPACT_VALUE_SCALE
+        )
+
+    def predict_proba(self, X):
+        """Class probabilities for a 2D array of encoded feature rows"""
+        # sklearn trees compare float32 features against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2:
+            raise ValueError(f'Expected a 2D array of feature rows, got shape {X.shape}')
+
+        if len(X) == 1:
+            return self._predict_row(X[0])[np.newaxis, :]
+
+        probabilities = np.empty((len(X), self.value.shape[1]))
+        for start in range(0, len(X), BATCH_CHUNK_ROWS):
+            chunk = X[start:start + BATCH_CHUNK_ROWS]
+            probabilities[start:start + len(chunk)] = self._predict_batch(chunk)
+        return probabilities
+
+    def apply(self, X):
+        """Leaf node id reached in every tree, shape (n_rows, n_trees) like sklearn's apply"""
+        X = np.asarray(X, dtype=np.float32)
+        leaves = np.empty((len(X), self.n_trees), dtype=np.intp)
+        for start in range(0, len(X), BATCH_CHUNK_ROWS):
+            chunk = X[start:start + BATCH_CHUNK_ROWS]
+            leaves[start:start + len(chunk)] = self._leaf_nodes(chunk).T
+        return leaves
+
+    def predict_with_proba(self, X):
+        """Predicted crop labels and class probabilities from a single pass"""
+        probabilities = self.predict_proba(X)
+        return self.classes[np.argmax(probabilities, axis=1)], probabilities
+
+    def _predict_row(self, row):
+        """Fast path for one row: walk all trees together, one level per step"""
+        children = self.children.ravel()
+        nodes = self.roots
+        for _ in range(self.max_depth):
+            go_right = row[self.feature[nodes]] > self.threshold[nodes]
+            nodes = children[2 * nodes + go_right]
+        return self.value.take(nodes, axis=0).sum(axis=0) / (self.n_trees * self.value_scale)
+
+    def _predict_batch(self, X):
+        """Vectorized path for many rows"""
+        probabilities = np.zeros((len(X), self.value.shape[1]))
+        for tree_leaves in self._leaf_nodes(X):
+            probabilities += self.value.take(tree_leaves, axis=0)
+        return probabilities / (self.n_trees * self.value_scale)
+
+    def _leaf_nodes(self, X):
+        """
+        Leaf reached by every (tree, row) pair, shape (n_trees, n_rows)
+
+        Every pair advances one level per step and pairs that have reached a
+        leaf are dropped, so work follows the real path lengths.
+        """
+        n_rows, n_features = X.shape
+        X_flat = X.ravel()
+        children = self.children.ravel()
+
+        # (tree, row) pairs, laid out tree by tree
+        nodes = np.repeat(self.roots, n_rows)
+        row_offsets = np.tile(np.arange(n_rows) * n_features, self.n_trees)
+
+        active = np.flatnonzero(~self.is_leaf[nodes])
+        current = nodes[active]
+        row_offsets = row_offsets[active]
+
+        while active.size:
+            go_right = X_flat[row_offsets + self.feature[current]] > self.threshold[current]
+            current = children[2 * current + go_right]
+            nodes[active] = current
+
+            internal = ~self.is_leaf[current]
+            active = active[internal]
+            current = current[internal]
+            row_offsets = row_offsets[internal]
+
+        return nodes.reshape(self.n_trees, n_rows)
+
+
+def measure_latency(engine, X, single_row_calls=500):
+    """Single-row p50/p99 and batch latency of the inference engine in milliseconds"""
+    rows = X[np.arange(single_row_calls + LATENCY_WARMUP_CALLS) % len(X)]
+    timings = []
+    for i, row in enumerate(rows):
+        start = time.perf_counter()
+        engine.predict_proba(row[np.newaxis, :])
+        if i >= LATENCY_WARMUP_CALLS:
+            timings.append((time.perf_counter() - start) * 1000)
+
+    batch = X[:BATCH_LATENCY_ROWS]
+    batch_timings = []
+    for _ in range(BATCH_LATENCY_REPEATS):
+        start = time.perf_counter()
+        engine.predict_proba(batch)
+        batch_timings.append((time.perf_counter() - start) * 1000)
+
+    p50, p99 = np.percentile(timings, [50, 99])
+    return {
+        'single_row_p50_ms': float(p50),
+        'single_row_p99_ms': float(p99),
+        'batch_rows': len(batch),
+        'batch_ms': float(np.median(batch_timings))
+    }
+
+
+def check_parity(engine, forest, X, tolerance=1e-9):
+    """
+    Compare engine output with sklearn's predict_proba on the same rows.
+    Raises AssertionError on any mismatch and returns a small report otherwise.
+    """
+    expected = forest.predict_proba(X)
+    labels, probabilities = engine.predict_with_proba(np.asarray(X))
+
+    max_difference = float(np.abs(probabilities - expected).max())
+    if max_difference > tolerance:
+        raise AssertionError(f'Probabilities differ from sklearn by {max_difference:.3g}')
+
+    # Only compare labels where the top two classes are not tied within tolerance
+    top_two = np.sort(expected, axis=1)[:, -2:]
+    decided = (top_two[:, 1] - top_two[:, 0]) > tolerance
+    expected_labels = forest.classes_[np.argmax(expected, axis=1)]
+    mismatches = int((labels[decided] != expected_labels[decided]).sum())
+    if mismatches:
+        raise AssertionError(f'{mismatches} predicted labels differ from sklearn')
+
+    # Also check the single-row fast path
+    for i in range(min(len(X), 50)):
+        single = engine.predict_proba(np.asarray(X[i:i + 1]))
+        if not np.allclose(single, forest.predict_proba(X[i:i + 1]), atol=tolerance):
+            raise AssertionError('Single-row probabilities differ from sklearn')
+
+    return {
+        'rows': len(X),
+        'max_probability_difference': max_difference,
+        'label_agreement': float((labels == expected_labels).mean())
+    }
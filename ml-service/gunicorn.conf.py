@@ -0,0 +1,60 @@
+"""
+Production server configuration for the ML service
+
+    gunicorn -c gunicorn.conf.py
+
+The master process imports app.py once (preload_app), which loads and warms up
+the model, then forks the workers. The model arrays and every other object
+created at import are shared copy-on-write between the workers. Moving them to
+the permanent GC generation before forking keeps the collector from writing to
+(and so un-sharing) their pages. Each worker restarts the background threads,
+which are lost on fork, and runs warm-up predictions before it takes traffic;
+GET /health/ready answers 503 until then. Unless MODEL_WATCH_INTERVAL is set,
+workers poll models/CURRENT every 10 seconds.
+"""
+
+import gc
+import os
+
+wsgi_app = 'app:app'
+bind = os.environ.get('BIND', '0.0.0.0:5001')
+
+# Prediction is CPU bound, so one process per core. Each worker also runs a few
+# threads so I/O-bound requests overlap and micro-batching has rows to group.
+workers = int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+
+# Load the model once in the master, before fork
+preload_app = True
+
+# POST /admin/reload and /admin/retrain only swap the model in the worker that
+# answered them. Every worker watches models/CURRENT so all of them follow the
+# active version within this many seconds. Set before app.py is imported.
+os.environ.setdefault('MODEL_WATCH_INTERVAL', '10')
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = 30
+keepalive = 5
+
+# Restart workers now and then to bound memory growth; jitter avoids restarting them all at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+
+
+def when_ready(server):
+    """Runs in the master after the app was preloaded, before the first fork"""
+    gc.collect()
+    gc.freeze()
+    server.log.info("Froze %d objects allocated at startup into the permanent GC generation",
+                    gc.get_freeze_count())
+
+
+def post_worker_init(worker):
+    """Runs in each worker after fork, before it accepts connections"""
+    import app
+
+    if app.init_worker():
+        worker.log.info("Worker %s ready with model %s", worker.pid, app.registry.active.version)
+    else:
+        worker.log.warning("Worker %s has no model loaded and will report not ready", worker.pid)
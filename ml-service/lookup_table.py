@@ -0,0 +1,376 @@
+"""
+Precomputed recommendation lookup table
+
+The numerical inputs are cut into a fixed number of equal-width bins between
+their validated ranges, and every (numerical bins, state, season, soil type,
+irrigation, farm size) combination is one cell. The full grid has tens of
+millions of cells, most of which no farm ever falls into. So the table is
+built from a large reference sample drawn like the training data. Each cell
+stores the model's own top-k crops and probabilities for the cell's centre
+point, so a hit answers the request as if its numerical inputs were rounded
+to the bin centres. A cell is kept only when enough samples fell into it and
+the model gives (nearly) all of them the same top crop as the centre.
+Requests that land in any other cell fall back to the model.
+
+Lookup is a few integer operations and one binary search over the sorted
+cell keys, so a covered request skips the model entirely.
+
+The table is never written into a published version. The script publishes
+a new version with the same model files plus the table, and only then moves
+models/CURRENT to it (when the source version was CURRENT).
+
+Usage:
+    python lookup_table.py                       # table for models/CURRENT
+    python lookup_table.py --bins 6 --rows-multiplier 50
+    python lookup_table.py --version 20251123-101500 --min-purity 0.9
+    python lookup_table.py --match-top 3         # only cells whose alternatives match too
+"""
+
+import argparse
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+
+import numpy as np
+
+from compress_model import top3_agreement
+
+LOOKUP_TABLE_DIRNAME = 'lookup_table'
+LOOKUP_TABLE_FORMAT_VERSION = 1
+ARRAY_NAMES = ['keys', 'top_classes', 'top_probabilities']
+
+# Crops stored per cell: the prediction plus the three alternatives /predict returns
+DEFAULT_TOP_K = 4
+
+# Lookups timed by the report
+LATENCY_CALLS = 2000
+
+
+def cell_keys(numerical, categorical, lows, highs, bins, categorical_sizes):
+    """Cell key of every row: numerical bins and categorical codes as one mixed-radix integer"""
+    numerical = np.asarray(numerical, dtype=np.float64)
+    bins = np.asarray(bins, dtype=np.int64)
+    scale = bins / (np.asarray(highs, dtype=np.float64) - np.asarray(lows, dtype=np.float64))
+    indices = np.floor((numerical - lows) * scale).astype(np.int64).clip(0, bins - 1)
+
+    keys = np.zeros(len(numerical), dtype=np.int64)
+    for column, count in zip(indices.T, bins):
+        keys = keys * count + column
+    for column, size in zip(np.asarray(categorical, dtype=np.int64).T, categorical_sizes):
+        keys = keys * size + column
+    return keys
+
+
+def cell_centres(keys, lows, highs, bins, categorical_sizes):
+    """Numerical bin centres and categorical codes of every cell key, the inverse of cell_keys"""
+    keys = np.array(keys, dtype=np.int64)
+    categorical = np.empty((len(keys), len(categorical_sizes)), dtype=np.int64)
+    for column in reversed(range(len(categorical_sizes))):
+        keys, categorical[:, column] = np.divmod(keys, categorical_sizes[column])
+    numerical = np.empty((len(keys), len(bins)), dtype=np.float64)
+    for column in reversed(range(len(bins))):
+        keys, index = np.divmod(keys, bins[column])
+        width = (highs[column] - lows[column]) / bins[column]
+        numerical[:, column] = lows[column] + (index + 0.5) * width
+    return numerical, categorical
+
+
+class LookupTable:
+    """Top-k crops and probabilities for the covered cells of a quantized input grid"""
+
+    def __init__(self, keys, top_classes, top_probabilities, lows, highs, bins, categorical_sizes,
+                 n_classes, model_version=None, report=None):
+        self.keys = keys
+        self.top_classes = top_classes
+        self.top_probabilities = top_probabilities
+        self.lows = [float(low) for low in lows]
+        self.highs = [float(high) for high in highs]
+        self.bins = [int(count) for count in bins]
+        self.categorical_sizes = [int(size) for size in categorical_sizes]
+        self.n_classes = int(n_classes)
+        self.model_version = model_version
+        self.report = report or {}
+        # (low, bins per unit, bins) for each numerical feature, for the scalar lookup
+        self._numerical_grid = [(low, count / (high - low), count)
+                                for low, high, count in zip(self.lows, self.highs, self.bins)]
+
+    @property
+    def n_cells(self):
+        return len(self.keys)
+
+    @property
+    def nbytes(self):
+        return int(sum(getattr(self, name).nbytes for name in ARRAY_NAMES))
+
+    def cell_keys(self, numerical, categorical):
+        return cell_keys(numerical, categorical, self.lows, self.highs, self.bins, self.categorical_sizes)
+
+    def lookup(self, numerical, categorical):
+        """
+        Class probabilities (top-k filled in, zeros elsewhere) for one row, or
+        None when its cell is not covered
+        """
+        key = 0
+        for value, (low, scale, count) in zip(numerical, self._numerical_grid):
+            index = int((value - low) * scale)
+            key = key * count + (0 if index < 0 else count - 1 if index >= count else index)
+        for code, size in zip(categorical, self.categorical_sizes):
+            key = key * size + code
+
+        position = int(np.searchsorted(self.keys, key))
+        if position == len(self.keys) or self.keys[position] != key:
+            return None
+        probabilities = np.zeros(self.n_classes)
+        probabilities[self.top_classes[position]] = self.top_probabilities[position]
+        return probabilities
+
+    def lookup_many(self, numerical, categorical):
+        """Row index into the table for every row, -1 where the cell is not covered"""
+        keys = self.cell_keys(numerical, categorical)
+        positions = np.searchsorted(self.keys, keys).clip(0, max(len(self.keys) - 1, 0))
+        found = (self.keys[positions] == keys) if len(self.keys) else np.zeros(len(keys), dtype=bool)
+        return np.where(found, positions, -1)
+
+    def save(self, directory):
+        """Write the arrays and lookup_table.json into a new `directory` of an unpublished version"""
+        os.makedirs(directory)
+        for name in ARRAY_NAMES:
+            np.save(os.path.join(directory, f'{name}.npy'), np.ascontiguousarray(getattr(self, name)))
+        metadata = {
+            'format_version': LOOKUP_TABLE_FORMAT_VERSION,
+            'model_version': self.model_version,
+            'lows': self.lows,
+            'highs': self.highs,
+            'bins': self.bins,
+            'categorical_sizes': self.categorical_sizes,
+            'n_classes': self.n_classes,
+            'report': self.report
+        }
+        with open(os.path.join(directory, 'lookup_table.json'), 'w') as f:
+            json.dump(metadata, f, indent=2)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        with open(os.path.join(directory, 'lookup_table.json'), 'r') as f:
+            metadata = json.load(f)
+        if metadata.get('format_version') != LOOKUP_TABLE_FORMAT_VERSION:
+            raise ValueError(f'Unsupported lookup table format: {metadata.get("format_version")}')
+        arrays = {
+            name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r' if mmap else None)
+            for name in ARRAY_NAMES
+        }
+        return cls(lows=metadata['lows'], highs=metadata['highs'], bins=metadata['bins'],
+                   categorical_sizes=metadata['categorical_sizes'], n_classes=metadata['n_classes'],
+                   model_version=metadata['model_version'], report=metadata.get('report'), **arrays)
+
+
+def build_lookup_table(engine, numerical, categorical, lows, highs, bins, categorical_sizes,
+                       top_k=DEFAULT_TOP_K, min_samples=2, min_purity=1.0, match_top=1, model_version=None):
+    """
+    Build the table from reference samples (numerical and encoded categorical
+    columns). Every cell with at least `min_samples` samples is scored by the
+    model at its centre. It is kept when at least `min_purity` of its samples
+    get the centre's top `match_top` crops, in the same order, from the model.
+    It stores the centre's top-k.
+    """
+    keys = cell_keys(numerical, categorical, lows, highs, bins, categorical_sizes)
+    sample_probabilities = engine.predict_proba(np.hstack([numerical, categorical]))
+
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    sample_probabilities = sample_probabilities[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    counts = np.diff(np.r_[starts, len(keys)])
+    scored = np.flatnonzero(counts >= min_samples)
+
+    centre_probabilities = engine.predict_proba(np.hstack(
+        cell_centres(keys[starts[scored]], lows, highs, bins, categorical_sizes)))
+    centre_top = np.full((len(starts), match_top), -1)
+    centre_top[scored] = np.argsort(-centre_probabilities, axis=1, kind='stable')[:, :match_top]
+    sample_top = np.argsort(-sample_probabilities, axis=1, kind='stable')[:, :match_top]
+    # Crops the model gives zero probability are ties in arbitrary order, so they are not compared
+    relevant = np.take_along_axis(sample_probabilities, sample_top, axis=1) > 0
+    matching = ((sample_top == np.repeat(centre_top, counts, axis=0)) | ~relevant).all(axis=1)
+    agreeing = np.add.reduceat(matching.astype(np.int64), starts)
+    keep = (agreeing[scored] >= min_purity * counts[scored])
+
+    centre_probabilities = centre_probabilities[keep]
+    top_classes = np.argsort(-centre_probabilities, axis=1, kind='stable')[:, :top_k]
+    top_probabilities = np.take_along_axis(centre_probabilities, top_classes, axis=1)
+
+    return LookupTable(keys[starts[scored[keep]]], top_classes.astype(np.uint8),
+                       top_probabilities.astype(np.float32), lows, highs, bins, categorical_sizes,
+                       len(engine.classes), model_version)
+
+
+def evaluate_lookup_table(table, engine, numerical, categorical, latency_calls=LATENCY_CALLS):
+    """
+    Coverage and agreement with the model on held-out samples, and the time of
+    a table lookup next to a single-row model call
+    """
+    positions = table.lookup_many(numerical, categorical)
+    covered = positions >= 0
+    model_probabilities = engine.predict_proba(np.hstack([numerical, categorical])[covered])
+
+    table_probabilities = np.zeros((int(covered.sum()), table.n_classes))
+    np.put_along_axis(table_probabilities, np.asarray(table.top_classes[positions[covered]], dtype=np.int64),
+                      table.top_probabilities[positions[covered]], axis=1)
+    top1_agreement = float((table_probabilities.argmax(axis=1) == model_probabilities.argmax(axis=1)).mean()) \
+        if covered.any() else 0.0
+    top3 = top3_agreement(table_probabilities, model_probabilities) if covered.any() else 0.0
+    coverage = float(covered.mean())
+
+    rows = np.flatnonzero(covered)[:latency_calls] if covered.any() else np.arange(min(latency_calls, len(covered)))
+    numerical_rows = numerical[rows].tolist()
+    categorical_rows = categorical[rows].tolist()
+    started = time.perf_counter()
+    for numerical_row, categorical_row in zip(numerical_rows, categorical_rows):
+        table.lookup(numerical_row, categorical_row)
+    lookup_us = (time.perf_counter() - started) / max(len(rows), 1) * 1e6
+
+    model_rows = np.hstack([numerical, categorical])[rows[:200]]
+    started = time.perf_counter()
+    for row in model_rows:
+        engine.predict_proba(row[np.newaxis, :])
+    model_us = (time.perf_counter() - started) / max(len(model_rows), 1) * 1e6
+
+    return {
+        'cells': table.n_cells,
+        'table_bytes': table.nbytes,
+        'samples': len(covered),
+        'coverage': coverage,
+        'top1_agreement': top1_agreement,
+        'top3_agreement': top3,
+        # Top-1 agreement of what /predict serves: the table where covered, the model elsewhere
+        'served_top1_agreement': coverage * top1_agreement + (1 - coverage),
+        'lookup_us': lookup_us,
+        'model_single_row_us': model_us
+    }
+
+
+def print_lookup_report(report):
+    print(f"📇 Lookup table: {report['cells']:,} cells, {report['table_bytes'] / 1024:.1f} KB")
+    print(f"   Coverage of {report['samples']:,} held-out samples: {report['coverage'] * 100:.1f}%")
+    print(f"   Agreement with the model on covered samples: top-1 {report['top1_agreement'] * 100:.2f}%, "
+          f"top-3 {report['top3_agreement'] * 100:.2f}%")
+    print(f"   Served top-1 agreement (model fallback elsewhere): {report['served_top1_agreement'] * 100:.2f}%")
+    print(f"   Lookup {report['lookup_us']:.1f} µs vs model single row {report['model_single_row_us']:.1f} µs")
+
+
+def encode_samples(df, label_encoders, numerical_columns, categorical_columns):
+    """Numerical and categorical arrays of a generated dataset, encoded like the API encodes requests"""
+    numerical = df[numerical_columns].to_numpy(dtype=np.float64)
+    categorical = np.column_stack([
+        df[column].map({value: code for code, value in enumerate(label_encoders[column])}).to_numpy()
+        for column in categorical_columns
+    ])
+    if np.isnan(categorical.astype(np.float64)).any():
+        raise ValueError('Reference samples contain categories the model was not trained on')
+    return numerical, categorical.astype(np.int64)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Precompute a recommendation lookup table for a model version')
+    parser.add_argument('--version', help='model version (default: models/CURRENT)')
+    parser.add_argument('--bins', type=int, default=4, help='bins per numerical feature (default: 4)')
+    parser.add_argument('--feature-bins', default='',
+                        help='per-feature overrides, e.g. "ph=6,rainfall=6"')
+    parser.add_argument('--top-k', type=int, default=DEFAULT_TOP_K, help='crops stored per cell (default: 4)')
+    parser.add_argument('--min-samples', type=int, default=2,
+                        help='reference samples a cell needs to be kept (default: 2)')
+    parser.add_argument('--min-purity', type=float, default=1.0,
+                        help='share of a cell\'s samples that must agree on its top crops (default: 1.0)')
+    parser.add_argument('--match-top', type=int, default=1,
+                        help='ranked top crops a sample must share with the cell\'s centre (default: 1)')
+    parser.add_argument('--rows-multiplier', type=float, default=10.0,
+                        help='reference sample size, as in train_model.py (default: 10)')
+    parser.add_argument('--seed', type=int, default=7, help='reference sample seed (default: 7)')
+    parser.add_argument('--eval-seed', type=int, default=8, help='held-out sample seed (default: 8)')
+    return parser.parse_args()
+
+
+def main():
+    # Training helpers import scikit-learn; keep them out of the serving import path
+    from model_registry import (MANIFEST_FILENAME, MODELS_DIR, load_bundle, new_version_dir, publish_version,
+                                read_current_version)
+    from train_model import CATEGORICAL_PATTERN_KEYS, CLIP_RANGES, crop_patterns, generate_dataset
+
+    args = parse_args()
+    current_version = read_current_version(MODELS_DIR)
+    version = args.version or current_version
+    if version is None:
+        raise SystemExit('No model version given and models/CURRENT does not exist. Run train_model.py first.')
+    path = os.path.join(MODELS_DIR, version)
+    bundle = load_bundle(path, version)
+
+    numerical_columns = list(CLIP_RANGES)
+    categorical_columns = list(CATEGORICAL_PATTERN_KEYS)
+    bins = {column: args.bins for column in numerical_columns}
+    for item in filter(None, args.feature_bins.split(',')):
+        column, count = item.split('=')
+        if column not in bins:
+            raise SystemExit(f'Unknown numerical feature in --feature-bins: {column}')
+        bins[column] = int(count)
+
+    print(f"🌱 Generating reference samples (rows multiplier {args.rows_multiplier})...")
+    reference = generate_dataset(crop_patterns, args.seed, args.rows_multiplier)
+    held_out = generate_dataset(crop_patterns, args.eval_seed, 1.0)
+    for df in (reference, held_out):
+        for column, (low, high) in CLIP_RANGES.items():
+            df[column] = df[column].clip(low, high)
+
+    numerical, categorical = encode_samples(reference, bundle.label_encoders, numerical_columns, categorical_columns)
+    print(f"📇 Building lookup table for model {version} from {len(numerical):,} samples...")
+    table = build_lookup_table(
+        bundle.engine, numerical, categorical,
+        lows=[CLIP_RANGES[column][0] for column in numerical_columns],
+        highs=[CLIP_RANGES[column][1] for column in numerical_columns],
+        bins=[bins[column] for column in numerical_columns],
+        categorical_sizes=[len(bundle.label_encoders[column]) for column in categorical_columns],
+        top_k=args.top_k, min_samples=args.min_samples, min_purity=args.min_purity,
+        match_top=args.match_top, model_version=version
+    )
+
+    report = evaluate_lookup_table(table, bundle.engine,
+                                   *encode_samples(held_out, bundle.label_encoders, numerical_columns,
+                                                   categorical_columns))
+    report.update({
+        'bins': dict(bins),
+        'top_k': args.top_k,
+        'min_samples': args.min_samples,
+        'min_purity': args.min_purity,
+        'match_top': args.match_top,
+        'reference_samples': len(numerical),
+        'rows_multiplier': args.rows_multiplier,
+        'seed': args.seed,
+        'eval_seed': args.eval_seed
+    })
+    table.report = report
+    print_lookup_report(report)
+
+    # The table goes into a new version with hard links to the model files; published versions never change
+    table_version, staging_path = new_version_dir(MODELS_DIR)
+    for name in os.listdir(path):
+        if name in (LOOKUP_TABLE_DIRNAME, MANIFEST_FILENAME):
+            continue
+        source = os.path.join(path, name)
+        if os.path.isdir(source):
+            shutil.copytree(source, os.path.join(staging_path, name), copy_function=os.link)
+        else:
+            os.link(source, os.path.join(staging_path, name))
+
+    table.model_version = table_version
+    table.save(os.path.join(staging_path, LOOKUP_TABLE_DIRNAME))
+    manifest = dict(bundle.manifest, created_at=datetime.now().isoformat(), lookup_table={
+        'base_version': version, 'cells': report['cells'], 'coverage': report['coverage']})
+    make_current = version == current_version
+    version_path = publish_version(table_version, staging_path, manifest, MODELS_DIR, make_current=make_current)
+    print(f"🏷️  Published model {version} with its lookup table as version {table_version} in '{version_path}/'"
+          + (" (now CURRENT)" if make_current else " (not CURRENT)"))
+    print("   Serve the table with LOOKUP_TABLE_ENABLED=1")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""
+Low-overhead in-process metrics for the ML service
+
+Counters and fixed-bucket histograms keyed by label values, rendered in the
+Prometheus text exposition format by GET /metrics. Recording a value is a dict
+lookup, a bisect and a few additions under a lock, so it can be used on the
+request hot path. Values that already live elsewhere (prediction cache stats,
+active model version) are read at scrape time through collectors.
+"""
+
+import math
+import sys
+import threading
+import time
+from bisect import bisect_left
+
+# Seconds; covers sub-millisecond model calls up to slow requests
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, one value per combination of label values"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        for labelvalues, value in sorted(values.items()):
+            lines.append(f'{self.name}{format_labels(self.labelnames, labelvalues)} {format_value(value)}')
+        return lines
+
+
+class Histogram:
+    """Cumulative histogram with fixed upper bounds, one series per combination of label values"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                # Per-bucket counts (last one is +Inf), sum, count
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for labelvalues, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                labels = format_labels(self.labelnames, labelvalues, ('le', format_value(float(bound))))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = format_labels(self.labelnames, labelvalues)
+            lines.append(f'{self.name}_sum{labels} {format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Collector:
+    """
+    Metric whose samples are read at scrape time. `collect()` returns a list of
+    (label values, value) pairs.
+    """
+
+    def __init__(self, name, documentation, metric_type, labelnames, collect):
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        for labelvalues, value in self.collect():
+            lines.append(f'{self.name}{format_labels(self.labelnames, labelvalues)} {format_value(value)}')
+        return lines
+
+
+class MetricsRegistry:
+    """Creates metrics and renders all of them for GET /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, name, documentation, metric_type, labelnames, collect):
+        return self._register(Collector(name, documentation, metric_type, labelnames, collect))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class StageTimer:
+    """
+    Records the time between consecutive mark() calls in a per-stage histogram:
+
+        timer = StageTimer(stage_histogram, '/predict')
+        data = request.get_json()
+        timer.mark('parse')
+
+    The durations of this request's stages are also kept in `stages` (seconds).
+    """
+
+    __slots__ = ('histogram', 'endpoint', 'last', 'stages')
+
+    def __init__(self, histogram, endpoint):
+        self.histogram = histogram
+        self.endpoint = endpoint
+        self.last = time.perf_counter()
+        self.stages = {}
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        elapsed = now - self.last
+        self.histogram.observe(elapsed, self.endpoint, stage)
+        self.stages[stage] = elapsed
+        self.last = now
+
+
+def peak_rss_mb(pid=None, children=False):
+    """
+    Peak resident memory in MB of a process (default: this one), or with
+    children=True of this process's finished child processes. None where it
+    cannot be read.
+    """
+    if not children:
+        try:
+            with open(f'/proc/{pid or "self"}/status', 'r') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        if pid is not None:
+            return None
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
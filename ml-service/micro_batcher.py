@@ -0,0 +1,122 @@
+"""
+Dynamic micro-batching for concurrent single-row predictions
+
+Every model call has a fixed cost on top of the per-row work. Under load many
+/predict requests arrive at once, so instead of each request thread calling
+the model, it puts its encoded feature row on a queue and waits. A background
+worker takes the first waiting row, collects more for at most `max_wait`
+seconds or until `max_batch_size` rows are waiting, scores them with one
+predict_proba call and hands each request its own row of probabilities.
+A request waits at most `max_wait` plus the time of one batch. When the
+previous batch had a single row (no concurrent load) the worker does not
+wait at all, so a lone request only pays for the hand-off to the worker.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    Collects rows from concurrent callers into one model call
+
+    - max_batch_size: most rows scored together
+    - max_wait:       seconds the first row of a batch waits for more rows
+    - on_batch:       optional callback(batch_size, inference_seconds) run after every model call
+    """
+
+    def __init__(self, max_batch_size=32, max_wait=0.0005, on_batch=None):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.on_batch = on_batch
+        self.batches = 0
+        self.rows = 0
+        self.max_observed_batch = 0
+        self.batch_sizes = {}
+        self._last_batch_size = 0
+        self._queue = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self.start()
+
+    def start(self):
+        """
+        Start the worker thread if it is not running in this process. Threads do
+        not survive fork, so a forked server worker calls this again.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._last_batch_size = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, args=(self._queue,), name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def predict_proba(self, engine, row):
+        """Class probabilities for one encoded row, scored together with concurrent callers"""
+        future = Future()
+        self._queue.put((engine, row, future))
+        return future.result()
+
+    def _collect(self, rows):
+        """Block for the first row, then gather more until the batch is full or the wait is over"""
+        batch = [rows.get()]
+        deadline = time.perf_counter() + (self.max_wait if self._last_batch_size > 1 else 0)
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(rows.get(timeout=remaining) if remaining > 0 else rows.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, rows):
+        while True:
+            batch = self._collect(rows)
+
+            # Rows queued around a model swap can belong to different engines
+            by_engine = {}
+            for engine, row, future in batch:
+                by_engine.setdefault(id(engine), (engine, []))[1].append((row, future))
+
+            self._last_batch_size = len(batch)
+            for engine, items in by_engine.values():
+                started = time.perf_counter()
+                try:
+                    probabilities = engine.predict_proba(np.array([row for row, _ in items]))
+                except BaseException as e:
+                    for _, future in items:
+                        future.set_exception(e)
+                    continue
+                elapsed = time.perf_counter() - started
+
+                for (_, future), row_probabilities in zip(items, probabilities):
+                    future.set_result(row_probabilities)
+                self._record(len(items), elapsed)
+
+    def _record(self, size, elapsed):
+        with self._lock:
+            self.batches += 1
+            self.rows += size
+            self.max_observed_batch = max(self.max_observed_batch, size)
+            self.batch_sizes[size] = self.batch_sizes.get(size, 0) + 1
+        if self.on_batch is not None:
+            self.on_batch(size, elapsed)
+
+    def stats(self):
+        """Counters reported by /health"""
+        with self._lock:
+            return {
+                'enabled': True,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_us': round(self.max_wait * 1e6),
+                'batches': self.batches,
+                'rows': self.rows,
+                'mean_batch_size': round(self.rows / self.batches, 2) if self.batches else 0.0,
+                'max_observed_batch_size': self.max_observed_batch,
+                'batch_size_counts': {str(size): count for size, count in sorted(self.batch_sizes.items())},
+                'queue_depth': self._queue.qsize()
+            }
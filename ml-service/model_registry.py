@@ -0,0 +1,302 @@
+"""
+Versioned model registry with zero-downtime hot reload
+
+train_model.py publishes every trained model as its own version directory:
+
+    models/
+    ├── CURRENT                     # name of the version to serve
+    └── 20251123-101500/
+        ├── crop_model.pkl
+        ├── crop_model_arrays/
+        ├── student_arrays/         # optional fast-tier model (distill_model.py)
+        ├── feature_names.json
+        ├── label_encoders.json
+        ├── manifest.json
+        ├── shards/                 # optional per-(state, season) models (shards.py)
+        └── lookup_table/           # optional, written by lookup_table.py
+
+The service loads a version into a ModelBundle (engine + feature names + label
+encoders), warms it up and then swaps it in with a single reference assignment.
+A request reads the active bundle once and uses it throughout, so it never mixes
+a model from one version with encoders from another.
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from drift import TRAINING_PROFILE_FILENAME
+from forest_engine import ForestEngine
+from lookup_table import LOOKUP_TABLE_DIRNAME, LookupTable
+from shards import DEFAULT_CACHE_SIZE, SHARDS_DIRNAME, ShardSet
+
+# Next to the service, whatever directory a script or server is started from
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+CURRENT_FILENAME = 'CURRENT'
+MODEL_FILENAME = 'crop_model.pkl'
+ARRAYS_DIRNAME = 'crop_model_arrays'
+STUDENT_ARRAYS_DIRNAME = 'student_arrays'
+FEATURE_NAMES_FILENAME = 'feature_names.json'
+LABEL_ENCODERS_FILENAME = 'label_encoders.json'
+MANIFEST_FILENAME = 'manifest.json'
+
+# Version name used for models stored directly in the service directory
+LEGACY_VERSION = 'legacy'
+
+
+class ModelBundle:
+    """Everything needed to serve one model version, swapped in as a unit"""
+
+    def __init__(self, version, path, engine, model_format, feature_names, label_encoders, manifest,
+                 lookup_table=None, student_engine=None, training_profile=None, shards=None):
+        self.version = version
+        self.path = path
+        self.engine = engine
+        self.model_format = model_format
+        self.feature_names = feature_names
+        self.label_encoders = label_encoders
+        self.manifest = manifest
+        self.lookup_table = lookup_table
+        self.student_engine = student_engine
+        self.training_profile = training_profile
+        self.shards = shards
+        self.loaded_at = datetime.now().isoformat()
+
+
+def load_engine(path, model_format='auto'):
+    """Load the inference engine from a model directory"""
+    arrays_path = os.path.join(path, ARRAYS_DIRNAME)
+    if model_format == 'mmap' or (model_format == 'auto' and os.path.isdir(arrays_path)):
+        # Read-only memory map: workers share the pages and sklearn is never imported
+        return ForestEngine.load(arrays_path, mmap=True), 'mmap'
+
+    # Unpickling the forest imports scikit-learn, so keep it off the mmap path
+    import joblib
+    return ForestEngine.from_sklearn(joblib.load(os.path.join(path, MODEL_FILENAME))), 'pickle'
+
+
+def load_bundle(path, version, model_format='auto', shard_cache_size=DEFAULT_CACHE_SIZE):
+    """
+    Load one model version and check that its files belong together. Shard
+    models are only indexed here; ShardSet loads them on first use.
+    """
+    engine, loaded_format = load_engine(path, model_format)
+    with open(os.path.join(path, FEATURE_NAMES_FILENAME), 'r') as f:
+        feature_names = json.load(f)
+    with open(os.path.join(path, LABEL_ENCODERS_FILENAME), 'r') as f:
+        label_encoders = json.load(f)
+
+    manifest = {}
+    manifest_path = os.path.join(path, MANIFEST_FILENAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+
+    n_features = int(engine.feature.max()) + 1 if engine.n_nodes else 0
+    if n_features > len(feature_names):
+        raise ValueError(f'Model {version} uses {n_features} features but '
+                         f'{FEATURE_NAMES_FILENAME} lists {len(feature_names)}')
+
+    lookup_table = None
+    table_path = os.path.join(path, LOOKUP_TABLE_DIRNAME)
+    if os.path.isdir(table_path):
+        lookup_table = LookupTable.load(table_path)
+        # A table that does not match the model is ignored; requests then always use the model
+        if lookup_table.model_version != version or lookup_table.n_classes != len(engine.classes) or \
+                lookup_table.categorical_sizes != [len(values) for values in label_encoders.values()]:
+            print(f"⚠️  Ignoring lookup table in {table_path}: it was not built for model {version}")
+            lookup_table = None
+
+    # Distilled fast-tier model, only ever stored as node arrays
+    student_engine = None
+    student_path = os.path.join(path, STUDENT_ARRAYS_DIRNAME)
+    if os.path.isdir(student_path):
+        student_engine = ForestEngine.load(student_path, mmap=True)
+        if list(student_engine.classes) != list(engine.classes):
+            raise ValueError(f'Fast-tier model of {version} predicts different classes than the model')
+
+    # Training input distribution (drift.py); versions trained before it have none
+    training_profile = None
+    profile_path = os.path.join(path, TRAINING_PROFILE_FILENAME)
+    if os.path.exists(profile_path):
+        with open(profile_path, 'r') as f:
+            training_profile = json.load(f)
+
+    # Per-(state, season) specialist models, kept in the same format as the main engine
+    shards = None
+    shards_path = os.path.join(path, SHARDS_DIRNAME)
+    if os.path.isdir(shards_path):
+        shards = ShardSet.load(shards_path, label_encoders, mmap=loaded_format == 'mmap',
+                               cache_size=shard_cache_size)
+
+    return ModelBundle(version, path, engine, loaded_format, feature_names, label_encoders, manifest,
+                       lookup_table, student_engine, training_profile, shards)
+
+
+def read_current_version(models_dir=MODELS_DIR):
+    """Name of the version in models/CURRENT, or None when there is no registry"""
+    try:
+        with open(os.path.join(models_dir, CURRENT_FILENAME), 'r') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def list_versions(models_dir=MODELS_DIR):
+    """All published versions, oldest first"""
+    if not os.path.isdir(models_dir):
+        return []
+    return sorted(
+        name for name in os.listdir(models_dir)
+        if os.path.isdir(os.path.join(models_dir, name)) and not name.endswith('.tmp')
+    )
+
+
+def new_version_dir(models_dir=MODELS_DIR):
+    """
+    Reserve a version name and a staging directory to write its files into.
+    Returns (version, staging_path); pass both to publish_version when done.
+    """
+    os.makedirs(models_dir, exist_ok=True)
+    base = datetime.now().strftime('%Y%m%d-%H%M%S')
+    version = base
+    suffix = 1
+    while os.path.exists(os.path.join(models_dir, version)) or \
+            os.path.exists(os.path.join(models_dir, version + '.tmp')):
+        suffix += 1
+        version = f'{base}-{suffix}'
+    staging_path = os.path.join(models_dir, version + '.tmp')
+    os.makedirs(staging_path)
+    return version, staging_path
+
+
+def publish_version(version, staging_path, manifest, models_dir=MODELS_DIR, make_current=True):
+    """
+    Move a fully written staging directory into place and optionally point
+    models/CURRENT at it. Both steps are atomic renames, so a watcher never
+    sees a half written version.
+    """
+    manifest = dict(manifest, version=version)
+    with open(os.path.join(staging_path, MANIFEST_FILENAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    version_path = os.path.join(models_dir, version)
+    os.rename(staging_path, version_path)
+
+    if make_current:
+        current_path = os.path.join(models_dir, CURRENT_FILENAME)
+        with open(current_path + '.tmp', 'w') as f:
+            f.write(version + '\n')
+        os.replace(current_path + '.tmp', current_path)
+    return version_path
+
+
+class ModelRegistry:
+    """
+    Holds the active ModelBundle and replaces it without dropping requests
+
+    - warm_up(bundle) runs a few predictions on a freshly loaded bundle before it
+      is made active; an exception there keeps the old bundle in place
+    - on_swap(bundle) runs right after a new bundle becomes active
+    - shard_cache_size is the number of shard models a loaded version keeps in memory
+    """
+
+    def __init__(self, models_dir=MODELS_DIR, legacy_dir='.', model_format='auto',
+                 warm_up=None, on_swap=None, shard_cache_size=DEFAULT_CACHE_SIZE):
+        self.models_dir = models_dir
+        self.legacy_dir = legacy_dir
+        self.model_format = model_format
+        self.warm_up = warm_up
+        self.on_swap = on_swap
+        self.shard_cache_size = shard_cache_size
+        self.active = None
+        self.last_error = None
+        self.last_reload_at = None
+        self.failed_version = None
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+
+    @property
+    def reloading(self):
+        return self._reload_lock.locked()
+
+    def _locate(self, version):
+        """Directory and version name to load; falls back to the legacy flat layout"""
+        if version is None:
+            version = read_current_version(self.models_dir)
+        if version is None:
+            return self.legacy_dir, LEGACY_VERSION
+
+        # Only published version names are accepted, never arbitrary paths
+        if version not in list_versions(self.models_dir):
+            raise FileNotFoundError(f'Model version {version} not found in {self.models_dir}/')
+        return os.path.join(self.models_dir, version), version
+
+    def reload(self, version=None, blocking=True):
+        """
+        Load `version` (default: models/CURRENT), warm it up and make it active.
+        Returns the new bundle, or None when another reload is already running
+        and blocking is False.
+        """
+        if not self._reload_lock.acquire(blocking=blocking):
+            return None
+        requested = version
+        try:
+            path, version = self._locate(version)
+            bundle = load_bundle(path, version, self.model_format, self.shard_cache_size)
+            if self.warm_up is not None:
+                self.warm_up(bundle)
+
+            self.active = bundle
+            if self.on_swap is not None:
+                self.on_swap(bundle)
+            self.last_error = None
+            self.failed_version = None
+            return bundle
+        except Exception as e:
+            self.last_error = f'{type(e).__name__}: {e}'
+            self.failed_version = version if version is not None else requested
+            raise
+        finally:
+            self.last_reload_at = datetime.now().isoformat()
+            self._reload_lock.release()
+
+    def reload_in_background(self, version=None):
+        """Start a reload on a daemon thread. Returns False if one is already running."""
+        if self.reloading:
+            return False
+
+        def run():
+            try:
+                bundle = self.reload(version, blocking=False)
+                if bundle is not None:
+                    print(f"🔄 Model version {bundle.version} is now active")
+            except Exception as e:
+                print(f"❌ Model reload failed: {e}")
+
+        threading.Thread(target=run, name='model-reload', daemon=True).start()
+        return True
+
+    def watch(self, interval):
+        """
+        Poll models/CURRENT every `interval` seconds and reload when it changes.
+        Calling it again after fork starts a watcher in the child process.
+        """
+        if (self._watcher is not None and self._watcher.is_alive()) or interval <= 0:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                current = read_current_version(self.models_dir)
+                active = self.active
+                # A version that failed to load is not retried until CURRENT changes again
+                if current is not None and (active is None or active.version != current) \
+                        and current != self.failed_version and not self.reloading:
+                    print(f"👀 models/{CURRENT_FILENAME} changed to {current}, reloading...")
+                    self.reload_in_background(current)
+
+        self._watcher = threading.Thread(target=run, name='model-watcher', daemon=True)
+        self._watcher.start()
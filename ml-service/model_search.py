@@ -0,0 +1,265 @@
+"""
+Hyperparameter search for the crop recommendation forest
+
+Trains one RandomForestClassifier per candidate in a process pool. The
+train/test split is copied into shared memory once and every worker maps the
+same pages, so adding workers does not copy the dataset again. Each candidate
+is scored on accuracy, model size, node count and single-row / batch latency
+of the inference engine app.py serves with. Latency is measured one candidate
+at a time after training, so candidates do not slow each other down.
+Candidates are ranked and the most accurate one whose single-row p99 latency
+meets the target is published as a new model version.
+
+Usage:
+    python model_search.py
+    python model_search.py --mode random --candidates 20 --p99-target-ms 2
+    python model_search.py --no-promote --report search_report.json
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from multiprocessing import shared_memory
+
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import ParameterGrid, ParameterSampler
+
+from dataset_cache import DATASET_CACHE_DIR
+from forest_engine import ForestEngine, check_parity, measure_latency
+from train_model import (FEATURE_COLUMNS, FOREST_PARAMS, crop_patterns, load_or_build_dataset,
+                         publish_model, split_dataset)
+
+# Every combination is trained in grid mode
+GRID_SPACE = {
+    'n_estimators': [50, 100, 200],
+    'max_depth': [12, 18, 25],
+    'min_samples_leaf': [1, 3],
+    'max_features': ['sqrt', 0.5]
+}
+
+# Random mode samples --candidates combinations from a wider space
+RANDOM_SPACE = {
+    'n_estimators': [25, 50, 75, 100, 150, 200, 300],
+    'max_depth': [8, 10, 12, 15, 18, 21, 25, 30],
+    'min_samples_split': [2, 3, 5, 8],
+    'min_samples_leaf': [1, 2, 3, 5],
+    'max_features': ['sqrt', 'log2', 0.3, 0.5]
+}
+
+# Arrays attached from shared memory in each worker process
+_shared_arrays = {}
+_shared_blocks = []
+
+
+def share_arrays(arrays):
+    """
+    Copy arrays into shared memory once.
+    Returns (blocks, specs); pass specs to attach_arrays in the workers and
+    close and unlink the blocks when done.
+    """
+    blocks = []
+    specs = {}
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        specs[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, specs
+
+
+def attach_arrays(specs):
+    """Worker initializer: map the shared arrays read-only without copying them"""
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        array = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+        array.flags.writeable = False
+        _shared_blocks.append(block)
+        _shared_arrays[name] = array
+
+
+def train_candidate(task):
+    """Worker: train and evaluate one candidate, save it and report its size"""
+    index, params, output_dir = task
+    start = time.perf_counter()
+    model = RandomForestClassifier(**dict(FOREST_PARAMS, **params), n_jobs=1)
+    model.fit(_shared_arrays['X_train'], _shared_arrays['y_train'])
+    fit_seconds = time.perf_counter() - start
+
+    accuracy = accuracy_score(_shared_arrays['y_test'], model.predict(_shared_arrays['X_test']))
+
+    model_path = os.path.join(output_dir, f'candidate-{index:03d}.pkl')
+    joblib.dump(model, model_path)
+    engine = ForestEngine.from_sklearn(model)
+
+    return {
+        'index': index,
+        'params': params,
+        'accuracy': float(accuracy),
+        'fit_seconds': fit_seconds,
+        'model_path': model_path,
+        'pickle_bytes': os.path.getsize(model_path),
+        'arrays_bytes': engine.nbytes,
+        'node_count': int(engine.n_nodes),
+        'n_trees': int(engine.n_trees)
+    }
+
+
+def candidate_params(mode, candidates, seed):
+    """Parameter sets to train for the chosen search mode"""
+    if mode == 'grid':
+        return list(ParameterGrid(GRID_SPACE))
+    return list(ParameterSampler(RANDOM_SPACE, n_iter=candidates, random_state=seed))
+
+
+def rank_candidates(results, p99_target_ms):
+    """
+    Candidates within the latency target first (most accurate, then fastest),
+    followed by the rest (fastest first)
+    """
+    for result in results:
+        result['meets_target'] = result['single_row_p99_ms'] <= p99_target_ms
+    ranked = sorted(results, key=lambda r: (not r['meets_target'],
+                                            -r['accuracy'] if r['meets_target'] else 0,
+                                            r['single_row_p99_ms']))
+    for rank, result in enumerate(ranked, start=1):
+        result['rank'] = rank
+    return ranked
+
+
+def print_report(ranked, limit=15):
+    print(f"\n{'Rank':>4} {'Accuracy':>9} {'p50 (ms)':>9} {'p99 (ms)':>9} {'Batch (ms)':>11} "
+          f"{'Nodes':>9} {'Size (MB)':>10} {'Target':>7}  Params")
+    for r in ranked[:limit]:
+        size_mb = (r['pickle_bytes'] + r['arrays_bytes']) / 1024 / 1024
+        print(f"{r['rank']:>4} {r['accuracy'] * 100:>8.2f}% {r['single_row_p50_ms']:>9.3f} "
+              f"{r['single_row_p99_ms']:>9.3f} {r['batch_ms']:>11.2f} {r['node_count']:>9,} "
+              f"{size_mb:>10.1f} {'✅' if r['meets_target'] else '❌':>6}  {r['params']}")
+    if len(ranked) > limit:
+        print(f"... {len(ranked) - limit} more in the report")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Search forest hyperparameters for accuracy within a latency budget')
+    parser.add_argument('--mode', choices=['grid', 'random'], default='grid', help='search strategy (default: grid)')
+    parser.add_argument('--candidates', type=int, default=12, help='candidates sampled in random mode')
+    parser.add_argument('--search-seed', type=int, default=42, help='seed for random mode sampling')
+    parser.add_argument('--workers', type=int, default=None, help='training processes (default: all CPUs)')
+    parser.add_argument('--p99-target-ms', type=float, default=5.0,
+                        help='single-row p99 latency a promoted model must meet (default: 5.0)')
+    parser.add_argument('--latency-calls', type=int, default=500,
+                        help='single-row predictions timed per candidate (default: 500)')
+    parser.add_argument('--report', default='search_report.json', help='ranked report file')
+    parser.add_argument('--no-promote', action='store_true', help='only write the report')
+    parser.add_argument('--rows-multiplier', type=float, default=1.0, help='dataset size, as in train_model.py')
+    parser.add_argument('--data-seed', type=int, default=42, help='dataset seed, as in train_model.py')
+    parser.add_argument('--dataset-cache-dir', default=DATASET_CACHE_DIR, help='dataset cache, as in train_model.py')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    df, label_encoders = load_or_build_dataset(crop_patterns, args.data_seed, args.rows_multiplier,
+                                               None, args.dataset_cache_dir)
+    X_train, X_test, y_train, y_test = split_dataset(df)
+
+    # sklearn trains on float32 anyway, so sharing float32 avoids a per-worker copy
+    blocks, specs = share_arrays({
+        'X_train': X_train.to_numpy(dtype=np.float32),
+        'y_train': y_train.to_numpy(dtype=str),
+        'X_test': X_test.to_numpy(dtype=np.float32),
+        'y_test': y_test.to_numpy(dtype=str)
+    })
+    shared_mb = sum(block.size for block in blocks) / 1024 / 1024
+
+    params_list = candidate_params(args.mode, args.candidates, args.search_seed)
+    workers = args.workers or os.cpu_count() or 1
+    print(f"🔎 {args.mode.title()} search: {len(params_list)} candidates on {workers} workers "
+          f"({len(X_train):,} training rows, {shared_mb:.1f} MB in shared memory)")
+
+    results = []
+    try:
+        with tempfile.TemporaryDirectory(prefix='model-search-') as output_dir:
+            with ProcessPoolExecutor(max_workers=workers, initializer=attach_arrays,
+                                     initargs=(specs,)) as executor:
+                futures = [executor.submit(train_candidate, (i, params, output_dir))
+                           for i, params in enumerate(params_list)]
+                for future in as_completed(futures):
+                    result = future.result()
+                    results.append(result)
+                    print(f"  [{len(results)}/{len(params_list)}] accuracy {result['accuracy'] * 100:.2f}% "
+                          f"in {result['fit_seconds']:.1f}s  {result['params']}")
+
+            # Time candidates one at a time so they don't compete for CPU
+            print("\n⏱️  Measuring inference latency...")
+            X_latency = X_test.to_numpy(dtype=np.float64)
+            for result in results:
+                engine = ForestEngine.from_sklearn(joblib.load(result['model_path']))
+                result.update(measure_latency(engine, X_latency, args.latency_calls))
+
+            ranked = rank_candidates(results, args.p99_target_ms)
+            print_report(ranked)
+
+            best = ranked[0] if ranked and ranked[0]['meets_target'] else None
+            report = {
+                'created_at': datetime.now().isoformat(),
+                'mode': args.mode,
+                'p99_target_ms': args.p99_target_ms,
+                'training_samples': len(X_train),
+                'testing_samples': len(X_test),
+                'rows_multiplier': args.rows_multiplier,
+                'data_seed': args.data_seed,
+                'best_index': best['index'] if best else None,
+                'promoted_version': None,
+                'candidates': [{k: v for k, v in r.items() if k != 'model_path'} for r in ranked]
+            }
+
+            if best is None:
+                print(f"\n❌ No candidate meets the {args.p99_target_ms} ms p99 target; nothing promoted")
+            elif args.no_promote:
+                print(f"\n🏆 Best candidate #{best['index']}: {best['params']} (not promoted)")
+            else:
+                model = joblib.load(best['model_path'])
+                print(f"\n🧪 Checking inference engine parity for candidate #{best['index']}...")
+                check_parity(ForestEngine.from_sklearn(model), model, X_latency)
+
+                version, version_path = publish_model(model, FEATURE_COLUMNS, label_encoders, {
+                    'created_at': datetime.now().isoformat(),
+                    'accuracy': best['accuracy'],
+                    'n_estimators': model.n_estimators,
+                    'max_depth': model.max_depth,
+                    'training_samples': len(X_train),
+                    'testing_samples': len(X_test),
+                    'rows_multiplier': args.rows_multiplier,
+                    'data_seed': args.data_seed,
+                    'search': {
+                        'mode': args.mode,
+                        'params': best['params'],
+                        'p99_target_ms': args.p99_target_ms,
+                        'single_row_p99_ms': best['single_row_p99_ms'],
+                        'candidates': len(ranked)
+                    }
+                })
+                report['promoted_version'] = version
+                print(f"🏷️  Published candidate #{best['index']} as model version {version} "
+                      f"in '{version_path}/' (now CURRENT)")
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Ranked report saved as '{args.report}'")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+In-process prediction cache for the crop recommendation API
+
+Predictions are cached under a key made of the encoded categorical features
+and the numerical features. On a miss the model always scores the exact
+inputs. By default the key holds the exact values too, so a cached answer is
+exactly what the model would return. Farmers in the same district often submit
+nearly identical soil cards; with a rounding resolution, those requests share
+one entry and get the answer computed for the first of them, trading exactness
+for hits. Concurrent requests for the same key share a single inference.
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class PredictionCache:
+    """
+    Bounded LRU cache of class probabilities
+
+    - max_size:   number of entries kept, least recently used are evicted (0 disables caching)
+    - resolution: step the numerical features are rounded to in the key (0 keeps exact values)
+    """
+
+    def __init__(self, max_size=10000, resolution=0.0):
+        self.max_size = max_size
+        self.resolution = resolution
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def key_part(self, numerical_inputs):
+        """Numerical inputs as they appear in the cache key: exact, or in steps of the resolution"""
+        if self.resolution <= 0:
+            return tuple(numerical_inputs)
+        return tuple(round(value / self.resolution) for value in numerical_inputs)
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached value for `key`, or run `compute()` to fill it.
+        If another thread is already computing the same key, wait for its result.
+        """
+        if not self.enabled:
+            return compute()
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+            pending = self._pending.get(key)
+            leader = pending is None
+            if leader:
+                pending = Future()
+                self._pending[key] = pending
+                self.misses += 1
+            else:
+                self.coalesced += 1
+            generation = self._generation
+
+        if not leader:
+            return pending.result()
+
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                if self._pending.get(key) is pending:
+                    del self._pending[key]
+            pending.set_exception(e)
+            raise
+
+        with self._lock:
+            if self._pending.get(key) is pending:
+                del self._pending[key]
+            # Results computed before an invalidation belong to the old model
+            if generation == self._generation:
+                self._entries[key] = value
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+
+        pending.set_result(value)
+        return value
+
+    def invalidate(self):
+        """Drop every cached prediction. Must be called whenever the model changes."""
+        with self._lock:
+            self._entries.clear()
+            self._pending.clear()
+            self._generation += 1
+
+    def stats(self):
+        """Counters reported by /health"""
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'enabled': self.enabled,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'resolution': self.resolution,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'hit_rate': round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,471 @@
+"""
+Serving cost profile of a trained model version
+
+Reports what a forest will cost to serve, so a retrained model can be judged
+on serving cost as well as accuracy before it is promoted:
+- structure: nodes, leaves and depth of every tree
+- work:      nodes visited per prediction on the model's own test split
+- hot paths: which features the visited nodes test, overall and on the
+             nodes most test rows pass through
+- memory:    node arrays (shared between workers when memory-mapped), the
+             private copy a worker holds with MODEL_FORMAT=pickle, and the
+             temporary memory of single-row and batch calls
+- latency:   single-row and batch latency predicted from the structure, next
+             to the measured timings
+
+The latency model counts the steps of ForestEngine's two paths. A single row
+advances every tree for max_depth levels, whether or not it has reached a
+leaf. A batch only advances the (tree, row) pairs that have not reached a
+leaf, until the deepest one has. Each path's cost is a linear function of
+these counts, and the coefficients are fitted on random synthetic forests
+timed on this machine. So the check against the measured timings is on a
+model the fit never saw.
+
+The test split is regenerated from the data seed and rows multiplier in the
+version's manifest, exactly as train_model.py split it.
+
+Usage:
+    python profile_model.py                                   # models/CURRENT
+    python profile_model.py --version 20251123-101500 --json cost.json
+    python profile_model.py --max-single-row-ms 1.0 --max-batch-ms 40 --max-memory-mb 100
+"""
+
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+import numpy as np
+from scipy.optimize import nnls
+
+from forest_engine import ARRAY_NAMES, BATCH_CHUNK_ROWS, BATCH_LATENCY_ROWS, ForestEngine, measure_latency
+from model_registry import MODEL_FILENAME
+
+# Single-row calls timed per round for the model and for every calibration forest
+LATENCY_CALLS = 200
+
+# Timing rounds per engine; the fastest round is kept, as the one least
+# disturbed by other work on the machine
+LATENCY_ROUNDS = 3
+
+# Synthetic forests the latency model is fitted on: tree counts x (leaves per
+# tree, depth cap). The capped shapes keep levels and visits from rising together.
+CALIBRATION_TREES = [10, 50, 200]
+CALIBRATION_SHAPES = [(16, 30), (64, 30), (300, 30), (1000, 30), (1000, 10), (300, 6)]
+
+# Predictions further than this from the measurement are flagged
+LATENCY_MODEL_TOLERANCE = 0.25
+
+# A node is hot when at least this share of test rows passes through it
+HOT_NODE_SHARE = 0.1
+
+
+def tree_structure(engine):
+    """Nodes, leaves and depth of every tree"""
+    depths = engine.node_depths()
+    tree_of_node = np.repeat(np.arange(engine.n_trees), np.diff(np.append(engine.roots, engine.n_nodes)))
+    return {
+        'nodes': np.bincount(tree_of_node, minlength=engine.n_trees),
+        'leaves': np.bincount(tree_of_node, weights=engine.is_leaf, minlength=engine.n_trees).astype(np.int64),
+        'max_depth': np.maximum.reduceat(depths, engine.roots) if engine.n_nodes else np.zeros(0, dtype=np.int32),
+        'leaf_depths': depths[engine.is_leaf]
+    }
+
+
+def node_visits(engine, X):
+    """How many rows of X pass through every node of every tree"""
+    visits = np.zeros(engine.n_nodes, dtype=np.int64)
+    children = engine.children.ravel()
+    for start in range(0, len(X), BATCH_CHUNK_ROWS):
+        chunk = np.asarray(X[start:start + BATCH_CHUNK_ROWS], dtype=np.float32)
+        n_rows, n_features = chunk.shape
+        chunk = chunk.ravel()
+        current = np.repeat(engine.roots, n_rows)
+        row_offsets = np.tile(np.arange(n_rows) * n_features, engine.n_trees)
+        while current.size:
+            visits += np.bincount(current, minlength=engine.n_nodes)
+            internal = ~engine.is_leaf[current]
+            current = current[internal]
+            row_offsets = row_offsets[internal]
+            go_right = chunk[row_offsets + engine.feature[current]] > engine.threshold[current]
+            current = children[2 * current + go_right]
+    return visits
+
+
+def path_work(engine, X, depths=None):
+    """
+    Steps the two inference paths take on X:
+    - comparisons: internal nodes visited per row, summed over trees
+    - batch_visits / batch_levels: (tree, row) pair steps and loop levels of one batch call
+    - single_row_steps: trees x max_depth, the steps of every single-row call
+    """
+    depths = engine.node_depths() if depths is None else depths
+    path_lengths = depths[engine.apply(X)]
+    return {
+        'comparisons': path_lengths.sum(axis=1),
+        'batch_visits': int(path_lengths.sum()),
+        'batch_levels': int(path_lengths.max()) if path_lengths.size else 0,
+        'single_row_steps': engine.n_trees * engine.max_depth
+    }
+
+
+def fastest_latencies(engines):
+    """
+    measure_latency of every (engine, X) over LATENCY_ROUNDS rounds, keeping
+    the fastest round of each figure. Engines take turns within a round, so a
+    slow spell on the machine hits all of them alike.
+    """
+    fastest = [None] * len(engines)
+    for _ in range(LATENCY_ROUNDS):
+        for i, (engine, X) in enumerate(engines):
+            latency = measure_latency(engine, X, single_row_calls=LATENCY_CALLS)
+            fastest[i] = latency if fastest[i] is None else \
+                {name: min(value, fastest[i][name]) for name, value in latency.items()}
+    return fastest
+
+
+def single_row_terms(n_trees, max_depth):
+    return [1.0, max_depth, max_depth * n_trees, n_trees]
+
+
+def batch_terms(n_trees, levels, visits):
+    return [1.0, levels, visits, n_trees]
+
+
+def random_engine(n_trees, n_leaves, max_depth, n_features, n_classes, rng):
+    """
+    Engine of random trees for latency calibration. Each tree grows by
+    splitting a random leaf on a random feature at a random threshold in
+    [0, 1), so on uniform inputs path lengths vary like in a trained tree.
+    """
+    features, thresholds, children, roots = [], [], [], []
+    for _ in range(n_trees):
+        offset = len(features)
+        roots.append(offset)
+        features.append(0)
+        thresholds.append(np.inf)
+        children.append([offset, offset])
+        depth = {offset: 0}
+        open_leaves = [offset]
+        for _ in range(n_leaves - 1):
+            if not open_leaves:
+                break
+            k = int(rng.integers(len(open_leaves)))
+            node = open_leaves[k]
+            open_leaves[k] = open_leaves[-1]
+            open_leaves.pop()
+
+            features[node] = int(rng.integers(n_features))
+            thresholds[node] = float(rng.random())
+            children[node] = [len(features), len(features) + 1]
+            for child in children[node]:
+                features.append(0)
+                thresholds.append(np.inf)
+                children.append([child, child])
+                depth[child] = depth[node] + 1
+                if depth[child] < max_depth:
+                    open_leaves.append(child)
+
+    value = rng.random((len(features), n_classes))
+    return ForestEngine(
+        feature=np.array(features, dtype=np.intp),
+        threshold=np.array(thresholds, dtype=np.float64),
+        children=np.array(children, dtype=np.intp),
+        value=value / value.sum(axis=1, keepdims=True),
+        roots=np.array(roots, dtype=np.intp),
+        classes=np.arange(n_classes),
+        max_depth=max(depth.values())
+    )
+
+
+def with_dtypes_of(engine, like):
+    """`engine` stored like `like`: the same array dtypes, compact class distributions if it has them"""
+    if like.value_scale != 1:
+        engine = engine.compact()
+    return ForestEngine(classes=engine.classes, max_depth=engine.max_depth, value_scale=engine.value_scale,
+                        **{name: np.asarray(getattr(engine, name)).astype(getattr(like, name).dtype)
+                           for name in ARRAY_NAMES})
+
+
+def calibrate_latency(engine, X, seed=0):
+    """
+    Fit the single-row and batch latency models on random forests of
+    CALIBRATION_TREES x CALIBRATION_SHAPES, stored like `engine`, and measure
+    `engine` itself on X in the same timing rounds
+    """
+    rng = np.random.default_rng(seed)
+    n_features = X.shape[1]
+    X_random = rng.random((max(min(len(X), BATCH_LATENCY_ROWS), LATENCY_CALLS), n_features), dtype=np.float32)
+    forests = [
+        with_dtypes_of(random_engine(n_trees, n_leaves, max_depth, n_features, len(engine.classes), rng), engine)
+        for n_trees in CALIBRATION_TREES for n_leaves, max_depth in CALIBRATION_SHAPES
+    ]
+    *latencies, measured = fastest_latencies([(forest, X_random) for forest in forests] + [(engine, X)])
+
+    single_rows, batches = [], []
+    for forest, latency in zip(forests, latencies):
+        work = path_work(forest, X_random[:BATCH_LATENCY_ROWS])
+        single_rows.append((single_row_terms(forest.n_trees, forest.max_depth), latency['single_row_p50_ms']))
+        batches.append((batch_terms(forest.n_trees, work['batch_levels'], work['batch_visits']), latency['batch_ms']))
+
+    def fit(samples):
+        # Non-negative costs with the least relative error, so small forests count as much as big ones
+        terms, timings = map(np.array, zip(*samples))
+        coefficients, _ = nnls(terms / timings[:, np.newaxis], np.ones(len(timings)))
+        return coefficients
+
+    return {'single_row': fit(single_rows), 'batch': fit(batches), 'forests': len(forests), 'measured': measured}
+
+
+def working_set_mb(engine, X):
+    """Peak temporary memory of one predict_proba call on X, in MB"""
+    engine.predict_proba(X)
+    tracemalloc.start()
+    try:
+        engine.predict_proba(X)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024 / 1024
+
+
+def memory_report(engine, pickle_path, X):
+    """Node array sizes and per-call working sets in MB"""
+    compact = engine if engine.value_scale != 1 else engine.compact()
+    batch = X[np.arange(BATCH_CHUNK_ROWS) % len(X)]
+    return {
+        'node_arrays_mb': engine.nbytes / 1024 / 1024,
+        'compact_node_arrays_mb': compact.nbytes / 1024 / 1024,
+        'pickle_mb': os.path.getsize(pickle_path) / 1024 / 1024 if pickle_path and os.path.exists(pickle_path) else None,
+        'single_row_working_set_mb': working_set_mb(engine, X[:1]),
+        'batch_working_set_mb': working_set_mb(engine, batch),
+        'batch_working_set_rows': len(batch)
+    }
+
+
+def profile_engine(engine, feature_names, X, pickle_path, calibration):
+    """Structure, work, hot paths, memory and predicted vs measured latency of one engine"""
+    structure = tree_structure(engine)
+    depths = engine.node_depths()
+    work = path_work(engine, X, depths)
+    batch = X[:BATCH_LATENCY_ROWS]
+    batch_work = path_work(engine, batch, depths)
+
+    # Comparisons by feature, over all visited nodes and over the hot ones
+    visits = node_visits(engine, X)
+    internal = ~engine.is_leaf
+    hot = internal & (visits >= HOT_NODE_SHARE * len(X))
+    n_features = len(feature_names)
+    all_tests = np.bincount(engine.feature[internal], weights=visits[internal], minlength=n_features)
+    hot_tests = np.bincount(engine.feature[hot], weights=visits[hot], minlength=n_features)
+    root_tests = np.bincount(engine.feature[engine.roots[internal[engine.roots]]], minlength=n_features)
+    features = sorted((
+        {
+            'feature': name,
+            'comparison_share': float(all_tests[j] / all_tests.sum()) if all_tests.sum() else 0.0,
+            'hot_comparison_share': float(hot_tests[j] / hot_tests.sum()) if hot_tests.sum() else 0.0,
+            'root_splits': int(root_tests[j])
+        }
+        for j, name in enumerate(feature_names)
+    ), key=lambda entry: -entry['hot_comparison_share'])
+
+    measured = calibration['measured']
+    predicted_single = float(np.dot(calibration['single_row'],
+                                    single_row_terms(engine.n_trees, engine.max_depth)))
+    predicted_batch = float(np.dot(calibration['batch'], batch_terms(
+        engine.n_trees, batch_work['batch_levels'], batch_work['batch_visits'])))
+
+    return {
+        'trees': engine.n_trees,
+        'nodes': engine.n_nodes,
+        'leaves': int(engine.is_leaf.sum()),
+        'max_depth': engine.max_depth,
+        'per_tree': [
+            {'nodes': int(nodes), 'leaves': int(leaves), 'max_depth': int(depth)}
+            for nodes, leaves, depth in zip(structure['nodes'], structure['leaves'], structure['max_depth'])
+        ],
+        'nodes_per_tree': percentiles(structure['nodes']),
+        'depth_per_tree': percentiles(structure['max_depth']),
+        'leaf_depth': percentiles(structure['leaf_depths']),
+        'test_rows': len(X),
+        'comparisons_per_prediction': float(work['comparisons'].mean()),
+        'comparisons_per_tree': float(work['comparisons'].mean() / engine.n_trees),
+        'single_row_steps': work['single_row_steps'],
+        'hot_nodes': int(hot.sum()),
+        'features': features,
+        'memory': memory_report(engine, pickle_path, X),
+        'latency': {
+            'single_row_predicted_ms': predicted_single,
+            'single_row_measured_ms': measured['single_row_p50_ms'],
+            'single_row_p99_ms': measured['single_row_p99_ms'],
+            'batch_rows': measured['batch_rows'],
+            'batch_predicted_ms': predicted_batch,
+            'batch_measured_ms': measured['batch_ms'],
+            'batch_levels': batch_work['batch_levels'],
+            'batch_visits': batch_work['batch_visits']
+        }
+    }
+
+
+def percentiles(values):
+    values = np.asarray(values)
+    if not values.size:
+        return {'min': 0, 'p50': 0, 'p95': 0, 'max': 0}
+    p50, p95 = np.percentile(values, [50, 95])
+    return {'min': int(values.min()), 'p50': float(p50), 'p95': float(p95), 'max': int(values.max())}
+
+
+def relative_error(predicted, measured):
+    return abs(predicted - measured) / measured if measured else 0.0
+
+
+def print_profile(report):
+    nodes, depth, leaf_depth = report['nodes_per_tree'], report['depth_per_tree'], report['leaf_depth']
+    print(f"\n🌲 Structure: {report['trees']} trees, {report['nodes']:,} nodes ({report['leaves']:,} leaves), "
+          f"max depth {report['max_depth']}")
+    print(f"   Nodes per tree:  min {nodes['min']:,}  p50 {nodes['p50']:,.0f}  p95 {nodes['p95']:,.0f}  "
+          f"max {nodes['max']:,}")
+    print(f"   Depth per tree:  min {depth['min']}  p50 {depth['p50']:.0f}  p95 {depth['p95']:.0f}  max {depth['max']}")
+    print(f"   Leaf depth:      min {leaf_depth['min']}  p50 {leaf_depth['p50']:.0f}  p95 {leaf_depth['p95']:.0f}  "
+          f"max {leaf_depth['max']}")
+
+    print(f"\n👣 Work on {report['test_rows']:,} test rows:")
+    print(f"   Comparisons per prediction: {report['comparisons_per_prediction']:,.0f} "
+          f"({report['comparisons_per_tree']:.1f} per tree)")
+    print(f"   Single-row path steps:      {report['single_row_steps']:,} "
+          f"(every tree walks max depth {report['max_depth']}, "
+          f"{report['comparisons_per_prediction'] / max(report['single_row_steps'], 1) * 100:.0f}% of them useful)")
+
+    print(f"\n🔥 Features tested ({report['hot_nodes']:,} hot nodes reached by ≥{HOT_NODE_SHARE * 100:.0f}% of rows):")
+    print(f"   {'Feature':<20} {'Hot nodes':>10} {'All nodes':>10} {'Roots':>6}")
+    for entry in report['features']:
+        print(f"   {entry['feature']:<20} {entry['hot_comparison_share'] * 100:>9.1f}% "
+              f"{entry['comparison_share'] * 100:>9.1f}% {entry['root_splits']:>6}")
+
+    memory = report['memory']
+    print("\n💾 Memory per worker:")
+    print(f"   Node arrays:           {memory['node_arrays_mb']:>8.2f} MB (shared between workers with MODEL_FORMAT=mmap)")
+    if memory['compact_node_arrays_mb'] < memory['node_arrays_mb']:
+        print(f"   Compact node arrays:   {memory['compact_node_arrays_mb']:>8.2f} MB (compress_model.py storage)")
+    if memory['pickle_mb'] is not None:
+        print(f"   Pickle format:         {memory['pickle_mb'] + memory['node_arrays_mb']:>8.2f} MB private "
+              f"(forest {memory['pickle_mb']:.2f} MB + engine arrays)")
+    print(f"   Single-row call:       {memory['single_row_working_set_mb']:>8.2f} MB temporary")
+    print(f"   Batch call:            {memory['batch_working_set_mb']:>8.2f} MB temporary "
+          f"({memory['batch_working_set_rows']:,} rows)")
+
+    latency = report['latency']
+    print("\n⏱️  Latency (predicted from structure vs measured):")
+    for label, predicted, measured in [
+        ('Single row p50', latency['single_row_predicted_ms'], latency['single_row_measured_ms']),
+        (f"Batch of {latency['batch_rows']:,}", latency['batch_predicted_ms'], latency['batch_measured_ms'])
+    ]:
+        error = relative_error(predicted, measured)
+        flag = '' if error <= LATENCY_MODEL_TOLERANCE else '  ⚠️  latency model is off for this model'
+        print(f"   {label:<15} predicted {predicted:>8.3f} ms   measured {measured:>8.3f} ms   "
+              f"error {error * 100:>5.1f}%{flag}")
+    print(f"   Single row p99  measured {latency['single_row_p99_ms']:.3f} ms")
+
+
+def check_budgets(report, args):
+    """Messages for every measured cost over its budget"""
+    latency, memory = report['latency'], report['memory']
+    checks = [
+        ('Single-row p50', latency['single_row_measured_ms'], args.max_single_row_ms, 'ms'),
+        (f"Batch of {latency['batch_rows']:,}", latency['batch_measured_ms'], args.max_batch_ms, 'ms'),
+        ('Node arrays', memory['node_arrays_mb'], args.max_memory_mb, 'MB')
+    ]
+    return [f"{label} {value:.2f} {unit} is over the budget of {budget:g} {unit}"
+            for label, value, budget, unit in checks if budget is not None and value > budget]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Profile the serving cost of a trained model version')
+    parser.add_argument('--version', help='model version (default: models/CURRENT)')
+    parser.add_argument('--model-dir', help='profile this directory instead of a published version, '
+                                            'e.g. the legacy layout next to app.py')
+    parser.add_argument('--format', choices=['auto', 'mmap', 'pickle'], default='auto',
+                        help='how to load the model, as MODEL_FORMAT (default: auto)')
+    parser.add_argument('--tier', choices=['accurate', 'fast'], default='accurate',
+                        help='fast profiles the distilled student model')
+    parser.add_argument('--rows-multiplier', type=float,
+                        help='dataset size the test split is drawn from (default: from the manifest)')
+    parser.add_argument('--seed', type=int, help='dataset seed (default: from the manifest)')
+    parser.add_argument('--max-single-row-ms', type=float, help='fail when the measured single-row p50 is higher')
+    parser.add_argument('--max-batch-ms', type=float,
+                        help=f'fail when a batch of {BATCH_LATENCY_ROWS} rows takes longer')
+    parser.add_argument('--max-memory-mb', type=float, help='fail when the node arrays are larger')
+    parser.add_argument('--json', help='also write the report to this JSON file')
+    return parser.parse_args()
+
+
+def main():
+    # Training helpers import scikit-learn; keep them out of the serving import path
+    from model_registry import LEGACY_VERSION, MODELS_DIR, load_bundle, read_current_version
+    from train_model import crop_patterns, generate_compact_dataset, split_compact_dataset
+
+    args = parse_args()
+    if args.model_dir:
+        path, version = args.model_dir, LEGACY_VERSION
+    else:
+        version = args.version or read_current_version(MODELS_DIR)
+        if version is None:
+            raise SystemExit('No model version given and models/CURRENT does not exist. Run train_model.py first.')
+        path = os.path.join(MODELS_DIR, version)
+    bundle = load_bundle(path, version, args.format)
+    engine = bundle.engine
+    if args.tier == 'fast':
+        if bundle.student_engine is None:
+            raise SystemExit(f'Model {version} has no fast-tier model')
+        engine = bundle.student_engine
+    print(f"🔍 Profiling {args.tier} model {version} ({bundle.model_format})")
+
+    seed = args.seed if args.seed is not None else bundle.manifest.get('data_seed', 42)
+    rows_multiplier = args.rows_multiplier or bundle.manifest.get('rows_multiplier', 1.0)
+    print(f"🌱 Regenerating the test split (seed {seed}, rows multiplier {rows_multiplier:g})...")
+    dataset = generate_compact_dataset(crop_patterns, seed, rows_multiplier,
+                                       categorical_classes=bundle.label_encoders)
+    _, X_test, _, _ = split_compact_dataset(dataset)
+    del dataset
+    if X_test.shape[1] != len(bundle.feature_names):
+        raise SystemExit(f'Test rows have {X_test.shape[1]} features but the model expects '
+                         f'{len(bundle.feature_names)}')
+
+    print(f"📐 Timing the model and {len(CALIBRATION_TREES) * len(CALIBRATION_SHAPES)} random forests "
+          "for the latency model...")
+    start = time.perf_counter()
+    calibration = calibrate_latency(engine, X_test)
+    print(f"   done in {time.perf_counter() - start:.1f}s")
+
+    # The fast tier is only ever stored as node arrays
+    pickle_path = os.path.join(path, MODEL_FILENAME) if args.tier == 'accurate' else None
+    report = profile_engine(engine, bundle.feature_names, X_test, pickle_path, calibration)
+    report.update({
+        'version': version,
+        'tier': args.tier,
+        'model_format': bundle.model_format,
+        'data_seed': seed,
+        'rows_multiplier': rows_multiplier,
+        'calibration': {name: calibration[name].tolist() for name in ('single_row', 'batch')}
+    })
+    print_profile(report)
+
+    failures = check_budgets(report, args)
+    report['budget_failures'] = failures
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Report saved to '{args.json}'")
+
+    if failures:
+        for failure in failures:
+            print(f"❌ {failure}")
+        raise SystemExit(1)
+    if any(value is not None for value in (args.max_single_row_ms, args.max_batch_ms, args.max_memory_mb)):
+        print("✅ Within the serving cost budget")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Non-blocking structured request log
+
+Request handlers hand a dict to RequestLog.log(), which only puts it on a
+bounded queue. A background thread serializes the records as JSON lines and
+writes them to the sink (stdout or a file), flushing once per batch of records.
+When the sink falls behind and the queue is full, new records are dropped and
+counted instead of blocking the request. Successful requests can be sampled;
+errors are always logged.
+"""
+
+import json
+import queue
+import random
+import sys
+import threading
+
+# Records written between flushes of the sink
+WRITE_BATCH_SIZE = 256
+
+
+class RequestLog:
+    """
+    Bounded, queue-backed JSON-lines logger
+
+    - sink:                file-like object the lines are written to
+    - max_queue_size:      records waiting to be written before new ones are dropped
+    - success_sample_rate: fraction of successful requests logged (0-1)
+    """
+
+    def __init__(self, sink=None, max_queue_size=10000, success_sample_rate=1.0):
+        self.sink = sink if sink is not None else sys.stdout
+        self.max_queue_size = max_queue_size
+        self.success_sample_rate = success_sample_rate
+        self.logged = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.write_errors = 0
+        self._queue = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self.start()
+
+    def start(self):
+        """
+        Start the writer thread if it is not running in this process. Threads do
+        not survive fork, so a forked server worker calls this again.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._queue = queue.Queue(maxsize=self.max_queue_size)
+        self._thread = threading.Thread(target=self._run, args=(self._queue,), name='request-log', daemon=True)
+        self._thread.start()
+
+    def should_log(self, error):
+        """Errors are always logged; successes with probability success_sample_rate"""
+        if error or self.success_sample_rate >= 1.0 or random.random() < self.success_sample_rate:
+            return True
+        with self._lock:
+            self.sampled_out += 1
+        return False
+
+    def log(self, record):
+        """Queue one record for writing; drops it if the queue is full"""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def _run(self, records):
+        while True:
+            batch = [records.get()]
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(records.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = [json.dumps(record, default=str, separators=(',', ':')) for record in batch]
+            try:
+                self.sink.write('\n'.join(lines) + '\n')
+                self.sink.flush()
+            except (OSError, ValueError):
+                with self._lock:
+                    self.write_errors += len(batch)
+                continue
+            with self._lock:
+                self.logged += len(batch)
+
+    def stats(self):
+        """Counters reported by /health"""
+        with self._lock:
+            return {
+                'enabled': True,
+                'success_sample_rate': self.success_sample_rate,
+                'logged': self.logged,
+                'dropped': self.dropped,
+                'sampled_out': self.sampled_out,
+                'write_errors': self.write_errors,
+                'queue_depth': self._queue.qsize(),
+                'max_queue_size': self.max_queue_size
+            }
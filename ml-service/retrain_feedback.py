@@ -0,0 +1,269 @@
+"""
+Incremental retraining on farmer feedback
+
+Grows extra trees on a published model instead of refitting the whole forest:
+
+1. Load the forest of a model version (default: models/CURRENT). When that
+   version was itself retrained on feedback, its feedback trees are dropped
+   first, so the forest never grows past base trees + --extra-trees and every
+   run learns from the whole feedback log.
+2. Load the synthetic dataset the version was trained on from the dataset cache
+   and append the feedback rows (feedback_log.py) with a good enough outcome.
+   Each feedback row weighs --feedback-weight synthetic rows.
+3. Fit with warm_start: only the extra trees are trained, on the merged data.
+4. Compress the served forest as train_model.py does (compress_model.py), with
+   the base version's accuracy loss and top-3 agreement limits. Tree dropping
+   is judged on synthetic data alone, so only base trees are dropped; the
+   feedback trees always stay, though depth caps apply to them too.
+5. Compare the served model before and after on the synthetic test split and
+   on held-out feedback, then publish a new model version with the fast-tier
+   student of the base version, if it still agrees with the served model.
+   Per-region shards are not carried over: they were judged against the
+   base version's global model.
+
+Trees vote equally, so the feedback trees hold extra / (served trees) of the
+vote; a few reports refine uncertain predictions rather than overturn the
+synthetic data. crop_model.pkl keeps the full forest to retrain from.
+
+A running server picks the version up via MODEL_WATCH_INTERVAL or
+POST /admin/reload, or runs this script itself through POST /admin/retrain.
+
+Usage:
+    python retrain_feedback.py
+    python retrain_feedback.py --extra-trees 40 --min-outcome average --no-activate
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import time
+import warnings
+from datetime import datetime
+
+import joblib
+import numpy as np
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import train_test_split
+
+from compress_model import DEFAULT_MIN_TOP3_AGREEMENT, choose_level, compression_report, print_compression_report
+from dataset_cache import DATASET_CACHE_DIR
+from distill_model import distillation_report, skip_reason
+from feedback_log import (FEEDBACK_DIR, OUTCOMES, RESULT_PREFIX, RETRAIN_LOCK_FILENAME,
+                          feedback_training_rows)
+from forest_engine import ForestEngine
+from model_registry import MODEL_FILENAME, MODELS_DIR, load_bundle, read_current_version
+from train_model import (FEATURE_COLUMNS, build_training_profile, crop_patterns, load_or_build_dataset,
+                         publish_model, split_dataset)
+
+# Share of feedback rows held out to compare the models on, once there are enough of them
+FEEDBACK_HOLDOUT_SHARE = 0.2
+FEEDBACK_HOLDOUT_MIN_ROWS = 50
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Grow extra trees on a model version from farmer feedback')
+    parser.add_argument('--version', default=None,
+                        help='model version to start from (default: models/CURRENT)')
+    parser.add_argument('--feedback-dir', default=FEEDBACK_DIR,
+                        help=f'feedback log directory (default: {FEEDBACK_DIR})')
+    parser.add_argument('--extra-trees', type=int, default=20,
+                        help='trees grown on the merged data (default: 20)')
+    parser.add_argument('--min-outcome', choices=OUTCOMES, default='good',
+                        help='worst reported outcome used as a training label (default: good)')
+    parser.add_argument('--feedback-weight', type=float, default=5.0,
+                        help='sample weight of a feedback row relative to a synthetic row (default: 5)')
+    parser.add_argument('--min-feedback-rows', type=int, default=1,
+                        help='usable feedback rows needed to retrain at all (default: 1)')
+    parser.add_argument('--dataset-cache-dir', default=DATASET_CACHE_DIR,
+                        help=f'where generated datasets are cached (default: {DATASET_CACHE_DIR})')
+    parser.add_argument('--max-accuracy-loss', type=float, default=None,
+                        help='accuracy (percentage points) compression may give up '
+                             '(default: as for the base version, else 0.5)')
+    parser.add_argument('--min-top3-agreement', type=float, default=None,
+                        help='share of rows (percent) whose full-model top 3 crops a compressed model must keep '
+                             f'listing (default: as for the base version, else {DEFAULT_MIN_TOP3_AGREEMENT * 100:g})')
+    parser.add_argument('--no-compress', action='store_true',
+                        help='serve the full forest instead of the smallest compressed one')
+    parser.add_argument('--no-activate', action='store_true',
+                        help='publish without pointing models/CURRENT at the new version')
+    parser.add_argument('--jobs', type=int, default=-1,
+                        help='processes used to grow trees (default: all CPUs)')
+    parser.add_argument('--nice', type=int, default=0,
+                        help='lower this process\'s CPU priority by this much (default: 0)')
+    return parser.parse_args()
+
+
+def print_result(result):
+    """Machine-readable summary, parsed by feedback_log.RetrainJob"""
+    print(RESULT_PREFIX + json.dumps(result))
+
+
+def served_accuracy(engine, X, y):
+    return accuracy_score(y, engine.classes[np.argmax(engine.predict_proba(X), axis=1)]) if len(X) else None
+
+
+def main():
+    args = parse_args()
+    if args.nice:
+        os.nice(args.nice)
+
+    # One run at a time, even when several server workers start one
+    os.makedirs(args.feedback_dir, exist_ok=True)
+    lock = open(os.path.join(args.feedback_dir, RETRAIN_LOCK_FILENAME), 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        raise SystemExit('Another retraining run is in progress')
+
+    version = args.version or read_current_version(MODELS_DIR)
+    if version is None:
+        raise SystemExit('No model version given and models/CURRENT does not exist. Run train_model.py first.')
+    path = os.path.join(MODELS_DIR, version)
+    base = load_bundle(path, version)
+    model = joblib.load(os.path.join(path, MODEL_FILENAME))
+
+    previous = base.manifest.get('feedback')
+    base_version = previous['base_version'] if previous else version
+    base_trees = previous['base_trees'] if previous else len(model.estimators_)
+    print(f"🌲 Starting from model {version}: {base_trees} trees of {base_version}"
+          + (f" (dropping {len(model.estimators_) - base_trees} earlier feedback trees)" if previous else ""))
+
+    X_feedback, y_feedback, counts = feedback_training_rows(
+        base.label_encoders, list(base.engine.classes), args.min_outcome, args.feedback_dir)
+    print(f"📝 Feedback: {counts['records']} reports, {counts['used']} usable "
+          f"({counts['below_min_outcome']} below '{args.min_outcome}', "
+          f"{counts['unknown_category']} with values this model does not know)")
+    if counts['used'] < args.min_feedback_rows:
+        print(f"⏭️  Fewer than {args.min_feedback_rows} usable feedback rows; nothing retrained")
+        print_result({'version': None, 'base_version': version, 'feedback': counts})
+        return
+
+    df, label_encoders = load_or_build_dataset(
+        crop_patterns, base.manifest.get('data_seed', 42), base.manifest.get('rows_multiplier', 1.0), None,
+        cache_dir=args.dataset_cache_dir)
+    if {col: le.classes_.tolist() for col, le in label_encoders.items()} != base.label_encoders:
+        raise SystemExit(f'The synthetic dataset is not encoded like model {version}')
+    X_train, X_test, y_train, y_test = split_dataset(df)
+    del df
+    X_train = X_train.to_numpy(dtype=np.float32)
+    X_test = X_test.to_numpy(dtype=np.float32)
+
+    X_feedback_test = np.empty((0, X_feedback.shape[1]), dtype=np.float32)
+    y_feedback_test = np.empty(0, dtype=object)
+    if len(X_feedback) >= FEEDBACK_HOLDOUT_MIN_ROWS:
+        X_feedback, X_feedback_test, y_feedback, y_feedback_test = train_test_split(
+            X_feedback, y_feedback, test_size=FEEDBACK_HOLDOUT_SHARE, random_state=42)
+
+    X_merged = np.vstack([X_train, X_feedback])
+    y_merged = np.concatenate([np.asarray(y_train, dtype=object), y_feedback.astype(object)])
+    weights = np.concatenate([np.ones(len(X_train)), np.full(len(X_feedback), args.feedback_weight)])
+
+    print(f"\n🌱 Growing {args.extra_trees} trees on {len(X_train):,} synthetic + "
+          f"{len(X_feedback):,} feedback rows (weight {args.feedback_weight:g})...")
+    del model.estimators_[base_trees:]
+    model.set_params(warm_start=True, n_estimators=base_trees + args.extra_trees, n_jobs=args.jobs)
+    start = time.perf_counter()
+    with warnings.catch_warnings():
+        # The merged rows are the full training set, which is what class_weight='balanced' needs
+        warnings.filterwarnings('ignore', message='class_weight presets')
+        model.fit(X_merged, y_merged, sample_weight=weights)
+    seconds = time.perf_counter() - start
+    # Served forests predict from arrays; the pickle is only used to retrain again
+    model.set_params(warm_start=False)
+    print(f"✅ Grew {args.extra_trees} trees in {seconds:.1f}s")
+
+    engine = full_engine = ForestEngine.from_sklearn(model)
+
+    # Compress like train_model.py; half of the test split picks trees, the other half scores each level
+    compression = None
+    if not args.no_compress:
+        limits = base.manifest.get('compression') or {}
+        max_accuracy_loss = args.max_accuracy_loss / 100 if args.max_accuracy_loss is not None \
+            else limits.get('max_accuracy_loss', 0.005)
+        min_top3_agreement = args.min_top3_agreement / 100 if args.min_top3_agreement is not None \
+            else limits.get('min_top3_agreement', DEFAULT_MIN_TOP3_AGREEMENT)
+        print(f"\n🗜️  Compressing model (the {args.extra_trees} feedback trees are never dropped)...")
+        X_select, X_eval, y_select, y_eval = train_test_split(
+            X_test, y_test, test_size=0.5, random_state=42, stratify=y_test)
+        levels, build_level = compression_report(full_engine, X_select, y_select, X_eval, y_eval,
+                                                 keep=range(base_trees, full_engine.n_trees))
+        chosen = choose_level(levels, max_accuracy_loss, min_top3_agreement)
+        print_compression_report(levels, chosen, min_top3_agreement)
+
+        engine = build_level(chosen)
+        compression = dict(levels[chosen], max_accuracy_loss=max_accuracy_loss,
+                           min_top3_agreement=min_top3_agreement, full_arrays_bytes=levels[0]['arrays_bytes'])
+        print(f"✅ Serving {engine.n_trees} trees up to depth {engine.max_depth}: "
+              f"{levels[chosen]['arrays_bytes'] / 1024 / 1024:.2f} MB instead of "
+              f"{levels[0]['arrays_bytes'] / 1024 / 1024:.2f} MB, accuracy "
+              f"{levels[chosen]['accuracy'] * 100:.2f}% vs {levels[0]['accuracy'] * 100:.2f}%, "
+              f"top-3 agreement {levels[chosen]['top3_agreement'] * 100:.2f}%, "
+              f"single-row p50 {levels[chosen]['single_row_p50_ms']:.3f} ms vs "
+              f"{levels[0]['single_row_p50_ms']:.3f} ms")
+
+    comparison = {
+        'synthetic_test': {'rows': len(X_test), 'before': served_accuracy(base.engine, X_test, y_test),
+                           'after': served_accuracy(engine, X_test, y_test)},
+        'feedback_holdout': {'rows': len(X_feedback_test),
+                             'before': served_accuracy(base.engine, X_feedback_test, y_feedback_test),
+                             'after': served_accuracy(engine, X_feedback_test, y_feedback_test)}
+    }
+    print("\n📊 Served model accuracy, before -> after:")
+    for name, entry in comparison.items():
+        if entry['rows']:
+            print(f"   {name:<17} {entry['before'] * 100:6.2f}% -> {entry['after'] * 100:6.2f}% "
+                  f"({entry['rows']} rows)")
+        else:
+            print(f"   {name:<17} not measured (fewer than {FEEDBACK_HOLDOUT_MIN_ROWS} feedback rows)")
+
+    # The base version's student was checked against the base version's served model, so check it again
+    student = base.student_engine
+    distillation = base.manifest.get('distillation')
+    if student is not None:
+        reason = skip_reason(distillation_report(student, full_engine, X_test, y_test, served=engine),
+                             min_top3_agreement=(compression or {}).get('min_top3_agreement',
+                                                                         DEFAULT_MIN_TOP3_AGREEMENT))
+        if reason is not None:
+            print(f"⏭️  Not carrying the fast tier over: the student's {reason}")
+            student = None
+            distillation = dict(distillation or {}, skip_reason=reason, published=False)
+
+    # Shards were only published because they beat the base version's global model
+    if base.shards is not None:
+        print("⏭️  Not carrying the base version's shards over; run train_model.py --shards to train new ones")
+
+    feedback = {
+        'base_version': base_version,
+        'base_trees': base_trees,
+        'extra_trees': args.extra_trees,
+        'retrained_from': version,
+        'min_outcome': args.min_outcome,
+        'feedback_weight': args.feedback_weight,
+        'feedback_rows': len(X_feedback),
+        'records': counts,
+        'training_seconds': round(seconds, 2),
+        'accuracy': comparison
+    }
+    version, version_path = publish_model(model, FEATURE_COLUMNS, label_encoders, {
+        'created_at': datetime.now().isoformat(),
+        'accuracy': comparison['synthetic_test']['after'],
+        'n_estimators': model.n_estimators,
+        'max_depth': model.max_depth,
+        'training_samples': len(X_merged),
+        'testing_samples': len(X_test),
+        'rows_multiplier': base.manifest.get('rows_multiplier', 1.0),
+        'data_seed': base.manifest.get('data_seed', 42),
+        'compression': compression,
+        'distillation': distillation,
+        'feedback': feedback
+    }, engine=engine, student=student,
+        training_profile=build_training_profile(X_merged, label_encoders), make_current=not args.no_activate)
+    print(f"🏷️  Published model version {version} in '{version_path}/'"
+          + (" (not CURRENT)" if args.no_activate else " (now CURRENT)"))
+    print_result({'version': version, 'activated': not args.no_activate, 'base_version': feedback['retrained_from'],
+                  'feedback': counts, 'accuracy': comparison})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Sampling profiler that can be switched on in a running service
+
+A daemon thread wakes up every `interval` seconds, takes the current stack of
+every other thread from sys._current_frames() and counts identical stacks.
+Nothing is added to the request path, and the cost while running is one stack
+walk per thread per sample. Results are returned in the collapsed-stack format
+("thread;outer;...;inner count") used by flamegraph.pl and speedscope.
+"""
+
+import os
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+
+# Distinct stacks kept; further new stacks are counted under OVERFLOW_STACK
+MAX_STACKS = 10000
+OVERFLOW_STACK = '[other stacks]'
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})'
+
+
+class SamplingProfiler:
+    """Collects stack samples of all threads while started"""
+
+    def __init__(self):
+        self.interval = None
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+        self._stacks = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=0.01):
+        """Start sampling every `interval` seconds, clearing earlier samples. Returns False if already running."""
+        with self._lock:
+            if self.running:
+                return False
+            self.interval = interval
+            self.samples = 0
+            self.started_at = datetime.now().isoformat()
+            self.stopped_at = None
+            self._stacks = Counter()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """Stop sampling and keep the collected stacks. Returns False if it was not running."""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return False
+        self._stop.set()
+        thread.join()
+        self.stopped_at = datetime.now().isoformat()
+        return True
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            sampled = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, f'thread-{thread_id}'))
+                sampled.append(';'.join(reversed(stack)))
+
+            with self._lock:
+                for stack in sampled:
+                    if stack in self._stacks or len(self._stacks) < MAX_STACKS:
+                        self._stacks[stack] += 1
+                    else:
+                        self._stacks[OVERFLOW_STACK] += 1
+                self.samples += 1
+
+    def collapsed(self, limit=None):
+        """Most frequent stacks as collapsed-stack lines"""
+        with self._lock:
+            stacks = self._stacks.most_common(limit)
+        return '\n'.join(f'{stack} {count}' for stack, count in stacks) + '\n'
+
+    def status(self):
+        with self._lock:
+            return {
+                'running': self.running,
+                'interval_ms': self.interval * 1000 if self.interval else None,
+                'samples': self.samples,
+                'distinct_stacks': len(self._stacks),
+                'started_at': self.started_at,
+                'stopped_at': self.stopped_at
+            }
@@ -0,0 +1,231 @@
+"""
+Shadow evaluation of a candidate model on live traffic
+
+A candidate model version is loaded next to the active one. /predict hands a
+sample of its encoded feature rows to ShadowEvaluator.offer(), which only puts
+the row on a bounded queue. A background thread scores every queued row with
+both the active and the candidate model, and keeps:
+
+- top-1 agreement: both models recommend the same crop
+- top-3 agreement: the candidate's top 3 crops include every crop in the
+  active model's top 3 (as in compress_model.py)
+- the most frequent (active crop, candidate crop) disagreements
+- single-row latency of both models on the same rows, in the same thread,
+  taking turns at going first
+
+Requests never wait for the shadow work: when the queue is full, the row is
+dropped and counted. The thread shares the interpreter with the request
+threads, so the sample rate bounds how much CPU the comparison takes.
+"""
+
+import queue
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+
+from compress_model import top3_agreement
+
+# Latencies kept per model for the reported percentiles
+LATENCY_WINDOW = 10000
+
+# (active crop, candidate crop) disagreement pairs reported
+TOP_DISAGREEMENTS = 10
+
+
+def compatibility_error(active, candidate):
+    """Why encoded rows of the active model cannot be scored by the candidate, or None"""
+    if active.feature_names != candidate.feature_names:
+        return 'feature names differ'
+    if active.label_encoders != candidate.label_encoders:
+        return 'label encoders differ'
+    if list(active.engine.classes) != list(candidate.engine.classes):
+        return 'crop classes differ'
+    return None
+
+
+class ShadowEvaluator:
+    """
+    Scores sampled rows with a candidate model off the request path
+
+    - sample_rate:    fraction of offered rows queued for shadow scoring (0-1)
+    - max_queue_size: rows waiting to be scored before new ones are dropped
+    - on_score:       optional callback(active_seconds, candidate_seconds) run after every scored row
+    """
+
+    def __init__(self, sample_rate=0.1, max_queue_size=1000, on_score=None):
+        self.sample_rate = sample_rate
+        self.max_queue_size = max_queue_size
+        self.on_score = on_score
+        self.candidate = None
+        self._queue = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._reset(None)
+        self.start()
+
+    def start(self):
+        """
+        Start the scoring thread if it is not running in this process. Threads do
+        not survive fork, so a forked server worker calls this again.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._queue = queue.Queue(maxsize=self.max_queue_size)
+        self._thread = threading.Thread(target=self._run, args=(self._queue,), name='shadow', daemon=True)
+        self._thread.start()
+
+    def set_candidate(self, bundle):
+        """Shadow a new candidate bundle (None stops shadowing); statistics start over"""
+        with self._lock:
+            self.candidate = bundle
+            self._reset(None)
+
+    def _reset(self, active_version):
+        """Clear the statistics; called with the lock held (or from __init__)"""
+        self.active_version = active_version
+        self.since = datetime.now().isoformat()
+        self.offered = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self.scored = 0
+        self.top1_agreements = 0
+        self.top3_agreements = 0
+        self.incompatible = 0
+        self.incompatible_reason = None
+        self.errors = 0
+        self.last_error = None
+        self.disagreements = {}
+        self._latencies = {'active': deque(maxlen=LATENCY_WINDOW), 'candidate': deque(maxlen=LATENCY_WINDOW)}
+
+    def offer(self, active, row):
+        """
+        Maybe queue one encoded row scored by the `active` bundle. Never blocks;
+        returns True when the row was queued.
+        """
+        if self.candidate is None:
+            return False
+        sampled = self.sample_rate >= 1.0 or random.random() < self.sample_rate
+        with self._lock:
+            self.offered += 1
+            if not sampled:
+                self.sampled_out += 1
+                return False
+        try:
+            self._queue.put_nowait((active, self.candidate, row))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def _run(self, rows):
+        candidate_first = False
+        compatibility = {}
+        while True:
+            active, candidate, row = rows.get()
+            # Rows queued before the candidate changed belong to the old comparison
+            if candidate is not self.candidate:
+                continue
+
+            pair = (active.version, candidate.version)
+            if pair not in compatibility:
+                compatibility[pair] = compatibility_error(active, candidate)
+            error = compatibility[pair]
+            with self._lock:
+                if self.active_version is None:
+                    self.active_version = active.version
+                elif active.version != self.active_version:
+                    # The active model was reloaded: compare against the new one from scratch
+                    self._reset(active.version)
+                if error is not None:
+                    self.incompatible += 1
+                    self.incompatible_reason = error
+                    continue
+
+            X = np.array([row])
+            try:
+                if candidate_first:
+                    candidate_seconds, candidate_probabilities = self._timed(candidate.engine, X)
+                    active_seconds, active_probabilities = self._timed(active.engine, X)
+                else:
+                    active_seconds, active_probabilities = self._timed(active.engine, X)
+                    candidate_seconds, candidate_probabilities = self._timed(candidate.engine, X)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                    self.last_error = str(e)
+                continue
+            candidate_first = not candidate_first
+            self._record(active, active_probabilities, candidate_probabilities, active_seconds, candidate_seconds)
+
+    @staticmethod
+    def _timed(engine, X):
+        started = time.perf_counter()
+        probabilities = engine.predict_proba(X)
+        return time.perf_counter() - started, probabilities
+
+    def _record(self, active, active_probabilities, candidate_probabilities, active_seconds, candidate_seconds):
+        active_top = int(np.argmax(active_probabilities[0]))
+        candidate_top = int(np.argmax(candidate_probabilities[0]))
+        top3 = top3_agreement(candidate_probabilities, active_probabilities) == 1.0
+        with self._lock:
+            self.scored += 1
+            self._latencies['active'].append(active_seconds)
+            self._latencies['candidate'].append(candidate_seconds)
+            if active_top == candidate_top:
+                self.top1_agreements += 1
+            else:
+                pair = (str(active.engine.classes[active_top]), str(active.engine.classes[candidate_top]))
+                self.disagreements[pair] = self.disagreements.get(pair, 0) + 1
+            if top3:
+                self.top3_agreements += 1
+        if self.on_score is not None:
+            self.on_score(active_seconds, candidate_seconds)
+
+    def stats(self):
+        """Agreement and latency comparison reported by GET /shadow and /health"""
+        with self._lock:
+            candidate = self.candidate
+            latencies = {name: np.array(values) * 1000 for name, values in self._latencies.items()}
+            stats = {
+                'enabled': True,
+                'candidate_version': candidate.version if candidate else None,
+                'active_version': self.active_version,
+                'since': self.since,
+                'sample_rate': self.sample_rate,
+                'offered': self.offered,
+                'sampled_out': self.sampled_out,
+                'dropped': self.dropped,
+                'scored': self.scored,
+                'queue_depth': self._queue.qsize(),
+                'max_queue_size': self.max_queue_size,
+                'incompatible': self.incompatible,
+                'incompatible_reason': self.incompatible_reason,
+                'errors': self.errors,
+                'last_error': self.last_error,
+                'top1_agreement': round(self.top1_agreements / self.scored, 4) if self.scored else None,
+                'top3_agreement': round(self.top3_agreements / self.scored, 4) if self.scored else None,
+                'top_disagreements': [
+                    {'active': active_crop, 'candidate': candidate_crop, 'count': count}
+                    for (active_crop, candidate_crop), count in
+                    sorted(self.disagreements.items(), key=lambda item: -item[1])[:TOP_DISAGREEMENTS]
+                ]
+            }
+
+        stats['latency_ms'] = {}
+        for name, values in latencies.items():
+            p50, p99 = np.percentile(values, [50, 99]) if values.size else (None, None)
+            stats['latency_ms'][name] = {
+                'p50': round(float(p50), 4) if values.size else None,
+                'p99': round(float(p99), 4) if values.size else None,
+                'mean': round(float(values.mean()), 4) if values.size else None
+            }
+        active_p50 = stats['latency_ms']['active']['p50']
+        candidate_p50 = stats['latency_ms']['candidate']['p50']
+        stats['latency_ms']['candidate_vs_active_p50'] = \
+            round(candidate_p50 / active_p50, 3) if active_p50 and candidate_p50 is not None else None
+        return stats
@@ -0,0 +1,337 @@
+"""
+Specialist models per (state, season) shard, loaded lazily
+
+Every crop in crop_patterns grows in a few states and seasons, so the rows of
+one (state, season) pair only involve a handful of crops. train_model.py
+--shards fits a small forest on the training rows of each pair, next to the
+global model:
+
+    models/<version>/shards/
+    ├── shards.json                 # shard list and training report
+    ├── punjab__kharif/             # ForestEngine node arrays, one directory per shard
+    └── ...
+
+A shard passes only when it is more accurate than the global model on enough
+of its own test rows (less --shard-max-accuracy-loss). Pairs with too few
+rows, or whose specialist does not win, keep using the global model. Shards
+are only published at all when serving with them is at least as accurate on
+held-out rows as the global model alone.
+Shard engines predict over the global model's full crop list, so their
+probabilities can stand in for the global model's anywhere.
+
+ShardSet loads a shard the first time a request needs it and keeps the most
+recently used ones in memory, up to a fixed number. A worker that only sees a
+few regions only ever loads (and walks) their small forests.
+"""
+
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from compress_model import top3_agreement
+from forest_engine import ForestEngine, measure_latency
+from validation import CATEGORICAL_FIELDS, NUMERICAL_FIELDS
+
+SHARDS_DIRNAME = 'shards'
+SHARD_INDEX_FILENAME = 'shards.json'
+SHARD_FORMAT_VERSION = 1
+
+# Shards kept in memory per model version by default
+DEFAULT_CACHE_SIZE = 8
+
+# Fewest training rows a shard is trained on; smaller pairs use the global model
+SHARD_MIN_ROWS = 100
+
+# Fewest selection rows a shard is judged on; with fewer, one lucky row decides
+SHARD_MIN_SELECTION_ROWS = 30
+
+# Single-row predictions timed per model for the report
+LATENCY_CALLS = 200
+
+# Positions of the shard fields among the categorical codes and the model inputs
+STATE_INDEX = CATEGORICAL_FIELDS.index('state')
+SEASON_INDEX = CATEGORICAL_FIELDS.index('season')
+STATE_COLUMN = len(NUMERICAL_FIELDS) + STATE_INDEX
+SEASON_COLUMN = len(NUMERICAL_FIELDS) + SEASON_INDEX
+
+
+def shard_dirname(state, season):
+    """Directory name of a shard: lowercase state and season, e.g. 'uttar_pradesh__kharif'"""
+    return '__'.join(re.sub(r'[^a-z0-9]+', '_', name.lower()).strip('_') for name in (state, season))
+
+
+def with_classes(engine, classes):
+    """The same forest predicting over `classes`, a superset of its own, with zeros for the rest"""
+    columns = [list(classes).index(crop) for crop in engine.classes]
+    value = np.zeros((engine.n_nodes, len(classes)), dtype=engine.value.dtype)
+    value[:, columns] = engine.value
+    return ForestEngine(engine.feature, engine.threshold, engine.children, value, engine.roots, classes,
+                        engine.max_depth, engine.value_scale)
+
+
+class ShardSet:
+    """
+    The published shards of one model version, loaded on first use and kept in
+    a bounded LRU cache
+
+    - directory:  the version's shards/ directory
+    - shards:     {(state code, season code): shard directory name}
+    - mmap:       memory-map the node arrays (MODEL_FORMAT=mmap) or read them into memory
+    - cache_size: shards kept loaded; the least recently used one is dropped beyond that
+    """
+
+    def __init__(self, directory, shards, mmap=True, cache_size=DEFAULT_CACHE_SIZE, report=None):
+        self.directory = directory
+        self.shards = shards
+        self.mmap = mmap
+        self.cache_size = max(1, cache_size)
+        self.report = report or {}
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self.fallbacks = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, directory, label_encoders, mmap=True, cache_size=DEFAULT_CACHE_SIZE):
+        """Read the shard index; no shard is loaded until it is needed"""
+        with open(os.path.join(directory, SHARD_INDEX_FILENAME), 'r') as f:
+            index = json.load(f)
+        if index.get('format_version') != SHARD_FORMAT_VERSION:
+            raise ValueError(f'Unsupported shard format: {index.get("format_version")}')
+        shards = {}
+        for shard in index['shards']:
+            key = (label_encoders['state'].index(shard['state']), label_encoders['season'].index(shard['season']))
+            shards[key] = shard['path']
+        return cls(directory, shards, mmap, cache_size, index.get('report'))
+
+    @property
+    def n_shards(self):
+        return len(self.shards)
+
+    def engine_for(self, categorical_codes):
+        """Shard engine for a row's categorical codes, or None when the global model answers it"""
+        return self.get(categorical_codes[STATE_INDEX], categorical_codes[SEASON_INDEX])
+
+    def get(self, state_code, season_code):
+        """Shard engine of a (state, season) pair, loading it on first use; None if it has none"""
+        key = (state_code, season_code)
+        with self._lock:
+            engine = self._cache.get(key)
+            if engine is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return engine
+            if key not in self.shards:
+                self.fallbacks += 1
+                return None
+
+        # Loaded outside the lock; two requests racing for one shard both load it
+        engine = ForestEngine.load(os.path.join(self.directory, self.shards[key]), mmap=self.mmap)
+        with self._lock:
+            self.loads += 1
+            self._cache[key] = engine
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+        return engine
+
+    def stats(self):
+        """Counters reported by /health"""
+        with self._lock:
+            return {
+                'shards': len(self.shards),
+                'loaded': len(self._cache),
+                'cache_size': self.cache_size,
+                'loaded_bytes': sum(engine.nbytes for engine in self._cache.values()),
+                'hits': self.hits,
+                'loads': self.loads,
+                'evictions': self.evictions,
+                'fallbacks': self.fallbacks
+            }
+
+
+class ShardRouter:
+    """Engine-like wrapper for batches: each row is scored by its shard, or by `fallback`"""
+
+    def __init__(self, shards, fallback):
+        self.shards = shards
+        self.fallback = fallback
+        self.classes = fallback.classes
+
+    def predict_proba(self, X):
+        X = np.asarray(X)
+        probabilities = np.empty((len(X), len(self.classes)))
+        keys = X[:, [STATE_COLUMN, SEASON_COLUMN]].astype(np.int64)
+        pairs, inverse = np.unique(keys, axis=0, return_inverse=True)
+        fallback_rows = []
+        for group, (state, season) in enumerate(pairs.tolist()):
+            rows = np.flatnonzero(inverse.ravel() == group)
+            engine = self.shards.get(state, season)
+            if engine is None:
+                fallback_rows.append(rows)
+            else:
+                probabilities[rows] = engine.predict_proba(X[rows])
+        if fallback_rows:
+            rows = np.concatenate(fallback_rows)
+            probabilities[rows] = self.fallback.predict_proba(X[rows])
+        return probabilities
+
+
+def train_shards(X_train, y_train, X_test, y_test, served, label_encoders, params,
+                 min_rows=SHARD_MIN_ROWS, max_accuracy_loss=0.0, min_selection_rows=SHARD_MIN_SELECTION_ROWS):
+    """
+    Fit one forest with `params` per (state, season) pair of the training split
+    and compare it with the served global engine. Half of the test split
+    decides which shards pass: a shard must beat the global model on at least
+    `min_selection_rows` of its rows (by more than -`max_accuracy_loss`). The
+    other half scores the result, so the comparison is not biased towards the
+    shards that happened to win, and no shard is published unless the result
+    is at least as accurate as the global model alone.
+    Returns ({shard directory name: engine} of the published shards, report).
+    """
+    # Fitting imports scikit-learn; keep it off the serving import path
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.model_selection import train_test_split
+
+    X_train = np.asarray(X_train, dtype=np.float32)
+    X_test = np.asarray(X_test, dtype=np.float32)
+    y_train = np.asarray(y_train)
+    y_test = np.asarray(y_test)
+    states = label_encoders['state']
+    seasons = label_encoders['season']
+    train_keys = X_train[:, STATE_COLUMN].astype(np.int64) * len(seasons) + X_train[:, SEASON_COLUMN].astype(np.int64)
+    test_keys = X_test[:, STATE_COLUMN].astype(np.int64) * len(seasons) + X_test[:, SEASON_COLUMN].astype(np.int64)
+
+    select = np.zeros(len(X_test), dtype=bool)
+    select[train_test_split(np.arange(len(X_test)), test_size=0.5, random_state=42, stratify=y_test)[0]] = True
+    evaluate = ~select
+
+    served_probabilities = served.predict_proba(X_test)
+    served_correct = served.classes[np.argmax(served_probabilities, axis=1)] == y_test
+    sharded_probabilities = served_probabilities.copy()
+
+    shards = []
+    engines = {}
+    for key in np.unique(train_keys).tolist():
+        state, season = states[key // len(seasons)], seasons[key % len(seasons)]
+        train_rows = train_keys == key
+        test_rows = test_keys == key
+        select_rows = test_rows & select
+        entry = {'state': state, 'season': season, 'training_rows': int(train_rows.sum()),
+                 'selection_rows': int(select_rows.sum()), 'evaluation_rows': int((test_rows & evaluate).sum())}
+        shards.append(entry)
+        if entry['training_rows'] < min_rows or entry['selection_rows'] < min_selection_rows:
+            entry['status'] = 'too_few_rows'
+            continue
+
+        forest = RandomForestClassifier(**params, n_jobs=-1).fit(X_train[train_rows], y_train[train_rows])
+        engine = with_classes(ForestEngine.from_sklearn(forest), served.classes).compact()
+        probabilities = engine.predict_proba(X_test[test_rows])
+        correct = engine.classes[np.argmax(probabilities, axis=1)] == y_test[test_rows]
+        entry.update(
+            crops=len(forest.classes_),
+            accuracy=float(np.mean(correct[select[test_rows]])),
+            global_accuracy=float(np.mean(served_correct[select_rows])),
+            n_trees=engine.n_trees,
+            max_depth=engine.max_depth,
+            n_nodes=engine.n_nodes,
+            arrays_bytes=engine.nbytes
+        )
+        if entry['accuracy'] <= entry['global_accuracy'] - max_accuracy_loss:
+            entry['status'] = 'not_better'
+            continue
+
+        entry['status'] = 'published'
+        entry['path'] = shard_dirname(state, season)
+        entry['single_row_p50_ms'] = measure_latency(
+            engine, X_test[test_rows].astype(np.float64), LATENCY_CALLS)['single_row_p50_ms']
+        engines[entry['path']] = engine
+        sharded_probabilities[test_rows] = probabilities
+
+    published = [entry for entry in shards if entry['status'] == 'published']
+    covered = np.isin(test_keys, [states.index(entry['state']) * len(seasons) + seasons.index(entry['season'])
+                                  for entry in published])
+    sharded_correct = served.classes[np.argmax(sharded_probabilities, axis=1)] == y_test
+    covered_evaluation = covered & evaluate
+    # Shards that each won on their own rows may still lose overall; then the global model serves alone
+    withheld = bool(published) and bool(sharded_correct[evaluate].mean() < served_correct[evaluate].mean())
+    report = {
+        'params': params,
+        'min_rows': min_rows,
+        'min_selection_rows': min_selection_rows,
+        'max_accuracy_loss': max_accuracy_loss,
+        'trained': sum(entry['status'] != 'too_few_rows' for entry in shards),
+        'passed': len(published),
+        'withheld': withheld,
+        'published': 0 if withheld else len(published),
+        'evaluation_rows': int(evaluate.sum()),
+        'covered_share': float(covered[evaluate].mean()),
+        'accuracy': float(sharded_correct[evaluate].mean()),
+        'global_accuracy': float(served_correct[evaluate].mean()),
+        'covered_accuracy': float(sharded_correct[covered_evaluation].mean()) if covered_evaluation.any() else None,
+        'covered_global_accuracy':
+            float(served_correct[covered_evaluation].mean()) if covered_evaluation.any() else None,
+        'top3_agreement_with_global': top3_agreement(sharded_probabilities[evaluate], served_probabilities[evaluate]),
+        'global_arrays_bytes': served.nbytes,
+        'global_single_row_p50_ms': measure_latency(
+            served, X_test[covered if covered.any() else slice(None)].astype(np.float64),
+            LATENCY_CALLS)['single_row_p50_ms'],
+        'shard_arrays_bytes': sum(entry['arrays_bytes'] for entry in published),
+        'mean_shard_arrays_bytes':
+            float(np.mean([entry['arrays_bytes'] for entry in published])) if published else None,
+        'mean_shard_single_row_p50_ms':
+            float(np.mean([entry['single_row_p50_ms'] for entry in published])) if published else None,
+        'shards': shards
+    }
+    if withheld:
+        for entry in published:
+            entry['status'] = 'withheld'
+        engines = {}
+    return engines, report
+
+
+def print_shard_report(report):
+    print(f"{'State':<18} {'Season':<11} {'Train':>6} {'Select':>6} {'Crops':>5} {'Trees':>5} {'KB':>7} "
+          f"{'Shard acc':>9} {'Global acc':>10}  Status")
+    for entry in report['shards']:
+        if 'accuracy' in entry:
+            print(f"{entry['state']:<18} {entry['season']:<11} {entry['training_rows']:>6} "
+                  f"{entry['selection_rows']:>6} {entry['crops']:>5} {entry['n_trees']:>5} "
+                  f"{entry['arrays_bytes'] / 1024:>7.1f} {entry['accuracy'] * 100:>8.2f}% "
+                  f"{entry['global_accuracy'] * 100:>9.2f}%  {entry['status']}")
+        else:
+            print(f"{entry['state']:<18} {entry['season']:<11} {entry['training_rows']:>6} "
+                  f"{entry['selection_rows']:>6} {'':>5} {'':>5} {'':>7} {'':>9} {'':>10}  {entry['status']}")
+    print(f"\n{report['passed']} of {report['trained']} trained shards passed the accuracy check on their rows, "
+          f"covering {report['covered_share'] * 100:.1f}% of the {report['evaluation_rows']} held-out test rows")
+    print(f"Held-out accuracy with shards: {report['accuracy'] * 100:.2f}% vs global model "
+          f"{report['global_accuracy'] * 100:.2f}%"
+          + (f" (covered rows: {report['covered_accuracy'] * 100:.2f}% vs "
+             f"{report['covered_global_accuracy'] * 100:.2f}%)" if report['covered_accuracy'] is not None else ""))
+    if report['withheld']:
+        print("⏭️  Not publishing shards: the global model alone is more accurate on the held-out rows")
+    if report['passed']:
+        print(f"Mean shard: {report['mean_shard_arrays_bytes'] / 1024:.1f} KB, single-row p50 "
+              f"{report['mean_shard_single_row_p50_ms']:.3f} ms; global model: "
+              f"{report['global_arrays_bytes'] / 1024:.1f} KB, {report['global_single_row_p50_ms']:.3f} ms")
+
+
+def save_shards(directory, engines, report):
+    """Write the published shard engines and shards.json into `directory`"""
+    for path, engine in engines.items():
+        engine.save(os.path.join(directory, path))
+    index = {
+        'format_version': SHARD_FORMAT_VERSION,
+        'shards': [{'state': entry['state'], 'season': entry['season'], 'path': entry['path']}
+                   for entry in report['shards'] if entry['status'] == 'published'],
+        'report': report
+    }
+    with open(os.path.join(directory, SHARD_INDEX_FILENAME), 'w') as f:
+        json.dump(index, f, indent=2)
@@ -0,0 +1,48 @@
+"""ForestEngine must give the same probabilities as the sklearn forest it was built from"""
+
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from forest_engine import COMPACT_VALUE_SCALE, ForestEngine, check_parity
+
+
+@pytest.fixture(scope='module')
+def forest_and_rows():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(600, 6)).astype(np.float32)
+    y = np.array(['maize', 'rice', 'wheat'])[(X[:, 0] > 0).astype(int) + (X[:, 1] > 0.5).astype(int)]
+    forest = RandomForestClassifier(n_estimators=8, max_depth=6, random_state=0).fit(X[:400], y[:400])
+    return forest, X[400:]
+
+
+def test_engine_matches_sklearn(forest_and_rows):
+    forest, X = forest_and_rows
+    check_parity(ForestEngine.from_sklearn(forest), forest, X)
+
+
+def test_prune_with_every_tree_matches_sklearn(forest_and_rows):
+    forest, X = forest_and_rows
+    engine = ForestEngine.from_sklearn(forest)
+    check_parity(engine.prune(trees=list(range(engine.n_trees))), forest, X)
+
+
+def test_compact_matches_sklearn_within_quantization(forest_and_rows):
+    forest, X = forest_and_rows
+    compact = ForestEngine.from_sklearn(forest).compact()
+    assert compact.value.dtype == np.uint16
+    check_parity(compact, forest, X, tolerance=2.0 / COMPACT_VALUE_SCALE)
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_mmap_round_trip(forest_and_rows, tmp_path, compact):
+    forest, X = forest_and_rows
+    engine = ForestEngine.from_sklearn(forest)
+    if compact:
+        engine = engine.compact()
+    engine.save(str(tmp_path / 'arrays'))
+    loaded = ForestEngine.load(str(tmp_path / 'arrays'), mmap=True)
+
+    assert list(loaded.classes) == list(forest.classes_)
+    np.testing.assert_array_equal(loaded.predict_proba(X), engine.predict_proba(X))
+    check_parity(loaded, forest, X, tolerance=2.0 / COMPACT_VALUE_SCALE if compact else 1e-9)
@@ -17,16 +17,36 @@ Dataset Features:
 - farm_size: Farm size category (Small/Medium/Large)
 
 Target: 22 crop types with 10,000+ samples
+
+Usage:
+    python train_model.py
+    python train_model.py --rows-multiplier 100 --workers 8
+    python train_model.py --shards          # plus specialist models per (state, season)
 """
 
+import argparse
 import pandas as pd
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import LabelEncoder
 from sklearn.metrics import classification_report, accuracy_score, confusion_matrix
 import joblib
 import json
+import os
+from datetime import datetime
+from dataset_cache import DATASET_CACHE_DIR, dataset_key, load_dataset, save_dataset
+from compress_model import (DEFAULT_MIN_TOP3_AGREEMENT, choose_level, compression_report,
+                            print_compression_report)
+from distill_model import (TRANSFER_ROWS_MULTIPLIER, distillation_report, print_distillation_report, skip_reason,
+                           train_student)
+from drift import TRAINING_PROFILE_FILENAME, InputSketch
+from forest_engine import ForestEngine, check_parity
+from metrics import peak_rss_mb
+from shards import SHARD_MIN_ROWS, SHARDS_DIRNAME, print_shard_report, save_shards, train_shards
+from model_registry import (new_version_dir, publish_version, MODEL_FILENAME, ARRAYS_DIRNAME,
+                            STUDENT_ARRAYS_DIRNAME, FEATURE_NAMES_FILENAME, LABEL_ENCODERS_FILENAME)
 
 # Enhanced crop data with location, season, soil type, irrigation, and farm size
 # Based on agricultural research for Indian farming conditions
@@ -242,160 +262,627 @@ crop_patterns = {
     }
 }
 
-# Generate enhanced dataset
-print("🌱 Generating enhanced agricultural dataset...")
-data_rows = []
-
-np.random.seed(42)
-
-for crop, pattern in crop_patterns.items():
-    count = pattern['count']
-    
-    for _ in range(count):
-        # Generate soil parameters with realistic variance
-        n = np.random.uniform(*pattern['N'])
-        p = np.random.uniform(*pattern['P'])
-        k = np.random.uniform(*pattern['K'])
-        temp = np.random.uniform(*pattern['temp'])
-        humidity = np.random.uniform(*pattern['humidity'])
-        ph = np.random.uniform(*pattern['ph'])
-        rainfall = np.random.uniform(*pattern['rainfall'])
-        
-        # Select categorical features
-        state = np.random.choice(pattern['states'])
-        season = np.random.choice(pattern['seasons'])
-        soil_type = np.random.choice(pattern['soil_types'])
-        irrigation = np.random.choice(pattern['irrigation'])
-        farm_size = np.random.choice(pattern['farm_sizes'])
-        
-        data_rows.append({
-            'N': round(n, 2),
-            'P': round(p, 2),
-            'K': round(k, 2),
-            'temperature': round(temp, 2),
-            'humidity': round(humidity, 2),
-            'ph': round(ph, 2),
-            'rainfall': round(rainfall, 2),
-            'state': state,
-            'season': season,
-            'soil_type': soil_type,
-            'irrigation': irrigation,
-            'farm_size': farm_size,
-            'label': crop
+# Pattern keys for each generated column, in feature order
+NUMERICAL_PATTERN_KEYS = {
+    'N': 'N', 'P': 'P', 'K': 'K', 'temperature': 'temp',
+    'humidity': 'humidity', 'ph': 'ph', 'rainfall': 'rainfall'
+}
+CATEGORICAL_PATTERN_KEYS = {
+    'state': 'states', 'season': 'seasons', 'soil_type': 'soil_types',
+    'irrigation': 'irrigation', 'farm_size': 'farm_sizes'
+}
+
+# Valid (min, max) range of each numerical feature, same as the API validation
+CLIP_RANGES = {
+    'N': (0, 140),
+    'P': (5, 145),
+    'K': (5, 205),
+    'temperature': (8, 43),
+    'humidity': (14, 99),
+    'ph': (3.5, 9.9),
+    'rainfall': (20, 300)
+}
+
+# Model inputs, in the order app.py builds them
+FEATURE_COLUMNS = ['N', 'P', 'K', 'temperature', 'humidity', 'ph', 'rainfall',
+                   'state_encoded', 'season_encoded', 'soil_type_encoded',
+                   'irrigation_encoded', 'farm_size_encoded']
+
+# Forest trained by default; model_search.py tunes these
+FOREST_PARAMS = {
+    'n_estimators': 200,
+    'max_depth': 25,
+    'min_samples_split': 3,
+    'min_samples_leaf': 1,
+    'class_weight': 'balanced',
+    'random_state': 42
+}
+
+# Specialist forests trained per (state, season) shard with --shards
+SHARD_FOREST_PARAMS = dict(FOREST_PARAMS, n_estimators=50)
+
+# Bump whenever generate_dataset or prepare_dataset changes the data they produce
+DATASET_GENERATOR_VERSION = 1
+
+# Rows generated per task; large crops are split so chunks spread over the pool
+GENERATION_CHUNK_ROWS = 250_000
+
+# Below this many rows the process pool costs more than it saves
+PARALLEL_MIN_ROWS = 500_000
+
+
+def generate_crop_samples(task):
+    """
+    Generate one chunk of samples for one crop, a whole column at a time.
+    `task` is (crop, pattern, count, seed_sequence); the chunk's own
+    SeedSequence makes the output independent of which process runs it.
+    """
+    crop, pattern, count, seed_sequence = task
+    rng = np.random.default_rng(seed_sequence)
+
+    columns = {}
+    # Soil parameters with realistic variance
+    for column, key in NUMERICAL_PATTERN_KEYS.items():
+        low, high = pattern[key]
+        columns[column] = np.round(rng.uniform(low, high, size=count), 2)
+
+    # Categorical features
+    for column, key in CATEGORICAL_PATTERN_KEYS.items():
+        options = np.asarray(pattern[key])
+        columns[column] = options[rng.integers(len(options), size=count)]
+
+    columns['label'] = np.full(count, crop)
+    return columns
+
+
+def plan_generation(patterns, seed, rows_multiplier):
+    """(crop, pattern, count, seed_sequence) generation tasks, in dataset row order"""
+    crop_sequences = np.random.SeedSequence(seed).spawn(len(patterns))
+
+    tasks = []
+    for (crop, pattern), crop_sequence in zip(patterns.items(), crop_sequences):
+        count = max(1, int(round(pattern['count'] * rows_multiplier)))
+        chunk_counts = [GENERATION_CHUNK_ROWS] * (count // GENERATION_CHUNK_ROWS)
+        if count % GENERATION_CHUNK_ROWS:
+            chunk_counts.append(count % GENERATION_CHUNK_ROWS)
+        for chunk_count, chunk_sequence in zip(chunk_counts, crop_sequence.spawn(len(chunk_counts))):
+            tasks.append((crop, pattern, chunk_count, chunk_sequence))
+    return tasks
+
+
+def use_process_pool(workers, tasks):
+    """Worker count, and whether the dataset is large enough to generate in a process pool"""
+    workers = workers or os.cpu_count() or 1
+    return workers, workers > 1 and len(tasks) > 1 and sum(task[2] for task in tasks) >= PARALLEL_MIN_ROWS
+
+
+def generate_dataset(patterns=crop_patterns, seed=42, rows_multiplier=1.0, workers=None):
+    """
+    Build the synthetic dataset from `patterns`, scaling every crop's sample
+    count by `rows_multiplier`. Each crop (and each chunk of a large crop) draws
+    from its own stream spawned from `seed`, so the result is deterministic for
+    a given seed and multiplier no matter how many workers generate it.
+    """
+    tasks = plan_generation(patterns, seed, rows_multiplier)
+    total_rows = sum(task[2] for task in tasks)
+    workers, parallel = use_process_pool(workers, tasks)
+    if parallel:
+        print(f"⚙️  Generating {total_rows:,} rows in {len(tasks)} chunks on {workers} processes...")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunks = list(executor.map(generate_crop_samples, tasks))
+    else:
+        chunks = [generate_crop_samples(task) for task in tasks]
+
+    return pd.DataFrame({
+        column: np.concatenate([chunk[column] for chunk in chunks])
+        for column in chunks[0]
+    })
+
+
+def prepare_dataset(crop_data):
+    """Clip numerical features to valid ranges and label encode categoricals"""
+    # Ensure valid ranges for numerical features
+    df = crop_data.copy()
+    for column, (low, high) in CLIP_RANGES.items():
+        df[column] = df[column].clip(low, high)
+
+    # Encode categorical variables
+    label_encoders = {}
+    for col in CATEGORICAL_PATTERN_KEYS:
+        le = LabelEncoder()
+        df[col + '_encoded'] = le.fit_transform(df[col])
+        label_encoders[col] = le
+
+    return df, label_encoders
+
+
+class CompactDataset:
+    """
+    Prepared dataset as compact arrays instead of a DataFrame (--compact)
+
+    - numerical:           (n, 7) float32 features, clipped to CLIP_RANGES
+    - categorical:         (n, 5) uint8 label encoded categorical features
+    - labels:              (n,) uint8 crop codes
+    - categorical_classes: {column: classes}, as each column's LabelEncoder.classes_
+    - label_classes:       crop name of each label code
+
+    The values are exactly the ones the DataFrame path hands to scikit-learn,
+    which casts the features to float32 anyway, so both train the same forest.
+    """
+
+    def __init__(self, numerical, categorical, labels, categorical_classes, label_classes):
+        self.numerical = numerical
+        self.categorical = categorical
+        self.labels = labels
+        self.categorical_classes = categorical_classes
+        self.label_classes = np.array(label_classes, dtype=object)
+
+    @property
+    def n_rows(self):
+        return len(self.labels)
+
+    @property
+    def nbytes(self):
+        return self.numerical.nbytes + self.categorical.nbytes + self.labels.nbytes
+
+    def label_encoders(self):
+        label_encoders = {}
+        for column, classes in self.categorical_classes.items():
+            encoder = LabelEncoder()
+            encoder.classes_ = np.array(classes)
+            label_encoders[column] = encoder
+        return label_encoders
+
+    def features(self, rows=None):
+        """float32 model inputs in FEATURE_COLUMNS order, for all rows or the given row indices"""
+        rows = np.arange(self.n_rows) if rows is None else rows
+        n_numerical = self.numerical.shape[1]
+        X = np.empty((len(rows), len(FEATURE_COLUMNS)), dtype=np.float32)
+        # Gather in blocks so no full-size temporary copy is made
+        for start in range(0, len(rows), GENERATION_CHUNK_ROWS):
+            block = rows[start:start + GENERATION_CHUNK_ROWS]
+            X[start:start + len(block), :n_numerical] = self.numerical[block]
+            X[start:start + len(block), n_numerical:] = self.categorical[block]
+        return X
+
+    def label_names(self, rows=None):
+        return self.label_classes[self.labels if rows is None else self.labels[rows]]
+
+
+# Compact code of a categorical value outside a fixed vocabulary
+UNKNOWN_CODE = np.iinfo(np.uint8).max
+
+
+def generate_compact_samples(task):
+    """
+    generate_crop_samples for the compact path: the same draws in the same
+    order, returned as clipped float32 features and uint8 indices into each
+    column's vocabulary. `task` is (pattern, count, seed_sequence, vocabularies).
+    """
+    pattern, count, seed_sequence, vocabularies = task
+    rng = np.random.default_rng(seed_sequence)
+
+    numerical = np.empty((count, len(NUMERICAL_PATTERN_KEYS)), dtype=np.float32)
+    for j, (column, key) in enumerate(NUMERICAL_PATTERN_KEYS.items()):
+        low, high = pattern[key]
+        numerical[:, j] = np.round(rng.uniform(low, high, size=count), 2).clip(*CLIP_RANGES[column])
+
+    categorical = np.empty((count, len(CATEGORICAL_PATTERN_KEYS)), dtype=np.uint8)
+    for j, (column, key) in enumerate(CATEGORICAL_PATTERN_KEYS.items()):
+        codes = {value: code for code, value in enumerate(vocabularies[column])}
+        options = np.array([codes.get(option, UNKNOWN_CODE) for option in pattern[key]], dtype=np.uint8)
+        categorical[:, j] = options[rng.integers(len(options), size=count)]
+    return numerical, categorical
+
+
+def generate_compact_dataset(patterns=crop_patterns, seed=42, rows_multiplier=1.0, workers=None,
+                             categorical_classes=None):
+    """
+    The rows of prepare_dataset(generate_dataset(...)), generated straight into
+    a CompactDataset: no string columns, DataFrame copies or int64 codes.
+    Categorical codes follow LabelEncoder (sorted classes that occur) unless
+    `categorical_classes` fixes them, e.g. to encode with the training encoders.
+    """
+    tasks = plan_generation(patterns, seed, rows_multiplier)
+    total_rows = sum(task[2] for task in tasks)
+    label_classes = sorted(patterns)
+    vocabularies = categorical_classes or {
+        column: sorted({option for pattern in patterns.values() for option in pattern[key]})
+        for column, key in CATEGORICAL_PATTERN_KEYS.items()
+    }
+
+    numerical = np.empty((total_rows, len(NUMERICAL_PATTERN_KEYS)), dtype=np.float32)
+    categorical = np.empty((total_rows, len(CATEGORICAL_PATTERN_KEYS)), dtype=np.uint8)
+    labels = np.empty(total_rows, dtype=np.uint8)
+    compact_tasks = [(pattern, count, sequence, vocabularies) for _, pattern, count, sequence in tasks]
+
+    # Chunks are copied into place as they arrive instead of concatenated at the end
+    workers, parallel = use_process_pool(workers, tasks)
+    executor = ProcessPoolExecutor(max_workers=workers) if parallel else None
+    if parallel:
+        print(f"⚙️  Generating {total_rows:,} rows in {len(tasks)} chunks on {workers} processes...")
+    try:
+        chunks = executor.map(generate_compact_samples, compact_tasks) if parallel \
+            else map(generate_compact_samples, compact_tasks)
+        start = 0
+        for (crop, _, count, _), (chunk_numerical, chunk_categorical) in zip(tasks, chunks):
+            numerical[start:start + count] = chunk_numerical
+            categorical[start:start + count] = chunk_categorical
+            labels[start:start + count] = label_classes.index(crop)
+            start += count
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if categorical_classes is not None:
+        for j, column in enumerate(CATEGORICAL_PATTERN_KEYS):
+            if (categorical[:, j] == UNKNOWN_CODE).any():
+                raise ValueError(f'{column} contains values missing from the given classes')
+    else:
+        # LabelEncoder only knows the classes that occur; renumber if some never did
+        categorical_classes = {}
+        for j, column in enumerate(CATEGORICAL_PATTERN_KEYS):
+            used = np.bincount(categorical[:, j], minlength=len(vocabularies[column])) > 0
+            if not used.all():
+                categorical[:, j] = (np.cumsum(used) - 1).astype(np.uint8)[categorical[:, j]]
+            categorical_classes[column] = [value for value, ok in zip(vocabularies[column], used) if ok]
+
+    return CompactDataset(numerical, categorical, labels, categorical_classes, label_classes)
+
+
+def dataset_settings(patterns, seed, rows_multiplier):
+    """Everything the prepared dataset depends on, hashed into its cache key"""
+    return {
+        'generator_version': DATASET_GENERATOR_VERSION,
+        'crop_patterns': patterns,
+        'seed': seed,
+        'rows_multiplier': rows_multiplier,
+        'clip_ranges': CLIP_RANGES,
+        'encoders': {'columns': list(CATEGORICAL_PATTERN_KEYS), 'method': 'LabelEncoder'}
+    }
+
+
+def load_or_build_dataset(patterns, seed, rows_multiplier, workers, cache_dir):
+    """
+    Prepared dataset for these settings, from the dataset cache when possible.
+    Pass cache_dir=None to always generate.
+    """
+    if cache_dir is None:
+        print("🌱 Generating enhanced agricultural dataset...")
+        return prepare_dataset(generate_dataset(patterns, seed, rows_multiplier, workers))
+
+    settings = dataset_settings(patterns, seed, rows_multiplier)
+    key = dataset_key(settings)
+    cached = load_dataset(cache_dir, key)
+    if cached is not None:
+        print(f"📦 Dataset cache hit ({key[:12]}): loaded {len(cached[0]):,} rows from '{cache_dir}/'")
+        return cached
+
+    print(f"📦 Dataset cache miss ({key[:12]}), generating...")
+    print("🌱 Generating enhanced agricultural dataset...")
+    df, label_encoders = prepare_dataset(generate_dataset(patterns, seed, rows_multiplier, workers))
+    save_dataset(cache_dir, key, df, label_encoders, list(NUMERICAL_PATTERN_KEYS), settings)
+    print(f"💾 Dataset cached in '{os.path.join(cache_dir, key)}/'")
+    # Continue from the cached copy so cache hits and misses train on identical data
+    return load_dataset(cache_dir, key)
+
+
+def split_dataset(df):
+    """Stratified 80/20 train/test split of the encoded features"""
+    # Use both original categorical (for reference) and encoded (for training)
+    X = df[FEATURE_COLUMNS]
+    y = df['label']
+    return train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
+
+
+def split_compact_dataset(dataset):
+    """split_dataset for a CompactDataset: the same rows, as float32 arrays and crop names"""
+    train_rows, test_rows = train_test_split(
+        np.arange(dataset.n_rows), test_size=0.2, random_state=42, stratify=dataset.labels)
+    return (dataset.features(train_rows), dataset.features(test_rows),
+            dataset.label_names(train_rows), dataset.label_names(test_rows))
+
+
+def build_training_profile(X_train, label_encoders):
+    """
+    Sketch of the training split's input distribution (drift.InputSketch),
+    saved with the model so the service can compare live inputs against it
+    """
+    sketch = InputSketch()
+    n_numerical = len(NUMERICAL_PATTERN_KEYS)
+    classes = [np.asarray(encoder.classes_) for encoder in label_encoders.values()]
+    for start in range(0, len(X_train), GENERATION_CHUNK_ROWS):
+        # float32, the values the forest was fitted on, so both data paths give the same profile
+        block = np.asarray(X_train[start:start + GENERATION_CHUNK_ROWS], dtype=np.float32)
+        sketch.update_many(block[:, :n_numerical], {
+            column: column_classes[block[:, n_numerical + j].astype(np.intp)]
+            for j, (column, column_classes) in enumerate(zip(label_encoders, classes))
         })
+    return sketch.to_dict()
+
+
+def publish_model(model, feature_names, label_encoders, manifest, engine=None, student=None,
+                  training_profile=None, make_current=True, shards=None):
+    """
+    Publish a trained forest as a new version under models/ so app.py can hot
+    reload it. The model, its memory-mappable node arrays and the encoders
+    always travel together. Pass `engine` to serve a compressed engine instead
+    of the full forest, `student` to add a distilled fast-tier engine and
+    `training_profile` to save the training input distribution for drift checks.
+    `shards` is the (engines, report) pair of train_shards for per-region models.
+    With make_current=False the version is published without becoming CURRENT.
+    Returns (version, version_path).
+    """
+    version, staging_path = new_version_dir()
+
+    joblib.dump(model, os.path.join(staging_path, MODEL_FILENAME))
+    print(f"\n💾 Model saved as '{MODEL_FILENAME}'")
+
+    if engine is None:
+        engine = ForestEngine.from_sklearn(model)
+    engine.save(os.path.join(staging_path, ARRAYS_DIRNAME))
+    print(f"💾 Memory-mappable model arrays saved in '{ARRAYS_DIRNAME}/'")
+
+    if student is not None:
+        student.save(os.path.join(staging_path, STUDENT_ARRAYS_DIRNAME))
+        print(f"💾 Fast-tier student arrays saved in '{STUDENT_ARRAYS_DIRNAME}/'")
+
+    if shards is not None:
+        shards_path = os.path.join(staging_path, SHARDS_DIRNAME)
+        os.makedirs(shards_path)
+        save_shards(shards_path, *shards)
+        print(f"💾 {len(shards[0])} shard models saved in '{SHARDS_DIRNAME}/'")
+
+    # Save feature names
+    with open(os.path.join(staging_path, FEATURE_NAMES_FILENAME), 'w') as f:
+        json.dump(feature_names, f)
+    print(f"💾 Feature names saved as '{FEATURE_NAMES_FILENAME}'")
+
+    # Save label encoders for API use
+    encoders_dict = {}
+    for col, encoder in label_encoders.items():
+        encoders_dict[col] = encoder.classes_.tolist()
+
+    with open(os.path.join(staging_path, LABEL_ENCODERS_FILENAME), 'w') as f:
+        json.dump(encoders_dict, f, indent=2)
+    print(f"💾 Label encoders saved as '{LABEL_ENCODERS_FILENAME}'")
+
+    if training_profile is not None:
+        with open(os.path.join(staging_path, TRAINING_PROFILE_FILENAME), 'w') as f:
+            json.dump(training_profile, f)
+        print(f"💾 Training input profile saved as '{TRAINING_PROFILE_FILENAME}'")
+
+    version_path = publish_version(version, staging_path, manifest, make_current=make_current)
+
+    # Keep reference copies of the schema next to the service
+    with open('feature_names.json', 'w') as f:
+        json.dump(feature_names, f)
+    with open('label_encoders.json', 'w') as f:
+        json.dump(encoders_dict, f, indent=2)
+
+    return version, version_path
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Train the Krishi Mitra crop recommendation model')
+    parser.add_argument('--rows-multiplier', type=float, default=1.0,
+                        help='scale every crop\'s sample count in crop_patterns (default: 1.0)')
+    parser.add_argument('--seed', type=int, default=42,
+                        help='seed for synthetic data generation (default: 42)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='processes used to generate large datasets (default: all CPUs)')
+    parser.add_argument('--dataset-cache-dir', default=DATASET_CACHE_DIR,
+                        help=f'where generated datasets are cached (default: {DATASET_CACHE_DIR})')
+    parser.add_argument('--no-dataset-cache', action='store_true',
+                        help='always regenerate the dataset and do not cache it')
+    parser.add_argument('--max-accuracy-loss', type=float, default=0.5,
+                        help='accuracy (percentage points) compression may give up (default: 0.5)')
+    parser.add_argument('--min-top3-agreement', type=float, default=DEFAULT_MIN_TOP3_AGREEMENT * 100,
+                        help='share of rows (percent) whose top 3 crops a compressed model (vs the full model) '
+                             'and the fast-tier student (vs the served model) must keep listing '
+                             f'(default: {DEFAULT_MIN_TOP3_AGREEMENT * 100:g})')
+    parser.add_argument('--no-compress', action='store_true',
+                        help='serve the full forest instead of the smallest compressed one')
+    parser.add_argument('--no-distill', action='store_true',
+                        help='do not train the distilled fast-tier model')
+    parser.add_argument('--compact', action='store_true',
+                        help='generate straight into float32/uint8 arrays instead of DataFrames to cut peak '
+                             'memory on large datasets (same model; bypasses the dataset cache)')
+    parser.add_argument('--shards', action='store_true',
+                        help='also train a specialist model per (state, season), served with SHARDS_ENABLED=1')
+    parser.add_argument('--shard-trees', type=int, default=SHARD_FOREST_PARAMS['n_estimators'],
+                        help=f'trees per shard model (default: {SHARD_FOREST_PARAMS["n_estimators"]})')
+    parser.add_argument('--shard-min-rows', type=int, default=SHARD_MIN_ROWS,
+                        help=f'training rows a shard needs to get its own model (default: {SHARD_MIN_ROWS})')
+    parser.add_argument('--shard-max-accuracy-loss', type=float, default=0.0,
+                        help='accuracy (percentage points) a shard model may lose against the global model '
+                             'on its test rows and still pass; at 0 it must be more accurate (default: 0)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.compact:
+        # Compact arrays only: the split below is the only float32 feature copy
+        print("🌱 Generating enhanced agricultural dataset (compact arrays)...")
+        dataset = generate_compact_dataset(crop_patterns, args.seed, args.rows_multiplier, args.workers)
+        label_encoders = dataset.label_encoders()
+    else:
+        # Generate enhanced dataset (or load it from the dataset cache)
+        df, label_encoders = load_or_build_dataset(
+            crop_patterns, args.seed, args.rows_multiplier, args.workers,
+            cache_dir=None if args.no_dataset_cache else args.dataset_cache_dir
+        )
+
+    for col, le in label_encoders.items():
+        print(f"\n{col.replace('_', ' ').title()} Encoding:")
+        for i, label in enumerate(le.classes_):
+            print(f"  {i}: {label}")
+
+    if args.compact:
+        print(f"Dataset: {dataset.n_rows:,} rows in {dataset.nbytes / 1024 / 1024:.1f} MB of compact arrays")
+        print("\nCrop Distribution:")
+        print(pd.Series(dataset.label_names()).value_counts())
+
+        X_train, X_test, y_train, y_test = split_compact_dataset(dataset)
+        del dataset
+    else:
+        print("Dataset Shape:", df.shape)
+        print("\nDataset Info:")
+        print(df.info())
+        print("\nCrop Distribution:")
+        print(df['label'].value_counts())
+
+        # Prepare features and target and split dataset
+        X_train, X_test, y_train, y_test = split_dataset(df)
+
+    print(f"\nTraining samples: {len(X_train)}")
+    print(f"Testing samples: {len(X_test)}")
+
+    # Train Random Forest Classifier
+    print("\n🌱 Training Random Forest Classifier...")
+    model = RandomForestClassifier(**FOREST_PARAMS, n_jobs=-1)
+
+    model.fit(X_train, y_train)
+    print("✅ Model training complete!")
+
+    # Evaluate model
+    y_pred = model.predict(X_test)
+    accuracy = accuracy_score(y_test, y_pred)
+
+    print(f"\n📊 Model Accuracy: {accuracy * 100:.2f}%")
+    print("\nClassification Report:")
+    print(classification_report(y_test, y_pred))
+
+    # Check the array-backed inference engine used by app.py against sklearn
+    print("\n🧪 Checking inference engine parity on the test split...")
+    parity = check_parity(ForestEngine.from_sklearn(model), model, X_test)
+    print(f"✅ Engine matches sklearn on {parity['rows']} rows "
+          f"(max probability difference: {parity['max_probability_difference']:.2e})")
+
+    # Feature importance
+    feature_importance = pd.DataFrame({
+        'feature': FEATURE_COLUMNS,
+        'importance': model.feature_importances_
+    }).sort_values('importance', ascending=False)
+
+    print("\n🔍 Feature Importance:")
+    print(feature_importance)
+
+    # Compress the served node arrays: drop trees, cap depth, narrow dtypes.
+    # Half of the test split picks which trees to drop, the other half scores each level.
+    full_engine = engine = ForestEngine.from_sklearn(model)
+    compression = None
+    if not args.no_compress:
+        print("\n🗜️  Compressing model...")
+        X_select, X_eval, y_select, y_eval = train_test_split(
+            X_test, y_test, test_size=0.5, random_state=42, stratify=y_test)
+        levels, build_level = compression_report(engine, X_select, y_select, X_eval, y_eval)
+        chosen = choose_level(levels, args.max_accuracy_loss / 100, args.min_top3_agreement / 100)
+        print_compression_report(levels, chosen, args.min_top3_agreement / 100)
+
+        engine = build_level(chosen)
+        compression = dict(levels[chosen], max_accuracy_loss=args.max_accuracy_loss / 100,
+                           min_top3_agreement=args.min_top3_agreement / 100,
+                           full_arrays_bytes=levels[0]['arrays_bytes'])
+        print(f"✅ Serving {engine.n_trees} trees up to depth {engine.max_depth}: "
+              f"{levels[chosen]['arrays_bytes'] / 1024 / 1024:.2f} MB instead of "
+              f"{levels[0]['arrays_bytes'] / 1024 / 1024:.2f} MB, accuracy "
+              f"{levels[chosen]['accuracy'] * 100:.2f}% vs {levels[0]['accuracy'] * 100:.2f}%, "
+              f"top-3 agreement {levels[chosen]['top3_agreement'] * 100:.2f}%, "
+              f"single-row p50 {levels[chosen]['single_row_p50_ms']:.3f} ms vs "
+              f"{levels[0]['single_row_p50_ms']:.3f} ms")
+
+    # Distill the full forest into a small student for /predict?tier=fast. The
+    # transfer set adds fresh samples that only the full forest labels.
+    student = None
+    distillation = None
+    if not args.no_distill:
+        print("\n⚗️  Distilling fast-tier student model...")
+        if args.compact:
+            transfer = generate_compact_dataset(
+                crop_patterns, args.seed + 1, args.rows_multiplier * TRANSFER_ROWS_MULTIPLIER, args.workers,
+                categorical_classes={col: le.classes_.tolist() for col, le in label_encoders.items()})
+            X_transfer = np.vstack([X_train, transfer.features()])
+            del transfer
+        else:
+            transfer_df, _ = prepare_dataset(generate_dataset(
+                crop_patterns, args.seed + 1, args.rows_multiplier * TRANSFER_ROWS_MULTIPLIER, args.workers))
+            for col, le in label_encoders.items():
+                transfer_df[col + '_encoded'] = le.transform(transfer_df[col])
+            X_transfer = np.vstack([X_train.to_numpy(dtype=np.float32),
+                                    transfer_df[FEATURE_COLUMNS].to_numpy(dtype=np.float32)])
+
+        student = train_student(X_transfer, full_engine.predict_proba(X_transfer), full_engine.classes)
+        distillation = distillation_report(student, full_engine, X_test, y_test, served=engine)
+        print_distillation_report(distillation)
+        distillation['transfer_samples'] = len(X_transfer)
+        distillation['skip_reason'] = skip_reason(distillation, min_top3_agreement=args.min_top3_agreement / 100)
+        distillation['published'] = distillation['skip_reason'] is None
+        if not distillation['published']:
+            # tier=fast then falls back to the accurate tier
+            print(f"⏭️  Not publishing the fast tier: the student's {distillation['skip_reason']}")
+            student = None
+
+    # Specialist models per (state, season), compared with the served global model on each shard's test rows
+    shards = None
+    shard_summary = None
+    if args.shards:
+        print("\n🧩 Training per-region shard models...")
+        shards = train_shards(
+            X_train, y_train, X_test, y_test, engine,
+            {col: le.classes_.tolist() for col, le in label_encoders.items()},
+            dict(SHARD_FOREST_PARAMS, n_estimators=args.shard_trees),
+            args.shard_min_rows, args.shard_max_accuracy_loss / 100)
+        print_shard_report(shards[1])
+        shard_summary = {key: value for key, value in shards[1].items() if key != 'shards'}
+        if not shards[1]['published']:
+            shards = None
+
+    version, version_path = publish_model(model, FEATURE_COLUMNS, label_encoders, {
+        'created_at': datetime.now().isoformat(),
+        'accuracy': accuracy,
+        'n_estimators': model.n_estimators,
+        'max_depth': model.max_depth,
+        'training_samples': len(X_train),
+        'testing_samples': len(X_test),
+        'rows_multiplier': args.rows_multiplier,
+        'data_seed': args.seed,
+        'compact': args.compact,
+        'compression': compression,
+        'distillation': distillation,
+        'shards': shard_summary
+    }, engine=engine, student=student, training_profile=build_training_profile(X_train, label_encoders),
+        shards=shards)
+    print(f"🏷️  Published model version {version} in '{version_path}/' (now CURRENT)")
+
+    # Test prediction with enhanced features
+    # Test case: Rice in Punjab, Kharif season, Clay soil, Flood irrigation, Medium farm
+    state_idx = label_encoders['state'].transform(['Punjab'])[0]
+    season_idx = label_encoders['season'].transform(['Kharif'])[0]
+    soil_idx = label_encoders['soil_type'].transform(['Clay'])[0]
+    irrigation_idx = label_encoders['irrigation'].transform(['Flood'])[0]
+    farm_size_idx = label_encoders['farm_size'].transform(['Medium'])[0]
+
+    sample_input = [[90, 42, 43, 28, 80, 6.5, 200, state_idx, season_idx, soil_idx, irrigation_idx, farm_size_idx]]
+    prediction = model.predict(sample_input)
+    probabilities = model.predict_proba(sample_input)
+
+    print(f"\n🧪 Test Prediction:")
+    print(f"Input: N=90, P=42, K=43, temp=28°C, humidity=80%, pH=6.5, rainfall=200mm")
+    print(f"       State=Punjab, Season=Kharif, Soil=Clay, Irrigation=Flood, Farm=Medium")
+    print(f"Predicted Crop: {prediction[0]}")
+    print(f"Confidence: {max(probabilities[0]) * 100:.2f}%")
+
+    peak_mb = peak_rss_mb()
+    if peak_mb is not None:
+        print(f"\n📈 Peak memory: {peak_mb:.0f} MB")
+
+    print("\n✅ Training script completed successfully!")
+    print("Next step: Run 'python app.py' to start the Flask API server "
+          "(a running server picks the new version up via POST /admin/reload)")
+
 
-crop_data = pd.DataFrame(data_rows)
-
-# Ensure valid ranges for numerical features
-df = crop_data.copy()
-df['N'] = df['N'].clip(0, 140)
-df['P'] = df['P'].clip(5, 145)
-df['K'] = df['K'].clip(5, 205)
-df['temperature'] = df['temperature'].clip(8, 43)
-df['humidity'] = df['humidity'].clip(14, 99)
-df['ph'] = df['ph'].clip(3.5, 9.9)
-df['rainfall'] = df['rainfall'].clip(20, 300)
-
-# Encode categorical variables
-label_encoders = {}
-for col in ['state', 'season', 'soil_type', 'irrigation', 'farm_size']:
-    le = LabelEncoder()
-    df[col + '_encoded'] = le.fit_transform(df[col])
-    label_encoders[col] = le
-    print(f"\n{col.replace('_', ' ').title()} Encoding:")
-    for i, label in enumerate(le.classes_):
-        print(f"  {i}: {label}")
-
-print("Dataset Shape:", df.shape)
-print("\nDataset Info:")
-print(df.info())
-print("\nCrop Distribution:")
-print(df['label'].value_counts())
-
-# Prepare features and target
-# Use both original categorical (for reference) and encoded (for training)
-feature_cols = ['N', 'P', 'K', 'temperature', 'humidity', 'ph', 'rainfall',
-                'state_encoded', 'season_encoded', 'soil_type_encoded',
-                'irrigation_encoded', 'farm_size_encoded']
-
-X = df[feature_cols]
-y = df['label']
-
-# Split dataset
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
-
-print(f"\nTraining samples: {len(X_train)}")
-print(f"Testing samples: {len(X_test)}")
-
-# Train Random Forest Classifier
-print("\n🌱 Training Random Forest Classifier...")
-model = RandomForestClassifier(
-    n_estimators=200,
-    max_depth=25,
-    min_samples_split=3,
-    min_samples_leaf=1,
-    class_weight='balanced',
-    random_state=42,
-    n_jobs=-1
-)
-
-model.fit(X_train, y_train)
-print("✅ Model training complete!")
-
-# Evaluate model
-y_pred = model.predict(X_test)
-accuracy = accuracy_score(y_test, y_pred)
-
-print(f"\n📊 Model Accuracy: {accuracy * 100:.2f}%")
-print("\nClassification Report:")
-print(classification_report(y_test, y_pred))
-
-# Feature importance
-feature_importance = pd.DataFrame({
-    'feature': X.columns,
-    'importance': model.feature_importances_
-}).sort_values('importance', ascending=False)
-
-print("\n🔍 Feature Importance:")
-print(feature_importance)
-
-# Save the model
-model_filename = 'crop_model.pkl'
-joblib.dump(model, model_filename)
-print(f"\n💾 Model saved as '{model_filename}'")
-
-# Save feature names
-feature_names = X.columns.tolist()
-with open('feature_names.json', 'w') as f:
-    json.dump(feature_names, f)
-print("💾 Feature names saved as 'feature_names.json'")
-
-# Save label encoders for API use
-encoders_dict = {}
-for col, encoder in label_encoders.items():
-    encoders_dict[col] = encoder.classes_.tolist()
-
-with open('label_encoders.json', 'w') as f:
-    json.dump(encoders_dict, f, indent=2)
-print("💾 Label encoders saved as 'label_encoders.json'")
-
-# Test prediction with enhanced features
-# Test case: Rice in Punjab, Kharif season, Clay soil, Flood irrigation, Medium farm
-state_idx = label_encoders['state'].transform(['Punjab'])[0]
-season_idx = label_encoders['season'].transform(['Kharif'])[0]
-soil_idx = label_encoders['soil_type'].transform(['Clay'])[0]
-irrigation_idx = label_encoders['irrigation'].transform(['Flood'])[0]
-farm_size_idx = label_encoders['farm_size'].transform(['Medium'])[0]
-
-sample_input = [[90, 42, 43, 28, 80, 6.5, 200, state_idx, season_idx, soil_idx, irrigation_idx, farm_size_idx]]
-prediction = model.predict(sample_input)
-probabilities = model.predict_proba(sample_input)
-
-print(f"\n🧪 Test Prediction:")
-print(f"Input: N=90, P=42, K=43, temp=28°C, humidity=80%, pH=6.5, rainfall=200mm")
-print(f"       State=Punjab, Season=Kharif, Soil=Clay, Irrigation=Flood, Farm=Medium")
-print(f"Predicted Crop: {prediction[0]}")
-print(f"Confidence: {max(probabilities[0]) * 100:.2f}%")
-
-print("\n✅ Training script completed successfully!")
-print("Next step: Run 'python app.py' to start the Flask API server")
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Input validation and encoding rules for farm profiles
+
+Shared by the API (app.py) and offline scoring (bulk_score.py), so a record is
+accepted, encoded and rejected with the same messages everywhere. parse_record
+checks one JSON record; validate_columns applies the same rules to many records
+at once, column by column.
+"""
+
+import numpy as np
+
+# Input fields, in the column order the model was trained on
+NUMERICAL_FIELDS = ['N', 'P', 'K', 'temperature', 'humidity', 'ph', 'rainfall']
+CATEGORICAL_FIELDS = ['state', 'season', 'soil_type', 'irrigation', 'farm_size']
+REQUIRED_FIELDS = NUMERICAL_FIELDS + CATEGORICAL_FIELDS
+
+# Valid (min, max) range and error message for each numerical field
+NUMERICAL_RANGES = [
+    (0, 140, 'Nitrogen (N) must be between 0-140'),
+    (5, 145, 'Phosphorus (P) must be between 5-145'),
+    (5, 205, 'Potassium (K) must be between 5-205'),
+    (8, 43, 'Temperature must be between 8-43°C'),
+    (14, 99, 'Humidity must be between 14-99%'),
+    (3.5, 9.9, 'pH must be between 3.5-9.9'),
+    (20, 300, 'Rainfall must be between 20-300mm')
+]
+RANGE_MIN = np.array([low for low, _, _ in NUMERICAL_RANGES])
+RANGE_MAX = np.array([high for _, high, _ in NUMERICAL_RANGES])
+
+# Human readable names used in categorical validation errors
+CATEGORICAL_LABELS = {
+    'state': 'state',
+    'season': 'season',
+    'soil_type': 'soil type',
+    'irrigation': 'irrigation',
+    'farm_size': 'farm size'
+}
+
+
+def invalid_category_message(label_encoders, field):
+    """Error message for a categorical value that is not in the label encoder"""
+    return f'Invalid {CATEGORICAL_LABELS[field]}. Must be one of: {", ".join(label_encoders[field])}'
+
+
+def parse_record(data, label_encoders):
+    """
+    Validate and encode one farm profile the way /predict does.
+    Returns (numerical_inputs, categorical_encoded, None), or
+    (None, None, (error_type, message)) when the profile is invalid.
+    """
+    missing_fields = [field for field in REQUIRED_FIELDS if field not in data]
+    if missing_fields:
+        return None, None, ('missing_fields', f'Missing required fields: {", ".join(missing_fields)}')
+
+    try:
+        numerical_inputs = [float(data[field]) for field in NUMERICAL_FIELDS]
+        for field in CATEGORICAL_FIELDS:
+            if data[field] not in label_encoders[field]:
+                return None, None, ('invalid_category', invalid_category_message(label_encoders, field))
+        categorical_encoded = [label_encoders[field].index(data[field]) for field in CATEGORICAL_FIELDS]
+    except (ValueError, TypeError) as e:
+        return None, None, ('invalid_value', f'Invalid input values. {str(e)}')
+
+    error = range_error(numerical_inputs)
+    if error is not None:
+        return None, None, error
+    return numerical_inputs, categorical_encoded, None
+
+
+def range_error(numerical_inputs):
+    """('out_of_range', message) for the first numerical input outside its valid range, else None"""
+    for value, (low, high, message) in zip(numerical_inputs, NUMERICAL_RANGES):
+        if not (low <= value <= high):
+            return 'out_of_range', message
+    return None
+
+
+def encode_categorical_column(label_encoders, field, values):
+    """
+    Label encode a whole column of categorical values at once.
+    Unknown values are encoded as -1.
+    """
+    classes = np.asarray(label_encoders[field])
+    order = np.argsort(classes)
+    sorted_classes = classes[order]
+    values = np.asarray([str(value) for value in values])
+    positions = np.searchsorted(sorted_classes, values).clip(0, len(classes) - 1)
+    return np.where(sorted_classes[positions] == values, order[positions], -1)
+
+
+def validate_columns(numerical_inputs, categorical_inputs, errors, label_encoders):
+    """
+    Validate and encode many records at once with the rules of parse_record.
+
+    - numerical_inputs:   (n, 7) float array of the parsed numerical fields
+    - categorical_inputs: {field: n raw values}
+    - errors:             n (error_type, message) tuples for records that already
+                          failed parsing, None for the others; filled in place
+
+    Returns the (n, 5) categorical codes (-1 where invalid) and the mask of
+    valid records.
+    """
+    num_records = len(errors)
+    parsed = np.array([error is None for error in errors], dtype=bool)
+
+    # Validate and encode categorical features column by column
+    categorical_encoded = np.full((num_records, len(CATEGORICAL_FIELDS)), -1)
+    for j, field in enumerate(CATEGORICAL_FIELDS):
+        if not parsed.any():
+            break
+        categorical_encoded[parsed, j] = encode_categorical_column(
+            label_encoders, field, [value for value, ok in zip(categorical_inputs[field], parsed) if ok])
+
+    invalid_category = parsed & (categorical_encoded < 0).any(axis=1)
+    first_invalid_category = np.argmax(categorical_encoded < 0, axis=1)
+    for i in np.flatnonzero(invalid_category):
+        errors[i] = ('invalid_category',
+                     invalid_category_message(label_encoders, CATEGORICAL_FIELDS[first_invalid_category[i]]))
+
+    # Validate ranges (NaN fails both comparisons, like the single record check)
+    out_of_range = ~((numerical_inputs >= RANGE_MIN) & (numerical_inputs <= RANGE_MAX))
+    invalid_range = parsed & ~invalid_category & out_of_range.any(axis=1)
+    first_out_of_range = np.argmax(out_of_range, axis=1)
+    for i in np.flatnonzero(invalid_range):
+        errors[i] = ('out_of_range', NUMERICAL_RANGES[first_out_of_range[i]][2])
+
+    return categorical_encoded, parsed & ~invalid_category & ~invalid_range